@@ -11,7 +11,9 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..db import get_db
+from ..drive_pool import get_drive_pool
 from ..models import User
+from ..security import JWT_SECRET
 from ..utils import create_jwt, encrypt
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
@@ -19,7 +21,6 @@ router = APIRouter(prefix="/api/auth", tags=["auth"])
 CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", "")
 REDIRECT_URI = os.getenv("OAUTH_REDIRECT_URI", "http://localhost:8000/api/auth/google/callback")
-JWT_SECRET = os.getenv("JWT_SECRET", "change-me-jwt")
 
 SCOPES = ["https://www.googleapis.com/auth/drive.file", "openid", "email", "profile"]
 
@@ -86,6 +87,9 @@ async def google_callback(request: Request, response: Response, db: AsyncSession
         if refresh_enc:
             user.refresh_token_enc = refresh_enc
     await db.commit()
+    if refresh_enc:
+        # A pooled client may still hold the previous refresh token.
+        get_drive_pool().invalidate(user.id)
 
     token = create_jwt(sub=sub, secret=JWT_SECRET)
     response.set_cookie("access_token", token, httponly=True, samesite="lax")
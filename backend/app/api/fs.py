@@ -1,39 +1,72 @@
 from __future__ import annotations
 
 import os
+import stat
 from pathlib import Path
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Query, Response, Depends
+from fastapi import APIRouter, HTTPException, Query, Request, Response, Depends
 from fastapi.responses import FileResponse
+from ..dir_listing import ListingCache, etag, run_io, validator
 from ..security import get_current_user_sub
+from ..size_index import get_size_index
 
 router = APIRouter(prefix="/api/fs", tags=["fs"])
 
+FS_TREE_PAGE_SIZE = int(os.getenv("FS_TREE_PAGE_SIZE", "1000"))
+listing_cache = ListingCache()
+
 
 @router.get("/tree")
-async def tree(path: Optional[str] = Query(default=str(Path.home())), user: str = Depends(get_current_user_sub)):
+async def tree(
+    request: Request,
+    response: Response,
+    path: Optional[str] = Query(default=str(Path.home())),
+    sort: str = Query(default="name", pattern="^(name|size|mtime)$"),
+    order: str = Query(default="asc", pattern="^(asc|desc)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(default=FS_TREE_PAGE_SIZE, ge=1, le=10000),
+    user: str = Depends(get_current_user_sub),
+):
+    # Everything touching the filesystem runs on the listing pool; a slow mount must not
+    # stall the event loop (and with it the metrics and notification sockets).
     root = os.path.abspath(path)
-    if not os.path.exists(root):
+    try:
+        st = await run_io(os.stat, root)
+    except OSError:
+        raise HTTPException(404, "Path not found")
+    if not stat.S_ISDIR(st.st_mode):
+        return {"type": "file", "name": os.path.basename(root), "size": st.st_size}
+
+    sizes = get_size_index()
+    # Directory entries carry sizes from the index, so the page changes when the index does.
+    tag = etag(validator(st), sizes.generation, root, sort, order, cursor, limit)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if tag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    try:
+        listing = await listing_cache.get(root, validator(st), sort)
+        entries, next_cursor = listing.page(sort, order == "desc", cursor, limit)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+    except PermissionError:
+        raise HTTPException(403, "Permission denied")
+    except OSError:
         raise HTTPException(404, "Path not found")
-    if os.path.isfile(root):
-        stat = os.stat(root)
-        return {"type": "file", "name": os.path.basename(root), "size": stat.st_size}
-
-    entries = []
-    with os.scandir(root) as it:
-        for entry in it:
-            try:
-                info = entry.stat()
-            except Exception:
-                continue
-            entries.append({
-                "name": entry.name,
-                "is_dir": entry.is_dir(),
-                "size": 0 if entry.is_dir() else info.st_size,
-                "mtime": info.st_mtime,
-            })
-    return {"path": root, "entries": entries}
+    response.headers.update(headers)
+    for i, e in enumerate(entries):
+        if e["is_dir"] and (known := sizes.size_of(os.path.join(root, e["name"]))):
+            entries[i] = {**e, "size": known[0], "files": known[1]}
+    return {"path": root, "entries": entries, "total": len(listing.entries), "next_cursor": next_cursor}
+
+
+@router.post("/estimate")
+async def estimate(payload: dict, user: str = Depends(get_current_user_sub)):
+    # Size of a prospective backup set, answered from the directory size index.
+    paths = payload.get("paths") or []
+    if not paths:
+        raise HTTPException(400, "paths required")
+    return await get_size_index().estimate(paths, payload.get("exclusions") or [])
 
 
 @router.get("/download")
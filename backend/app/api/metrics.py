@@ -1,72 +1,64 @@
 from __future__ import annotations
 
-import asyncio
 import os
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
-import psutil
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
 
-from ..security import get_current_user_sub
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db import get_read_db
+from ..metrics_db import MINUTE_RETENTION_DAYS, ROLLUP_RETENTION_DAYS, MetricsWriter, query_history
+from ..metrics_sampler import MetricsSampler
+from ..metrics_store import MetricsHistory, parse_duration
+from ..security import get_current_user_sub, websocket_user
 
 router = APIRouter(tags=["metrics"])
 
 INTERVAL = float(os.getenv("METRICS_INTERVAL_SECONDS", "1"))
 RETENTION_HOURS = int(os.getenv("METRICS_HISTORY_RETENTION_HOURS", "24"))
-_history: list[dict] = []
-_prev_net = None  # (ts, bytes_recv, bytes_sent)
-
-
-def _snapshot() -> dict:
-    cpu_pct = psutil.cpu_percent(interval=None)
-    per_cpu = psutil.cpu_percent(interval=None, percpu=True)
-    vm = psutil.virtual_memory()
-    du = psutil.disk_usage("/")
-    global _prev_net
-    now = datetime.now(timezone.utc)
-    n = psutil.net_io_counters()
-    rx = tx = 0
-    if _prev_net is not None:
-        prev_ts, prev_rx, prev_tx = _prev_net
-        dt = (now - prev_ts).total_seconds() or 1.0
-        rx = int((n.bytes_recv - prev_rx) / dt)
-        tx = int((n.bytes_sent - prev_tx) / dt)
-    _prev_net = (now, n.bytes_recv, n.bytes_sent)
-    return {
-        "ts": now.isoformat(),
-        "cpu": cpu_pct,
-        "per_cpu": per_cpu,
-        "ram": {"used": vm.used, "total": vm.total},
-        "disk": {"used": du.used, "total": du.total},
-        "net": {"rx": rx, "tx": tx},
-        "top": [],
-    }
+_history = MetricsHistory(raw_hours=RETENTION_HOURS, minute_days=MINUTE_RETENTION_DAYS, hour_days=ROLLUP_RETENTION_DAYS)
+# Started and stopped by the app lifespan; one sampler serves every /ws/metrics client.
+writer = MetricsWriter()
+sampler = MetricsSampler(INTERVAL, _history, writer=writer)
 
 
 @router.websocket("/ws/metrics")
 async def ws_metrics(ws: WebSocket):
     # Check JWT from cookie before accepting
-    token = ws.cookies.get("access_token")
-    from ..utils import verify_jwt
-    import os as _os
-
-    if not token or not verify_jwt(token, _os.getenv("JWT_SECRET", "change-me-jwt")):
+    if await websocket_user(ws) is None:
         await ws.close(code=4401)
         return
     await ws.accept()
+    queue = sampler.subscribe()
     try:
         while True:
-            snap = _snapshot()
-            _history.append(snap)
-            cutoff = datetime.now(timezone.utc) - timedelta(hours=RETENTION_HOURS)
-            while _history and datetime.fromisoformat(_history[0]["ts"]) < cutoff:
-                _history.pop(0)
-            await ws.send_json(snap)
-            await asyncio.sleep(INTERVAL)
+            await ws.send_text(await queue.get())
     except WebSocketDisconnect:
         return
+    finally:
+        sampler.unsubscribe(queue)
 
 
 @router.get("/api/metrics/history")
-async def metrics_history(range: str = "24h", granularity: str = "1m", user: str = Depends(get_current_user_sub)):
-    return {"points": list(_history)}
+async def metrics_history(
+    range: str = "24h",
+    granularity: str = "1m",
+    user: str = Depends(get_current_user_sub),
+    db: AsyncSession = Depends(get_read_db),
+):
+    try:
+        range_s = parse_duration(range)
+        step = parse_duration(granularity)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+    now = datetime.now(timezone.utc).timestamp()
+    points = _history.query(range_s, step, now)
+    if not _history.covers(range_s, step, now):
+        # Memory only holds what this process sampled; older history comes from the database,
+        # and the in-memory points (which include unflushed samples) win where both overlap.
+        stored = await query_history(db, range_s, step, now)
+        if points:
+            stored = [p for p in stored if p["ts"] < points[0]["ts"]]
+        points = stored + points
+    return {"range": range, "granularity": granularity, "points": points}
@@ -1,25 +1,49 @@
 from __future__ import annotations
 
 import asyncio
+
+import orjson
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
 from ..ws import notifications_manager
-from ..utils import verify_jwt
+from ..security import websocket_user
 import os
 
 router = APIRouter(tags=["notifications"])
 
+PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+
+
+def _is_ping(msg: str) -> bool:
+    if msg == "ping":
+        return True
+    try:
+        return orjson.loads(msg).get("type") == "ping"
+    except (orjson.JSONDecodeError, AttributeError):
+        return False
+
 
 @router.websocket("/ws/notifications")
 async def ws_notifications(ws: WebSocket):
-    token = ws.cookies.get("access_token")
-    if not token or not verify_jwt(token, os.getenv("JWT_SECRET", "change-me-jwt")):
+    if await websocket_user(ws) is None:
         await ws.close(code=4401)
         return
     await notifications_manager.connect(ws)
     try:
         while True:
-            # keep alive ping/pong
-            await asyncio.sleep(30)
-    except WebSocketDisconnect:
+            # Heartbeat for idle connections. Clients need not answer: a ping the writer cannot
+            # deliver within its send timeout closes the connection and drops it from the
+            # manager, and dead peers are also caught by the server's protocol-level pings.
+            try:
+                msg = await asyncio.wait_for(ws.receive_text(), PING_INTERVAL)
+            except asyncio.TimeoutError:
+                if ws not in notifications_manager.active:
+                    break
+                notifications_manager.send(ws, {"type": "ping"})
+                continue
+            if _is_ping(msg):
+                notifications_manager.send(ws, {"type": "pong"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
         await notifications_manager.disconnect(ws)
@@ -4,41 +4,160 @@ import asyncio
 import json
 from typing import Optional
 
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 
+from ..db import ReadSessionLocal
+from ..drive_pool import get_drive_pool
+from ..orchestrator import SyncOrchestrator, options_from_dict
+from ..remote_changes import refresh_remote_tree, resolve_root
+from ..remote_tree import load_snapshot
 from ..sync_engine import SyncEngine, SyncOptions
-from ..security import get_current_user_sub
+from ..security import get_current_user_id, get_current_user_sub
 
 router = APIRouter(prefix="/api", tags=["sync"])
-_engine = SyncEngine()
+# Recovered and shut down by the app lifespan; every user's backup sets run through it.
+orchestrator = SyncOrchestrator()
+PLAN_PREVIEW_LIMIT = 1000
+
+
+def _own_job(sync_id: str, user_id: int):
+    job = orchestrator.jobs.get(sync_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(404, "Sync job not found")
+    return job
 
 
 @router.post("/sync/start")
-async def sync_start(payload: dict, background: BackgroundTasks, user: str = Depends(get_current_user_sub)):
+async def sync_start(
+    payload: dict,
+    user_id: int = Depends(get_current_user_id),
+):
     mode = payload.get("mode")
     if mode not in ("oneway", "twoway"):
         raise HTTPException(400, "Invalid mode")
     paths = payload.get("paths") or []
     exclusions = payload.get("exclusions") or []
-    options = payload.get("options") or {}
-    opts = SyncOptions(keep_both_on_conflict=bool(options.get("keep_both", False)))
-
-    async def run():
-        await _engine.start(mode, paths, exclusions, opts)
-
-    background.add_task(run)
-    return {"status": "started"}
+    opts = options_from_dict(payload.get("options") or {})
+    try:
+        sync_id = await orchestrator.submit(user_id, mode, paths, exclusions, opts, sync_id=payload.get("sync_id"))
+    except ValueError as exc:
+        raise HTTPException(409, str(exc))
+    return {"status": "started", "sync_id": sync_id}
+
+
+@router.post("/sync/plan")
+async def sync_plan(
+    payload: dict,
+    user_id: int = Depends(get_current_user_id),
+):
+    # Dry run: the actions a sync would take, against the persisted remote snapshot (brought
+    # up to date from the Drive changes feed first when refresh_remote is set).
+    mode = payload.get("mode")
+    if mode not in ("oneway", "twoway"):
+        raise HTTPException(400, "Invalid mode")
+    remote_root = payload.get("remote_root")
+    remote = ()
+    if remote_root and payload.get("refresh_remote"):
+        try:
+            client = await get_drive_pool().get(user_id)
+        except LookupError:
+            raise HTTPException(409, "Google Drive is not authorized")
+        tree, _ = await refresh_remote_tree(user_id, client, remote_root)
+        remote = tree.by_id.values()
+    elif remote_root:
+        async with ReadSessionLocal() as session:
+            # Same folder the refresh branch lists: the "root" alias maps to the id it resolved to.
+            root_id = await resolve_root(session, user_id, remote_root)
+            remote = (await load_snapshot(session, user_id, root_id)).by_id.values()
+    engine = SyncEngine(hash_pool=orchestrator.hash_pool)
+    plan = await engine.plan(
+        mode,
+        payload.get("paths") or [],
+        payload.get("exclusions") or [],
+        options_from_dict(payload.get("options") or {}),
+        user_id=user_id,
+        remote=remote,
+    )
+    limit = int(payload.get("limit") or PLAN_PREVIEW_LIMIT)
+    return {"mode": mode, "errors": engine.status()["errors"], **plan.to_dict(limit)}
 
 
 @router.post("/sync/stop")
-async def sync_stop(user: str = Depends(get_current_user_sub)):
-    _engine.stop()
-    return {"status": "stopping"}
+async def sync_stop(
+    payload: Optional[dict] = None,
+    user_id: int = Depends(get_current_user_id),
+):
+    sync_id = (payload or {}).get("sync_id")
+    if sync_id:
+        _own_job(sync_id, user_id)
+        ids = [sync_id]
+    else:
+        ids = [j.sync_id for j in orchestrator.running(user_id)]
+    for i in ids:
+        orchestrator.stop(i)
+    return {"status": "stopping", "sync_ids": ids}
+
+
+@router.post("/sync/resume")
+async def sync_resume(
+    payload: dict,
+    user_id: int = Depends(get_current_user_id),
+):
+    sync_id = payload.get("sync_id")
+    if not sync_id:
+        raise HTTPException(400, "sync_id required")
+    try:
+        await orchestrator.resume(sync_id, user_id)
+    except LookupError:
+        raise HTTPException(404, "Sync job not found")
+    except ValueError as exc:
+        raise HTTPException(409, str(exc))
+    return {"status": "resumed", "sync_id": sync_id}
 
 
 @router.get("/sync/status")
-async def sync_status(user: str = Depends(get_current_user_sub)):
-    return _engine.status()
+async def sync_status(
+    sync_id: Optional[str] = None,
+    user_id: int = Depends(get_current_user_id),
+):
+    if sync_id:
+        snapshot = await orchestrator.job_status(sync_id, user_id)
+        if snapshot is None:
+            raise HTTPException(404, "Sync job not found")
+        return snapshot
+    jobs = [j.snapshot() for j in orchestrator.running(user_id)]
+    return {"running": bool(jobs), "jobs": jobs}
+
+
+@router.get("/sync/jobs")
+async def sync_jobs(user_id: int = Depends(get_current_user_id)):
+    return {"jobs": await orchestrator.list_jobs(user_id)}
+
+
+@router.post("/sync/watch")
+async def sync_watch(payload: dict, user_id: int = Depends(get_current_user_id)):
+    # Continuous sync of a configured job: filesystem events instead of repeated full walks.
+    sync_id = payload.get("sync_id")
+    if not sync_id:
+        raise HTTPException(400, "sync_id required")
+    if payload.get("enabled", True):
+        try:
+            await orchestrator.watch(sync_id, user_id)
+        except LookupError:
+            raise HTTPException(404, "Sync job not found")
+        except ValueError as exc:
+            raise HTTPException(409, str(exc))
+    else:
+        live = orchestrator.watches.get(sync_id)
+        if live is None or live.user_id != user_id:
+            raise HTTPException(404, "Sync job is not watched")
+        await orchestrator.unwatch(sync_id)
+    return {"sync_id": sync_id, "watching": sync_id in orchestrator.watches}
+
+
+@router.get("/sync/watch")
+async def sync_watches(user_id: int = Depends(get_current_user_id)):
+    return {"watches": {i: w.status() for i, w in orchestrator.watches.items() if w.user_id == user_id}}
 
 
 @router.get("/files/list")
@@ -48,9 +167,9 @@ async def files_list(user: str = Depends(get_current_user_sub)):
 
 
 @router.post("/sync/force")
-async def sync_force(user: str = Depends(get_current_user_sub)):
+async def sync_force(user_id: int = Depends(get_current_user_id)):
     # Placeholder to trigger full reconciliation
-    if _engine.status().get("running"):
+    if orchestrator.running(user_id):
         raise HTTPException(400, "Sync already running")
-    await _engine.start("oneway", [], [], SyncOptions())
-    return {"status": "forced"}
+    sync_id = await orchestrator.submit(user_id, "oneway", [], [], SyncOptions())
+    return {"status": "forced", "sync_id": sync_id}
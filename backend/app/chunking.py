@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+from dataclasses import dataclass
+from typing import Iterator, Optional, Protocol, Sequence
+
+from googleapiclient.errors import HttpError
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Chunk, ChunkManifest
+from .pipeline import bounded_map
+from .utils import utcnow
+
+CHUNK_AVG_SIZE = int(os.getenv("CHUNK_AVG_SIZE", str(1024 * 1024)))
+CHUNK_UPLOAD_CONCURRENCY = int(os.getenv("CHUNK_UPLOAD_CONCURRENCY", "4"))
+CHUNK_RECORD_BATCH = 64
+# Where chunked backups keep their data, relative to the backup's remote root.
+CHUNKS_FOLDER = ".onyx/chunks"
+MANIFESTS_FOLDER = ".onyx/manifests"
+
+# Fixed seed so chunk boundaries are stable across runs and machines.
+_rng = random.Random(0x0C0FFEE)
+_GEAR = tuple(_rng.getrandbits(32) for _ in range(256))
+del _rng
+
+
+def _top_bits(k: int) -> int:
+    # The high bits of a shift-left gear hash depend on the most bytes of the window.
+    return ((1 << k) - 1) << (32 - k)
+
+
+@dataclass(frozen=True)
+class ChunkParams:
+    min_size: int
+    avg_size: int
+    max_size: int
+
+    @classmethod
+    def for_average(cls, avg: int) -> "ChunkParams":
+        return cls(avg // 4, avg, avg * 4)
+
+    @property
+    def masks(self) -> tuple[int, int]:
+        # Normalized chunking (FastCDC): harder to cut before the average size, easier after.
+        bits = max(1, self.avg_size.bit_length() - 1)
+        return _top_bits(bits + 2), _top_bits(max(1, bits - 2))
+
+
+DEFAULT_PARAMS = ChunkParams.for_average(CHUNK_AVG_SIZE)
+
+
+@dataclass(frozen=True)
+class ChunkRef:
+    hash: str
+    offset: int
+    length: int
+
+
+def find_cut(data: bytes, pos: int, end: int, params: ChunkParams = DEFAULT_PARAMS) -> int:
+    n = end - pos
+    if n <= params.min_size:
+        return n
+    limit = min(n, params.max_size)
+    normal = min(limit, params.avg_size)
+    mask_s, mask_l = params.masks
+    gear = _GEAR
+    h = 0
+    i = pos + params.min_size
+    stop = pos + normal
+    while i < stop:
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+        if not h & mask_s:
+            return i - pos + 1
+        i += 1
+    stop = pos + limit
+    while i < stop:
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+        if not h & mask_l:
+            return i - pos + 1
+        i += 1
+    return limit
+
+
+def iter_chunks(path: str, previous: Sequence[ChunkRef] = (), params: ChunkParams = DEFAULT_PARAMS) -> Iterator[ChunkRef]:
+    """Split a file into content-defined chunks.
+
+    The rolling hash runs in Python, so regions that still match the previous manifest are
+    recognised by hashing the expected next chunk directly; the gear scan only runs around
+    edits until a chunk lines up with the old manifest again.
+    """
+    prev_index = {c.hash: i for i, c in enumerate(previous)}
+    read_size = max(params.max_size * 4, 16 * 1024 * 1024)
+    expect: Optional[int] = 0 if previous else None
+    with open(path, "rb") as f:
+        buf = b""
+        base = 0
+        pos = 0
+        eof = False
+        while True:
+            if len(buf) - pos < params.max_size and not eof:
+                more = f.read(read_size)
+                eof = not more
+                buf = buf[pos:] + more
+                base += pos
+                pos = 0
+                continue
+            if pos >= len(buf):
+                return
+            n = 0
+            digest = ""
+            if expect is not None and expect < len(previous):
+                cand = previous[expect]
+                if pos + cand.length <= len(buf):
+                    h = hashlib.sha256(memoryview(buf)[pos : pos + cand.length]).hexdigest()
+                    if h == cand.hash:
+                        n, digest = cand.length, h
+            if not n:
+                n = find_cut(buf, pos, len(buf), params)
+                digest = hashlib.sha256(memoryview(buf)[pos : pos + n]).hexdigest()
+            yield ChunkRef(digest, base + pos, n)
+            k = prev_index.get(digest)
+            expect = k + 1 if k is not None else None
+            pos += n
+
+
+def read_chunk(path: str, ref: ChunkRef) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(ref.offset)
+        return f.read(ref.length)
+
+
+def encode_manifest(name: str, size: int, chunks: Sequence[ChunkRef]) -> bytes:
+    return json.dumps({"version": 1, "name": name, "size": size, "chunks": [[c.hash, c.length] for c in chunks]}).encode("utf-8")
+
+
+def decode_manifest(data: bytes | str) -> list[ChunkRef]:
+    doc = json.loads(data)
+    refs: list[ChunkRef] = []
+    offset = 0
+    for digest, length in doc["chunks"]:
+        refs.append(ChunkRef(digest, offset, length))
+        offset += length
+    return refs
+
+
+class ChunkTarget(Protocol):
+    def put_chunk(self, digest: str, data: bytes) -> str: ...
+
+    def put_manifest(self, name: str, data: bytes, remote_id: Optional[str] = None) -> str: ...
+
+    def get_chunk(self, remote_id: str) -> bytes: ...
+
+
+class DriveChunkTarget:
+    def __init__(self, client, chunks_folder_id: str, manifests_folder_id: str):
+        self.client = client
+        self.chunks_folder_id = chunks_folder_id
+        self.manifests_folder_id = manifests_folder_id
+
+    def put_chunk(self, digest: str, data: bytes) -> str:
+        return self.client.upload_bytes(data, self.chunks_folder_id, digest)["id"]
+
+    def put_manifest(self, name: str, data: bytes, remote_id: Optional[str] = None) -> str:
+        # The previous manifest of the same file is overwritten in place, keeping its id.
+        safe = hashlib.sha256(name.encode("utf-8")).hexdigest() + ".json"
+        try:
+            return self.client.upload_bytes(
+                data, self.manifests_folder_id, safe, mimetype="application/json", file_id=remote_id
+            )["id"]
+        except HttpError as exc:
+            if not remote_id or exc.resp.status != 404:
+                raise
+        # Deleted remotely since it was recorded: store a new one.
+        return self.client.upload_bytes(data, self.manifests_folder_id, safe, mimetype="application/json")["id"]
+
+    def get_chunk(self, remote_id: str) -> bytes:
+        return self.client.download_bytes(remote_id)
+
+
+def _insert(session: AsyncSession):
+    return postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+
+class ChunkStore:
+    """Per-user index of chunks already stored remotely, keyed by SHA-256.
+
+    Every call opens its own short session, so no connection is held while chunks upload.
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+
+    async def known(self, hashes: set[str]) -> dict[str, str]:
+        from .db import ReadSessionLocal
+
+        found: dict[str, str] = {}
+        items = list(hashes)
+        async with ReadSessionLocal() as session:
+            for i in range(0, len(items), 500):
+                result = await session.execute(
+                    select(Chunk.hash, Chunk.remote_id).where(Chunk.user_id == self.user_id, Chunk.hash.in_(items[i : i + 500]))
+                )
+                found.update({h: rid for h, rid in result})
+        return found
+
+    async def add(self, records: Sequence[tuple[str, int, str]]) -> None:
+        from .db import AsyncSessionLocal
+
+        if not records:
+            return
+        async with AsyncSessionLocal() as session:
+            # Backups running side by side can upload the same chunk; the first row recorded wins.
+            stmt = _insert(session)(Chunk).on_conflict_do_nothing(index_elements=[Chunk.user_id, Chunk.hash])
+            await session.execute(
+                stmt, [{"user_id": self.user_id, "hash": h, "size": size, "remote_id": rid} for h, size, rid in records]
+            )
+            await session.commit()
+
+    async def manifest(self, name: str) -> Optional[ChunkManifest]:
+        from .db import ReadSessionLocal
+
+        async with ReadSessionLocal() as session:
+            result = await session.execute(
+                select(ChunkManifest).where(ChunkManifest.user_id == self.user_id, ChunkManifest.path == name)
+            )
+            return result.scalar_one_or_none()
+
+    async def save_manifest(self, name: str, size: int, data: bytes, remote_id: str) -> None:
+        from .db import AsyncSessionLocal
+
+        values = {"size": size, "manifest": data.decode("utf-8"), "remote_id": remote_id, "updated_at": utcnow()}
+        async with AsyncSessionLocal() as session:
+            stmt = _insert(session)(ChunkManifest).values(user_id=self.user_id, path=name, **values)
+            await session.execute(
+                stmt.on_conflict_do_update(index_elements=[ChunkManifest.user_id, ChunkManifest.path], set_=values)
+            )
+            await session.commit()
+
+
+@dataclass
+class ChunkedBackupResult:
+    chunks: int
+    new_chunks: int
+    bytes_total: int
+    bytes_uploaded: int
+    manifest_id: str
+
+
+async def backup_file(
+    store: ChunkStore, target: ChunkTarget, path: str, name: str, params: ChunkParams = DEFAULT_PARAMS
+) -> ChunkedBackupResult:
+    prev_row = await store.manifest(name)
+    previous = decode_manifest(prev_row.manifest) if prev_row is not None else []
+    refs = await asyncio.to_thread(lambda: list(iter_chunks(path, previous, params)))
+    known = await store.known({r.hash for r in refs})
+
+    missing: dict[str, ChunkRef] = {}
+    for r in refs:
+        if r.hash not in known:
+            missing.setdefault(r.hash, r)
+
+    def upload(ref: ChunkRef) -> str:
+        return target.put_chunk(ref.hash, read_chunk(path, ref))
+
+    # Recorded a batch at a time as uploads land, so an interrupted backup keeps what it sent.
+    records: list[tuple[str, int, str]] = []
+    try:
+        async for ref, remote_id, exc in bounded_map(
+            missing.values(), lambda r: asyncio.to_thread(upload, r), CHUNK_UPLOAD_CONCURRENCY
+        ):
+            if exc is not None:
+                raise exc
+            records.append((ref.hash, ref.length, remote_id))
+            if len(records) >= CHUNK_RECORD_BATCH:
+                await store.add(records)
+                records = []
+    finally:
+        await store.add(records)
+
+    size = sum(r.length for r in refs)
+    data = encode_manifest(name, size, refs)
+    manifest_id = await asyncio.to_thread(
+        target.put_manifest, name, data, prev_row.remote_id if prev_row is not None else None
+    )
+    await store.save_manifest(name, size, data, manifest_id)
+    return ChunkedBackupResult(len(refs), len(missing), size, sum(r.length for r in missing.values()), manifest_id)
+
+
+async def restore_file(store: ChunkStore, target: ChunkTarget, name: str, dest_path: str) -> int:
+    row = await store.manifest(name)
+    if row is None:
+        raise FileNotFoundError(name)
+    refs = decode_manifest(row.manifest)
+    remote = await store.known({r.hash for r in refs})
+
+    def write() -> int:
+        with open(dest_path, "wb") as out:
+            for r in refs:
+                data = target.get_chunk(remote[r.hash])
+                if hashlib.sha256(data).hexdigest() != r.hash:
+                    raise ValueError(f"Chunk {r.hash} failed verification")
+                out.write(data)
+            return out.tell()
+
+    return await asyncio.to_thread(write)
@@ -1,24 +1,107 @@
 import os
 from contextlib import asynccontextmanager
+from pathlib import Path
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./app.db")
 
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+# Storage profile applied to every SQLite connection; SQLITE_PROFILE=default keeps SQLite's own settings.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+# Schema the app created with create_all before it had migrations.
+BASELINE_REVISION = "0001"
+
+
+def sqlite_pragmas(read_only: bool = False) -> list[str]:
+    pragmas = [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        # Negative cache_size is in KiB rather than pages.
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+    return pragmas
+
+
+def _apply_pragmas(engine: AsyncEngine, pragmas: list[str]) -> None:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def make_engines(url: str, profile: str = SQLITE_PROFILE) -> tuple[AsyncEngine, AsyncEngine]:
+    """Return (writer, reader) engines for a database URL.
+
+    SQLite allows one writer at a time, so writes go through a single pooled connection and
+    queue in the pool instead of failing with "database is locked"; in WAL mode reads run on
+    their own pool concurrently with that writer.
+    """
+    if not url.startswith("sqlite") or ":memory:" in url or profile != "tuned":
+        engine = create_async_engine(url, echo=False, future=True)
+        return engine, engine
+    writer = create_async_engine(url, echo=False, future=True, poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0)
+    reader = create_async_engine(
+        url, echo=False, future=True, poolclass=AsyncAdaptedQueuePool, pool_size=DB_READ_POOL_SIZE, max_overflow=0
+    )
+    _apply_pragmas(writer, sqlite_pragmas())
+    _apply_pragmas(reader, sqlite_pragmas(read_only=True))
+    return writer, reader
+
+
+engine, read_engine = make_engines(DATABASE_URL)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
 Base = declarative_base()
 
 
+def migrate(connection) -> None:
+    """Bring the database to the latest Alembic revision (sync; use with ``run_sync``)."""
+    from alembic import command
+    from alembic.config import Config
+
+    cfg = Config()
+    cfg.set_main_option("script_location", str(MIGRATIONS_DIR))
+    cfg.attributes["connection"] = connection
+    tables = inspect(connection).get_table_names()
+    if "alembic_version" not in tables and "users" in tables:
+        command.stamp(cfg, BASELINE_REVISION)
+    command.upgrade(cfg, "head")
+
+
 @asynccontextmanager
 async def lifespan(app):
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate)
     yield
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
         yield session
+
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    async with ReadSessionLocal() as session:
+        yield session
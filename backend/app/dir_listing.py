@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import os
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, TypeVar
+
+import orjson
+
+FS_LIST_WORKERS = int(os.getenv("FS_LIST_WORKERS", "4"))
+FS_TREE_CACHE_SIZE = int(os.getenv("FS_TREE_CACHE_SIZE", "32"))
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def run_io(fn: Callable[..., T], *args: Any) -> T:
+    # Own small pool so a hung network mount cannot use up the default executor.
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max(1, FS_LIST_WORKERS), thread_name_prefix="fs-list")
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+def validator(st: os.stat_result) -> str:
+    # A directory's mtime moves when entries are added, removed or renamed; it does not move
+    # when a child file is rewritten in place, so sizes in a cached listing can lag until then.
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def scan(root: str) -> list[dict]:
+    entries = []
+    with os.scandir(root) as it:
+        for entry in it:
+            try:
+                info = entry.stat()
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            entries.append({
+                "name": entry.name,
+                "is_dir": is_dir,
+                "size": 0 if is_dir else info.st_size,
+                "mtime": info.st_mtime,
+            })
+    return entries
+
+
+def _sort_value(entry: dict, sort: str):
+    return entry["name"].casefold() if sort == "name" else entry[sort]
+
+
+@dataclass
+class Listing:
+    """One scan of a directory plus its sorted views, built on first use per sort key.
+
+    A view is two segments, directories then files, each ascending by (value, name).
+    Descending order walks each segment backwards, so directories stay first either way.
+    """
+
+    validator: str
+    entries: list[dict]
+    _views: dict[str, tuple] = field(default_factory=dict, repr=False)
+
+    def _view(self, sort: str) -> tuple:
+        view = self._views.get(sort)
+        if view is None:
+            segments = []
+            for is_dir in (True, False):
+                part = [e for e in self.entries if e["is_dir"] is is_dir]
+                part.sort(key=lambda e: (_sort_value(e, sort), e["name"]))
+                segments.append(([(_sort_value(e, sort), e["name"]) for e in part], part))
+            view = self._views[sort] = tuple(segments)
+        return view
+
+    def page(self, sort: str, descending: bool, cursor: Optional[str], limit: int) -> tuple[list[dict], Optional[str]]:
+        """Up to ``limit`` entries after ``cursor``, and the cursor for the next page.
+
+        The cursor names the last entry returned rather than an offset, so paging stays
+        consistent when entries are added or removed between requests.
+        """
+        view = self._view(sort)
+        seg, pos = 0, 0
+        if cursor:
+            seg, value, name = decode_cursor(cursor)
+            keys = view[seg][0]
+            key = (value, name)
+            try:
+                pos = len(keys) - bisect_left(keys, key) if descending else bisect_right(keys, key)
+            except TypeError:
+                raise ValueError("Cursor does not match sort")
+        out: list[dict] = []
+        last: Optional[tuple] = None
+        while seg < 2 and len(out) < limit:
+            keys, items = view[seg]
+            take = min(limit - len(out), len(items) - pos)
+            if take > 0:
+                if descending:
+                    hi = len(items) - pos
+                    chunk = range(hi - 1, hi - 1 - take, -1)
+                else:
+                    chunk = range(pos, pos + take)
+                out.extend(items[i] for i in chunk)
+                last = (seg, *keys[chunk[-1]])
+                pos += take
+            if pos >= len(items):
+                seg, pos = seg + 1, 0
+        more = seg < 2 and any(len(view[s][1]) > (pos if s == seg else 0) for s in range(seg, 2))
+        return out, (encode_cursor(last) if more and last else None)
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(list(key))).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[int, Any, str]:
+    try:
+        seg, value, name = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if seg not in (0, 1) or not isinstance(name, str):
+        raise ValueError("Invalid cursor")
+    return seg, value, name
+
+
+def etag(dir_validator: str, *query: Any) -> str:
+    digest = hashlib.blake2b(orjson.dumps([dir_validator, *query]), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+class ListingCache:
+    """LRU of directory listings keyed by absolute path, valid while the validator matches."""
+
+    def __init__(self, size: int = FS_TREE_CACHE_SIZE):
+        self.size = max(1, size)
+        self._entries: OrderedDict[str, Listing] = OrderedDict()
+
+    async def get(self, root: str, dir_validator: str, sort: str = "name") -> Listing:
+        listing = self._entries.get(root)
+        if listing is None or listing.validator != dir_validator:
+            listing = Listing(dir_validator, await run_io(scan, root))
+            self._entries[root] = listing
+        if sort not in listing._views:
+            # Sorting a few hundred thousand entries is too long to hold the loop for.
+            await run_io(listing._view, sort)
+        self._entries.move_to_end(root)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return listing
+
+    def __len__(self) -> int:
+        return len(self._entries)
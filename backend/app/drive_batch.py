@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Any, Callable, Hashable, Iterable, Optional, TypeVar
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from .google_drive import FOLDER_MIME, GoogleDriveClient, folder_query, is_retryable
+
+# Drive rejects batch requests with more than 100 calls.
+DRIVE_BATCH_SIZE = max(1, min(100, int(os.getenv("DRIVE_BATCH_SIZE", "100"))))
+
+K = TypeVar("K", bound=Hashable)
+Result = tuple[Optional[Any], Optional[Exception]]
+
+
+class DriveBatch:
+    """Runs many small metadata calls as Drive batch requests, ``size`` calls per round trip.
+
+    Every call gets its own (response, error) result. Calls failing with a retryable error
+    (429, 5xx, rate-limit 403), or whose whole batch failed in transit, go into the next
+    batch after a jittered backoff; other errors are returned as they are. A retried call
+    may already have run, so calls must be safe to repeat: creates need a generated id.
+    """
+
+    def __init__(
+        self,
+        client: GoogleDriveClient,
+        size: int = DRIVE_BATCH_SIZE,
+        retries: Optional[int] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.client = client
+        self.size = max(1, min(100, size))
+        self.retries = client.retries if retries is None else retries
+        self.sleep = sleep
+
+    def execute(self, calls: dict[K, Callable[[], HttpRequest]]) -> dict[K, Result]:
+        results: dict[K, Result] = {}
+        pending = list(calls.items())
+        attempt = 0
+        while pending:
+            retry: list[tuple[K, Callable[[], HttpRequest]]] = []
+            for i in range(0, len(pending), self.size):
+                chunk = pending[i : i + self.size]
+                outcome: dict[str, Result] = {}
+                batch = self.client.new_batch(lambda rid, resp, exc: outcome.__setitem__(rid, (resp, exc)))
+                for n, (_, make) in enumerate(chunk):
+                    batch.add(self.client.prepare(make()), request_id=str(n))
+                try:
+                    batch.execute()
+                except Exception as exc:
+                    outcome = {str(n): (None, exc) for n in range(len(chunk))}
+                for n, call in enumerate(chunk):
+                    resp, exc = outcome.get(str(n), (None, RuntimeError("missing from batch response")))
+                    if exc is not None and attempt < self.retries and is_retryable(exc):
+                        retry.append(call)
+                    else:
+                        results[call[0]] = (resp, exc)
+            if retry:
+                self.sleep(random.uniform(0, min(32.0, 2.0**attempt)))
+                attempt += 1
+            pending = retry
+        return results
+
+    def delete(self, file_ids: Iterable[str]) -> dict[str, Optional[Exception]]:
+        files = self.client.service.files()
+        out = self.execute({fid: (lambda fid=fid: files.delete(fileId=fid)) for fid in file_ids})
+        for fid, (_, exc) in out.items():
+            if exc is None:
+                self.client.folders.invalidate(fid)
+        return {fid: exc for fid, (_, exc) in out.items()}
+
+    def update(self, changes: dict[str, dict], fields: str = "id,name,parents") -> dict[str, Result]:
+        """Patch metadata by file id; renames and moves are a ``name`` and ``addParents``/``removeParents``."""
+        files = self.client.service.files()
+
+        def call(fid: str, change: dict) -> Callable[[], HttpRequest]:
+            body = {k: v for k, v in change.items() if k not in ("addParents", "removeParents")}
+            params = {k: change[k] for k in ("addParents", "removeParents") if change.get(k)}
+            return lambda: files.update(fileId=fid, body=body, fields=fields, **params)
+
+        out = self.execute({fid: call(fid, change) for fid, change in changes.items()})
+        for fid in changes:
+            self.client.folders.invalidate(fid)
+        return out
+
+    def ensure_folders(self, paths: Iterable[str], root_id: str) -> dict[str, str]:
+        """Make sure every folder in ``paths`` (relative to ``root_id``) exists; returns path -> id.
+
+        Goes breadth-first so each level is one batched lookup of the folders the cache does
+        not know, then one batched create of those that are missing. Children of folders
+        created here cannot exist yet, so they skip the lookup.
+        """
+        levels: dict[int, set[str]] = defaultdict(set)
+        for p in paths:
+            parts = [x for x in p.replace("\\", "/").split("/") if x]
+            for i in range(1, len(parts) + 1):
+                levels[i].add("/".join(parts[:i]))
+        ids = {"": root_id}
+        created: set[str] = set()
+        files = self.client.service.files()
+        for depth in sorted(levels):
+            unknown: dict[str, tuple[str, str]] = {}
+            missing: dict[str, tuple[str, str]] = {}
+            for path in sorted(levels[depth]):
+                parent, _, name = path.rpartition("/")
+                parent_id = ids[parent]
+                cached = self.client.folders.get(parent_id, name)
+                if cached:
+                    ids[path] = cached
+                elif parent in created:
+                    missing[path] = (parent_id, name)
+                else:
+                    unknown[path] = (parent_id, name)
+
+            found = self.execute(
+                {
+                    path: (
+                        lambda pid=pid, name=name: files.list(
+                            q=folder_query(name, pid), spaces="drive", fields="files(id)", pageSize=1
+                        )
+                    )
+                    for path, (pid, name) in unknown.items()
+                }
+            )
+            for path, (resp, exc) in found.items():
+                if exc is not None:
+                    raise exc
+                hits = (resp or {}).get("files") or []
+                if hits:
+                    ids[path] = hits[0]["id"]
+                    self.client.folders.put(unknown[path][0], unknown[path][1], ids[path])
+                else:
+                    missing[path] = unknown[path]
+
+            # Creates carry pre-generated ids so a retried one cannot leave a duplicate folder:
+            # a 409 means an earlier attempt went through and only its response was lost.
+            new_ids = dict(zip(missing, self.client.generate_ids(len(missing)))) if missing else {}
+            made = self.execute(
+                {
+                    path: (
+                        lambda pid=pid, name=name, fid=new_ids[path]: files.create(
+                            body={"id": fid, "name": name, "mimeType": FOLDER_MIME, "parents": [pid]}, fields="id"
+                        )
+                    )
+                    for path, (pid, name) in missing.items()
+                }
+            )
+            for path, (_, exc) in made.items():
+                if exc is not None and not (isinstance(exc, HttpError) and exc.resp.status == 409):
+                    raise exc
+                ids[path] = new_ids[path]
+                created.add(path)
+                self.client.folders.put(missing[path][0], missing[path][1], ids[path])
+        del ids[""]
+        return ids
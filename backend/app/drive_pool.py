@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from google.auth.transport.requests import Request
+from loguru import logger
+from sqlalchemy import select
+
+from .google_drive import GoogleDriveClient
+from .models import User
+from .utils import decrypt
+
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", "")
+MASTER_KEY = os.getenv("MASTER_KEY", "change-me-strong")
+DRIVE_POOL_SIZE = int(os.getenv("DRIVE_POOL_SIZE", "64"))
+DRIVE_POOL_IDLE_SECONDS = float(os.getenv("DRIVE_POOL_IDLE_SECONDS", "900"))
+DRIVE_TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("DRIVE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+DRIVE_POOL_SWEEP_SECONDS = 60.0
+
+ClientFactory = Callable[[int], Awaitable[GoogleDriveClient]]
+
+
+async def client_for_user(user_id: int) -> GoogleDriveClient:
+    from .db import ReadSessionLocal
+
+    async with ReadSessionLocal() as session:
+        result = await session.execute(select(User.refresh_token_enc).where(User.id == user_id))
+        refresh_enc = result.scalar_one_or_none()
+    if not refresh_enc:
+        raise LookupError(f"No Drive authorization for user {user_id}")
+    refresh_token = decrypt(refresh_enc, MASTER_KEY)
+    # No access token yet: the pool refreshes it before handing the client out.
+    return GoogleDriveClient.from_tokens(None, refresh_token, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET)
+
+
+def _refresh(client: GoogleDriveClient) -> None:
+    client.creds.refresh(Request())
+
+
+@dataclass
+class _Pooled:
+    client: GoogleDriveClient
+    last_used: float
+
+
+class DriveClientPool:
+    """LRU of ready GoogleDriveClient instances keyed by user id.
+
+    Building a client means a database read, a token decrypt and a token refresh, so the
+    client is kept for later jobs. Access tokens are refreshed ahead of expiry, both on checkout
+    and from the background sweep. Clients idle longer than ``idle_seconds`` are dropped.
+    """
+
+    def __init__(
+        self,
+        factory: ClientFactory = client_for_user,
+        size: int = DRIVE_POOL_SIZE,
+        idle_seconds: float = DRIVE_POOL_IDLE_SECONDS,
+        refresh_margin: float = DRIVE_TOKEN_REFRESH_MARGIN_SECONDS,
+        refresh: Callable[[GoogleDriveClient], None] = _refresh,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.factory = factory
+        self.size = max(1, size)
+        self.idle_seconds = idle_seconds
+        self.refresh_margin = refresh_margin
+        self.refresh = refresh
+        self.clock = clock
+        self._clients: OrderedDict[int, _Pooled] = OrderedDict()
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, user_id: int) -> GoogleDriveClient:
+        # Per-user lock: concurrent job starts for one user build and refresh the client once.
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            pooled = self._clients.get(user_id)
+            if pooled is None:
+                pooled = _Pooled(await self.factory(user_id), self.clock())
+                self._clients[user_id] = pooled
+                self._evict_lru()
+            self._clients.move_to_end(user_id)
+            pooled.last_used = self.clock()
+            if self._needs_refresh(pooled.client):
+                await asyncio.to_thread(self.refresh, pooled.client)
+            return pooled.client
+
+    def invalidate(self, user_id: int) -> None:
+        # E.g. after the user re-authorized and the stored refresh token changed.
+        self._clients.pop(user_id, None)
+        self._drop_lock(user_id)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def _needs_refresh(self, client: GoogleDriveClient) -> bool:
+        creds = client.creds
+        if not getattr(creds, "refresh_token", None):
+            return False
+        if not creds.token:
+            return True
+        expiry = getattr(creds, "expiry", None)
+        if expiry is None:
+            return False
+        # google-auth keeps expiry as naive UTC.
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return expiry - timedelta(seconds=self.refresh_margin) <= now
+
+    def _evict_lru(self) -> None:
+        while len(self._clients) > self.size:
+            user_id, _ = self._clients.popitem(last=False)
+            self._drop_lock(user_id)
+
+    def _drop_lock(self, user_id: int) -> None:
+        lock = self._locks.get(user_id)
+        if lock is not None and not lock.locked():
+            del self._locks[user_id]
+
+    async def sweep(self) -> None:
+        now = self.clock()
+        for user_id, pooled in list(self._clients.items()):
+            if now - pooled.last_used > self.idle_seconds:
+                del self._clients[user_id]
+                self._drop_lock(user_id)
+            elif self._needs_refresh(pooled.client):
+                try:
+                    async with self._locks.setdefault(user_id, asyncio.Lock()):
+                        await asyncio.to_thread(self.refresh, pooled.client)
+                except Exception as exc:
+                    # Leave it to the next checkout, which surfaces the error to the caller.
+                    logger.warning(f"drive token refresh for user {user_id} failed: {exc}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(DRIVE_POOL_SWEEP_SECONDS)
+            await self.sweep()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="drive-pool")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._clients.clear()
+        self._locks.clear()
+
+
+_pool: Optional[DriveClientPool] = None
+
+
+def get_drive_pool() -> DriveClientPool:
+    global _pool
+    if _pool is None:
+        _pool = DriveClientPool()
+    return _pool
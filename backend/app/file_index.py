@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Optional, Sequence
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import FileIndex
+from .walker import FileEntry
+
+INDEX_WRITE_CHUNK = int(os.getenv("INDEX_WRITE_CHUNK", "10000"))
+
+_table = FileIndex.__table__
+_COLUMNS = (
+    FileIndex.path,
+    FileIndex.size,
+    FileIndex.mtime,
+    FileIndex.inode,
+    FileIndex.sha256,
+    FileIndex.remote_id,
+    FileIndex.remote_etag,
+    FileIndex.synced_sha256,
+    FileIndex.id,
+)
+# What a local scan knows about a file. The remote columns describe the last completed
+# transfer and are only written together with it, so a scan can never make a file look synced.
+_SCANNED = ("size", "mtime", "inode", "sha256")
+_SYNCED = (*_SCANNED, "remote_id", "remote_etag", "synced_sha256")
+
+
+@dataclass(slots=True)
+class IndexEntry:
+    path: str
+    size: Optional[int] = None
+    mtime: Optional[float] = None
+    inode: Optional[int] = None
+    sha256: Optional[str] = None
+    remote_id: Optional[str] = None
+    remote_etag: Optional[str] = None
+    synced_sha256: Optional[str] = None
+    id: Optional[int] = None
+
+    def unchanged(self, f: FileEntry) -> bool:
+        return self.size == f.size and self.mtime == f.mtime and self.inode == f.inode
+
+    def refresh(self, f: FileEntry) -> None:
+        self.size = f.size
+        self.mtime = f.mtime
+        self.inode = f.inode
+
+
+class FileIndexRepository:
+    """Set-based reads and writes of one user's FileIndex rows."""
+
+    def __init__(self, session: AsyncSession, user_id: int, chunk_size: int = INDEX_WRITE_CHUNK):
+        self.session = session
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+
+    def _upsert_sql(self, columns: tuple[str, ...]) -> tuple[str, tuple[str, ...]]:
+        dialect = self.session.get_bind().dialect
+        insert = postgresql.insert if dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(_table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[_table.c.user_id, _table.c.path],
+            set_={c: stmt.excluded[c] for c in columns},
+        )
+        # Compiled once and run as a plain DBAPI executemany: per-row parameter processing in
+        # the ORM costs more than the upsert itself at a million rows.
+        compiled = stmt.compile(dialect=dialect, column_keys=["user_id", "path", *columns])
+        return str(compiled), tuple(compiled.positiontup)
+
+    def _params(self, e: IndexEntry) -> dict:
+        return {
+            "user_id": self.user_id,
+            "path": e.path,
+            "size": e.size,
+            "mtime": e.mtime,
+            "inode": e.inode,
+            "sha256": e.sha256,
+            "remote_id": e.remote_id,
+            "remote_etag": e.remote_etag,
+            "synced_sha256": e.synced_sha256,
+        }
+
+    async def stream(self) -> AsyncIterator[IndexEntry]:
+        # Server-side cursor: rows arrive chunk_size at a time instead of being buffered up front.
+        result = await self.session.stream(
+            select(*_COLUMNS).where(FileIndex.user_id == self.user_id).execution_options(yield_per=self.chunk_size)
+        )
+        async for rows in result.partitions():
+            for row in rows:
+                yield IndexEntry(*row)
+
+    async def load(self) -> dict[str, IndexEntry]:
+        return {e.path: e async for e in self.stream()}
+
+    async def get(self, paths: Sequence[str]) -> dict[str, IndexEntry]:
+        found: dict[str, IndexEntry] = {}
+        for i in range(0, len(paths), 500):
+            result = await self.session.execute(
+                select(*_COLUMNS).where(FileIndex.user_id == self.user_id, FileIndex.path.in_(paths[i : i + 500]))
+            )
+            found.update((row[0], IndexEntry(*row)) for row in result)
+        return found
+
+    async def under(self, dirs: Sequence[str]) -> dict[str, IndexEntry]:
+        # Range scan over the (user_id, path) unique index rather than a LIKE, which SQLite
+        # cannot serve from it.
+        found: dict[str, IndexEntry] = {}
+        for d in dirs:
+            prefix = d.rstrip(os.sep) + os.sep
+            result = await self.session.execute(
+                select(*_COLUMNS).where(
+                    FileIndex.user_id == self.user_id,
+                    FileIndex.path >= prefix,
+                    FileIndex.path < prefix[:-1] + chr(ord(os.sep) + 1),
+                )
+            )
+            found.update((row[0], IndexEntry(*row)) for row in result)
+        return found
+
+    async def upsert(self, entries: Iterable[IndexEntry]) -> int:
+        """Write scan results; the remote columns of existing rows are left as they are."""
+        return await self._write(entries, _SCANNED)
+
+    async def record_synced(self, entries: Iterable[IndexEntry]) -> int:
+        """Write rows whose transfer just completed, remote id, etag and synced hash included."""
+        return await self._write(entries, _SYNCED)
+
+    async def _write(self, entries: Iterable[IndexEntry], columns: tuple[str, ...]) -> int:
+        sql, keys = self._upsert_sql(columns)
+        conn = await self.session.connection()
+        count = 0
+        rows: list[tuple] = []
+        for e in entries:
+            params = self._params(e)
+            rows.append(tuple(params[k] for k in keys))
+            if len(rows) >= self.chunk_size:
+                await conn.exec_driver_sql(sql, rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            await conn.exec_driver_sql(sql, rows)
+            count += len(rows)
+        return count
+
+    async def delete(self, paths: Sequence[str]) -> None:
+        for i in range(0, len(paths), 500):
+            await self.session.execute(
+                delete(FileIndex).where(FileIndex.user_id == self.user_id, FileIndex.path.in_(paths[i : i + 500]))
+            )
+
+
+async def load_index(session: AsyncSession, user_id: int) -> dict[str, IndexEntry]:
+    return await FileIndexRepository(session, user_id).load()
+
+
+async def save_index(
+    session: AsyncSession,
+    user_id: int,
+    entries: Iterable[IndexEntry],
+    removed: Iterable[IndexEntry] = (),
+    synced: Iterable[IndexEntry] = (),
+) -> None:
+    repo = FileIndexRepository(session, user_id)
+    await repo.upsert(entries)
+    await repo.record_synced(synced)
+    await repo.delete([e.path for e in removed])
+    await session.commit()
@@ -1,22 +1,187 @@
 from __future__ import annotations
 
+import hashlib
 import io
-from typing import Any, Optional
+import json
+import os
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Iterator, Optional, TypeVar
+from urllib.parse import urlparse
 
+import httplib2
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest, HttpRequest, MediaFileUpload, MediaIoBaseUpload
 
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+FOLDER_MIME = "application/vnd.google-apps.folder"
+FILE_FIELDS = "files(id,name,md5Checksum,mimeType,modifiedTime,parents)"
+CHANGE_FIELDS = "changes(fileId,removed,file(id,name,md5Checksum,sha256Checksum,mimeType,modifiedTime,parents,size,trashed))"
+MAX_PAGE_SIZE = 1000
+
+# Points the client at another Drive-compatible server, e.g. a local fake in tests.
+DRIVE_API_ENDPOINT = os.getenv("DRIVE_API_ENDPOINT") or None
+DRIVE_MAX_RETRIES = int(os.getenv("DRIVE_MAX_RETRIES", "5"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+DRIVE_FOLDER_CACHE_TTL = float(os.getenv("DRIVE_FOLDER_CACHE_TTL", "600"))
+_UPLOAD_CHUNK_ALIGN = 256 * 1024  # resumable chunks must be multiples of 256 KiB
+# Bigger chunks mean fewer round trips per file; each in-flight upload buffers one chunk.
+DRIVE_UPLOAD_CHUNK_BYTES = max(
+    _UPLOAD_CHUNK_ALIGN,
+    int(os.getenv("DRIVE_UPLOAD_CHUNK_BYTES", str(32 * 1024 * 1024))) // _UPLOAD_CHUNK_ALIGN * _UPLOAD_CHUNK_ALIGN,
+)
+# Files up to this size go up in one multipart request instead of opening a resumable session.
+DRIVE_MULTIPART_MAX_BYTES = int(os.getenv("DRIVE_MULTIPART_MAX_BYTES", str(5 * 1024 * 1024)))
+DRIVE_DOWNLOAD_CHUNK_BYTES = int(os.getenv("DRIVE_DOWNLOAD_CHUNK_BYTES", str(16 * 1024 * 1024)))
+PARTIAL_SUFFIX = ".part"
+CONTENT_RANGE = re.compile(r"bytes (\d+)-\d+/(\d+)")
+
+T = TypeVar("T")
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class _HashingWriter:
+    """File wrapper that hashes bytes as they are written, so a download is verified in one pass."""
+
+    def __init__(self, fh: io.RawIOBase):
+        self.fh = fh
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def update(self, data: bytes) -> None:
+        self.md5.update(data)
+        self.sha256.update(data)
+
+    def write(self, data: bytes) -> int:
+        self.update(data)
+        return self.fh.write(data)
+
+
+@lru_cache(maxsize=1)
+def _discovery_document() -> dict:
+    # Parsed once per process; every client and every worker thread builds its service from it.
+    return json.loads(discovery_cache.get_static_doc("drive", "v3"))
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, HttpError):
+        status = exc.resp.status
+        if status in RETRY_STATUSES:
+            return True
+        if status == 403:
+            reasons = {d.get("reason") for d in (exc.error_details or []) if isinstance(d, dict)}
+            return bool(reasons & RATE_LIMIT_REASONS)
+        return False
+    return isinstance(exc, (httplib2.HttpLib2Error, ConnectionError, TimeoutError))
+
+
+def _acknowledged(resp) -> int:
+    # Bytes a resumable session holds, from the Range header of a 308 ("bytes=0-N").
+    return int(resp["range"].rsplit("-", 1)[1]) + 1 if "range" in resp else 0
+
+
+def with_backoff(
+    fn: Callable[[], T],
+    retries: int = DRIVE_MAX_RETRIES,
+    base_delay: float = 1.0,
+    max_delay: float = 32.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as exc:
+            if attempt >= retries or not is_retryable(exc):
+                raise
+            # Full jitter keeps concurrent workers from retrying in lockstep.
+            sleep(random.uniform(0, min(max_delay, base_delay * (2**attempt))))
+            attempt += 1
+
+
+def folder_query(name: str, parent_id: Optional[str]) -> str:
+    escaped = name.replace("\\", "\\\\").replace("'", "\\'")
+    q = f"mimeType='{FOLDER_MIME}' and name='{escaped}' and trashed=false"
+    if parent_id:
+        q += f" and '{parent_id}' in parents"
+    return q
+
+
+class FolderCache:
+    # (parent_id, name) -> folder id, shared by the client's worker threads.
+    def __init__(self, ttl: float = DRIVE_FOLDER_CACHE_TTL, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: dict[tuple[Optional[str], str], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, parent_id: Optional[str], name: str) -> Optional[str]:
+        key = (parent_id, name)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return None
+            if hit[1] < self._clock():
+                del self._entries[key]
+                return None
+            return hit[0]
+
+    def put(self, parent_id: Optional[str], name: str, folder_id: str) -> None:
+        with self._lock:
+            self._entries[(parent_id, name)] = (folder_id, self._clock() + self.ttl)
+
+    def invalidate(self, folder_id: str) -> None:
+        # Drops the folder itself and every cached child, e.g. after a rename, move or delete.
+        with self._lock:
+            for key, (fid, _) in list(self._entries.items()):
+                if fid == folder_id or key[0] == folder_id:
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
 
 
 class GoogleDriveClient:
-    def __init__(self, creds: Credentials):
+    def __init__(self, creds: Credentials, api_endpoint: Optional[str] = DRIVE_API_ENDPOINT, retries: int = DRIVE_MAX_RETRIES):
         self.creds = creds
-        self.service = build("drive", "v3", credentials=creds, cache_discovery=False)
+        self.api_endpoint = api_endpoint
+        self.retries = retries
+        # httplib2 connections are not thread-safe, so each worker thread gets its own service.
+        self._local = threading.local()
+        self._local.service = self._build()
+        self.folders = FolderCache()
+
+    def _build(self):
+        client_options = {"api_endpoint": self.api_endpoint} if self.api_endpoint else None
+        return build_from_document(_discovery_document(), credentials=self.creds, client_options=client_options)
+
+    @property
+    def service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self._build()
+        return service
 
     @classmethod
-    def from_tokens(cls, token: str, refresh_token: Optional[str], client_id: str, client_secret: str) -> "GoogleDriveClient":
+    def from_tokens(cls, token: Optional[str], refresh_token: Optional[str], client_id: str, client_secret: str) -> "GoogleDriveClient":
         creds = Credentials(
             token=token,
             refresh_token=refresh_token,
@@ -27,38 +192,335 @@ class GoogleDriveClient:
         )
         return cls(creds)
 
-    def list_files(self, q: str, fields: str = "files(id,name,md5Checksum,mimeType,modifiedTime,parents)") -> list[dict[str, Any]]:
-        results = (
-            self.service.files()
-            .list(q=q, spaces="drive", fields=f"nextPageToken,{fields}")
-            .execute()
-        )
-        return results.get("files", [])
+    @property
+    def batch_uri(self) -> str:
+        # The discovery document's rootUrl ignores api_endpoint, so derive the batch URL here.
+        if not self.api_endpoint:
+            return "https://www.googleapis.com/batch/drive/v3"
+        url = urlparse(self.api_endpoint)
+        return f"{url.scheme}://{url.netloc}/batch/drive/v3"
+
+    def new_batch(self, callback: Callable[[str, Any, Optional[Exception]], None]) -> BatchHttpRequest:
+        return BatchHttpRequest(callback=callback, batch_uri=self.batch_uri)
+
+    def prepare(self, request: HttpRequest) -> HttpRequest:
+        # The discovery client keeps https for media upload URLs even when the endpoint is plain http.
+        if self.api_endpoint and self.api_endpoint.startswith("http://") and request.uri.startswith("https://"):
+            request.uri = "http://" + request.uri[len("https://") :]
+        return request
+
+    def _execute(self, make_request: Callable[[], HttpRequest]) -> Any:
+        return with_backoff(lambda: self.prepare(make_request()).execute(), retries=self.retries)
+
+    def iter_files(self, q: str, fields: str = FILE_FIELDS, page_size: int = MAX_PAGE_SIZE) -> Iterator[dict[str, Any]]:
+        page_token: Optional[str] = None
+        while True:
+            results = self._execute(
+                lambda: self.service.files().list(
+                    q=q,
+                    spaces="drive",
+                    fields=f"nextPageToken,{fields}",
+                    pageSize=page_size,
+                    pageToken=page_token,
+                )
+            )
+            yield from results.get("files", [])
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return
+
+    def list_files(self, q: str, fields: str = FILE_FIELDS, page_size: int = MAX_PAGE_SIZE) -> list[dict[str, Any]]:
+        return list(self.iter_files(q, fields, page_size))
+
+    def get_file(self, file_id: str, fields: str = "id,name,mimeType,parents") -> dict[str, Any]:
+        return self._execute(lambda: self.service.files().get(fileId=file_id, fields=fields))
+
+    def generate_ids(self, count: int) -> list[str]:
+        # Ids to create files under, so retrying a create cannot make a second copy.
+        ids: list[str] = []
+        while len(ids) < count:
+            n = min(1000, count - len(ids))
+            ids += self._execute(lambda: self.service.files().generateIds(count=n, space="drive"))["ids"]
+        return ids
 
-    def upload_file(self, local_path: str, remote_parent_id: Optional[str], name: Optional[str] = None) -> dict[str, Any]:
-        media = MediaFileUpload(local_path, resumable=True)
-        body = {"name": name or local_path.split("/")[-1]}
-        if remote_parent_id:
+    def get_start_page_token(self) -> str:
+        return self._execute(lambda: self.service.changes().getStartPageToken())["startPageToken"]
+
+    def list_changes(
+        self, page_token: str, fields: str = CHANGE_FIELDS, page_size: int = MAX_PAGE_SIZE
+    ) -> tuple[list[dict[str, Any]], Optional[str]]:
+        # Returns every change since page_token plus the token to resume from next time, or
+        # None if the feed ended without one; the caller then has to relist.
+        changes: list[dict[str, Any]] = []
+        token = page_token
+        while True:
+            results = self._execute(
+                lambda: self.service.changes().list(
+                    pageToken=token,
+                    spaces="drive",
+                    pageSize=page_size,
+                    includeRemoved=True,
+                    fields=f"nextPageToken,newStartPageToken,{fields}",
+                )
+            )
+            changes.extend(results.get("changes", []))
+            token = results.get("nextPageToken")
+            if results.get("newStartPageToken") or not token:
+                return changes, results.get("newStartPageToken")
+
+    def upload_file(
+        self,
+        local_path: str,
+        remote_parent_id: Optional[str],
+        name: Optional[str] = None,
+        *,
+        file_id: Optional[str] = None,
+        session_uri: Optional[str] = None,
+        on_session: Optional[Callable[[Optional[str]], None]] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        cancel: Optional[threading.Event] = None,
+        chunk_size: int = DRIVE_UPLOAD_CHUNK_BYTES,
+        multipart_max: int = DRIVE_MULTIPART_MAX_BYTES,
+    ) -> dict[str, Any]:
+        """Upload a file, in chunks through a resumable session unless it is small.
+
+        ``on_session`` receives the session URI as soon as it exists (and None once it is no
+        longer usable); passing it back as ``session_uri`` later continues the upload from the
+        last byte the server acknowledged instead of from zero. With ``file_id`` the content
+        of that existing file is replaced, keeping its id, instead of a new file being created.
+        """
+        body = {"name": name or os.path.basename(local_path)}
+        if remote_parent_id and not file_id:
             body["parents"] = [remote_parent_id]
-        return self.service.files().create(body=body, media_body=media, fields="id,etag,modifiedTime").execute()
+        size = os.path.getsize(local_path)
+        fields = "id,md5Checksum,modifiedTime"
+
+        def send(media) -> HttpRequest:
+            if file_id:
+                return self.service.files().update(fileId=file_id, body=body, media_body=media, fields=fields)
+            return self.service.files().create(body=body, media_body=media, fields=fields)
+
+        if size <= multipart_max and not session_uri:
+            result = self._execute(lambda: send(MediaFileUpload(local_path, resumable=False)))
+            if on_progress:
+                on_progress(size, size)
+            return result
+
+        # The resumable protocol is spoken directly (open a session, PUT byte ranges, ask with an
+        # empty PUT how much the server holds) rather than through MediaUpload's internal state.
+        request = self.prepare(send(MediaFileUpload(local_path, resumable=True, chunksize=chunk_size)))
+        http = request.http
+
+        def finished(resp, content, uri: str) -> Optional[dict[str, Any]]:
+            # The file's metadata once the upload is complete, None while it is not.
+            if resp.status in (200, 201):
+                return request.postproc(resp, content)
+            if resp.status != 308:
+                raise HttpError(resp, content, uri=uri)
+            return None
 
-    def download_file(self, file_id: str, dest_path: str) -> None:
-        request = self.service.files().get_media(fileId=file_id)
-        fh = io.FileIO(dest_path, "wb")
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
+        def open_session() -> str:
+            headers = {
+                **request.headers,
+                "X-Upload-Content-Type": request.resumable.mimetype(),
+                "X-Upload-Content-Length": str(size),
+            }
+            resp, content = http.request(request.uri, method=request.method, body=request.body, headers=headers)
+            if resp.status != 200 or "location" not in resp:
+                raise HttpError(resp, content, uri=request.uri)
+            return resp["location"]
+
+        offset = 0
+        # A saved session starts with a status query: the server may hold more than we know.
+        resync = session_uri is not None
+
+        def next_chunk(fh) -> Optional[dict[str, Any]]:
+            nonlocal offset, resync
+            try:
+                if resync:
+                    headers = {"Content-Range": f"bytes */{size}", "Content-Length": "0"}
+                    resp, content = http.request(session_uri, "PUT", headers=headers)
+                    result = finished(resp, content, session_uri)
+                    if result is not None:
+                        return result
+                    offset, resync = _acknowledged(resp), False
+                fh.seek(offset)
+                data = fh.read(chunk_size)
+                span = f"{offset}-{offset + len(data) - 1}" if data else "*"
+                headers = {"Content-Range": f"bytes {span}/{size}", "Content-Length": str(len(data))}
+                resp, content = http.request(session_uri, "PUT", body=data, headers=headers)
+                result = finished(resp, content, session_uri)
+            except Exception:
+                # Whatever went wrong, re-sync the offset with the server before retrying.
+                resync = True
+                raise
+            if result is None:
+                offset = _acknowledged(resp)
+            return result
+
+        restarted = False
+        with open(local_path, "rb") as fh:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise TransferCancelled(local_path)
+                try:
+                    if session_uri is None:
+                        session_uri = with_backoff(open_session, retries=self.retries)
+                        offset, resync = 0, False
+                        if on_session:
+                            on_session(session_uri)
+                    response = with_backoff(lambda: next_chunk(fh), retries=self.retries)
+                except HttpError as exc:
+                    if session_uri is None or restarted or exc.resp.status not in (404, 410):
+                        raise
+                    # The session expired server-side; start over with a fresh one.
+                    session_uri, restarted = None, True
+                    if on_session:
+                        on_session(None)
+                    continue
+                if response is not None:
+                    if on_progress:
+                        on_progress(size, size)
+                    return response
+                if on_progress:
+                    on_progress(offset, size)
+
+    def upload_bytes(
+        self,
+        data: bytes,
+        remote_parent_id: Optional[str],
+        name: str,
+        mimetype: str = "application/octet-stream",
+        file_id: Optional[str] = None,
+    ) -> dict[str, Any]:
+        # Small payloads (chunks, manifests) go up in a single multipart request. With
+        # ``file_id`` the content of that file is replaced instead of a new one being created.
+        body = {"name": name}
+        if remote_parent_id and not file_id:
+            body["parents"] = [remote_parent_id]
+
+        def send() -> HttpRequest:
+            media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype, resumable=False)
+            if file_id:
+                return self.service.files().update(fileId=file_id, body=body, media_body=media, fields="id,md5Checksum")
+            return self.service.files().create(body=body, media_body=media, fields="id,md5Checksum")
+
+        return self._execute(send)
+
+    def download_bytes(self, file_id: str) -> bytes:
+        return self._execute(lambda: self.service.files().get_media(fileId=file_id))
+
+    def download_file(
+        self,
+        file_id: str,
+        dest_path: str,
+        cancel: Optional[threading.Event] = None,
+        *,
+        expected_md5: Optional[str] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        chunk_size: int = DRIVE_DOWNLOAD_CHUNK_BYTES,
+    ) -> dict[str, Any]:
+        """Stream a file to ``dest_path`` and return its ``size``, ``md5`` and ``sha256``.
+
+        Bytes go to ``dest_path + PARTIAL_SUFFIX`` and are hashed as they arrive; the file is
+        renamed into place only once its MD5 matches Drive's ``md5Checksum``. A partial file
+        left by an interrupted call is resumed with a Range request instead of starting over.
+        """
+        if expected_md5 is None:
+            expected_md5 = self.get_file(file_id, fields="md5Checksum").get("md5Checksum")
+        part = dest_path + PARTIAL_SUFFIX
+        try:
+            offset = os.path.getsize(part)
+        except OSError:
+            offset = 0
+        try:
+            out: Optional[dict[str, Any]] = self._download_part(file_id, part, offset, cancel, on_progress, chunk_size)
+        except HttpError as exc:
+            if not offset or exc.resp.status != 416:
+                raise
+            out = None
+        if offset and (out is None or (expected_md5 and out["md5"] != expected_md5)):
+            # The partial copy does not fit the remote file any more (it changed or shrank).
+            os.remove(part)
+            out = self._download_part(file_id, part, 0, cancel, on_progress, chunk_size)
+        if expected_md5 and out["md5"] != expected_md5:
+            os.remove(part)
+            raise ChecksumMismatch(f"{file_id}: expected md5 {expected_md5}, got {out['md5']}")
+        os.replace(part, dest_path)
+        return out
+
+    def _download_part(
+        self,
+        file_id: str,
+        part: str,
+        offset: int,
+        cancel: Optional[threading.Event],
+        on_progress: Optional[Callable[[int, int], None]],
+        chunk_size: int,
+    ) -> dict[str, Any]:
+        with open(part, "ab" if offset else "wb", buffering=0) as fh:
+            writer = _HashingWriter(fh)
+            if offset:
+                # Hash what is already on disk; reading it locally is far cheaper than fetching it again.
+                with open(part, "rb") as existing:
+                    for block in iter(lambda: existing.read(4 * 1024 * 1024), b""):
+                        writer.update(block)
+            request = self.prepare(self.service.files().get_media(fileId=file_id))
+            total: Optional[int] = None
+
+            def fetch():
+                headers = {**request.headers, "range": f"bytes={offset}-{offset + chunk_size - 1}"}
+                resp, content = request.http.request(request.uri, "GET", headers=headers)
+                if resp.status == 416 and offset == 0:
+                    return resp, b""  # an empty file has no byte range to return
+                if resp.status not in (200, 206):
+                    raise HttpError(resp, content, uri=request.uri)
+                return resp, content
+
+            while total is None or offset < total:
+                if cancel is not None and cancel.is_set():
+                    raise TransferCancelled(file_id)
+                # Retried per chunk: a failed request writes nothing, so the next attempt
+                # continues at the same offset.
+                resp, content = with_backoff(fetch, retries=self.retries)
+                if resp.status == 206:
+                    m = CONTENT_RANGE.fullmatch(resp.get("content-range", ""))
+                    if m is None or int(m.group(1)) != offset:
+                        raise HttpError(resp, content, uri=request.uri)
+                    total = int(m.group(2))
+                else:
+                    # The range was ignored and the body is the whole file (empty after a 416):
+                    # whatever the part file held is replaced by it.
+                    if offset:
+                        fh.seek(0)
+                        fh.truncate()
+                        writer = _HashingWriter(fh)
+                        offset = 0
+                    total = len(content)
+                writer.write(content)
+                offset += len(content)
+                if on_progress:
+                    on_progress(offset, total)
+        return {"size": offset, "md5": writer.md5.hexdigest(), "sha256": writer.sha256.hexdigest()}
 
     def ensure_folder(self, name: str, parent_id: Optional[str]) -> str:
-        q = f"mimeType='application/vnd.google-apps.folder' and name='{name.replace("'","\\'")}'"
-        if parent_id:
-            q += f" and '{parent_id}' in parents"
-        files = self.list_files(q)
-        if files:
-            return files[0]["id"]
-        file_metadata = {"name": name, "mimeType": "application/vnd.google-apps.folder"}
-        if parent_id:
-            file_metadata["parents"] = [parent_id]
-        folder = self.service.files().create(body=file_metadata, fields="id").execute()
-        return folder["id"]
+        cached = self.folders.get(parent_id, name)
+        if cached:
+            return cached
+        found = next(self.iter_files(folder_query(name, parent_id), fields="files(id)", page_size=1), None)
+        if found:
+            folder_id = found["id"]
+        else:
+            file_metadata = {"name": name, "mimeType": FOLDER_MIME}
+            if parent_id:
+                file_metadata["parents"] = [parent_id]
+            folder_id = self._execute(lambda: self.service.files().create(body=file_metadata, fields="id"))["id"]
+        self.folders.put(parent_id, name, folder_id)
+        return folder_id
+
+    def ensure_path(self, path: str, root_id: Optional[str]) -> str:
+        # "a/b/c" relative to root_id; only uncached components cost a round trip.
+        parent_id = root_id
+        for part in filter(None, path.replace("\\", "/").split("/")):
+            parent_id = self.ensure_folder(part, parent_id)
+        return parent_id
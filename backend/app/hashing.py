@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Optional, TypeVar, Union
+
+from .pipeline import bounded_map
+
+T = TypeVar("T")
+
+# hashlib drops the GIL while digesting large buffers, so plain threads scale across cores.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(8, os.cpu_count() or 1))))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "256"))
+READ_CHUNK = 4 * 1024 * 1024
+_buffers = threading.local()
+
+
+def _buffer(size: int) -> bytearray:
+    # One read buffer per hashing thread, reused for every file it reads.
+    buf = getattr(_buffers, "buf", None)
+    if buf is None or len(buf) != size:
+        buf = _buffers.buf = bytearray(size)
+    return buf
+
+
+def hash_file(path: str, chunk: int = READ_CHUNK) -> str:
+    # readinto rather than mmap: a mapped file truncated while it is hashed raises SIGBUS and
+    # takes the process down, where a read just comes back short.
+    h = hashlib.sha256()
+    buf = _buffer(chunk)
+    with open(path, "rb", buffering=0) as f, memoryview(buf) as view:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+class HashPool:
+    def __init__(self, workers: int = HASH_WORKERS, queue_size: int = HASH_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash")
+
+    async def hash(self, path: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, hash_file, path)
+
+    def imap(
+        self, items: Union[Iterable[T], AsyncIterable[T]], path_of: Callable[[T], str]
+    ) -> AsyncIterator[tuple[T, Optional[str], Optional[Exception]]]:
+        return bounded_map(items, lambda item: self.hash(path_of(item)), self.queue_size)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[HashPool] = None
+
+
+def get_hash_pool() -> HashPool:
+    global _pool
+    if _pool is None:
+        _pool = HashPool()
+    return _pool
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import orjson
@@ -12,7 +13,9 @@ from loguru import logger
 # Load .env as early as possible and override any existing env values
 load_dotenv(override=True)
 
-from .db import lifespan
+from .db import lifespan as db_lifespan
+from .drive_pool import get_drive_pool
+from .size_index import get_size_index
 from .api import auth as auth_api
 from .api import fs as fs_api
 from .api import metrics as metrics_api
@@ -28,6 +31,24 @@ class ORJSONResponse:
         self.body = orjson.dumps(content)
         self.status_code = status_code
 
+@asynccontextmanager
+async def lifespan(app):
+    async with db_lifespan(app):
+        metrics_api.writer.start()
+        metrics_api.sampler.start()
+        get_drive_pool().start()
+        get_size_index().start()
+        await sync_api.orchestrator.recover()
+        try:
+            yield
+        finally:
+            await sync_api.orchestrator.shutdown()
+            await get_drive_pool().stop()
+            await get_size_index().stop()
+            await metrics_api.sampler.stop()
+            await metrics_api.writer.stop()
+
+
 app = FastAPI(lifespan=lifespan, title="Backup Backend")
 
 frontend_origin = os.getenv("FRONTEND_ORIGIN", "http://localhost:5173")
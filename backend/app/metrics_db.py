@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import Integer, cast, delete, func, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .db import AsyncSessionLocal
+from .metrics_store import FIELDS
+from .models import MetricsPoint
+
+RETENTION_HOURS = int(os.getenv("METRICS_HISTORY_RETENTION_HOURS", "24"))
+MINUTE_RETENTION_DAYS = int(os.getenv("METRICS_MINUTE_RETENTION_DAYS", "7"))
+ROLLUP_RETENTION_DAYS = int(os.getenv("METRICS_ROLLUP_RETENTION_DAYS", "30"))
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+FLUSH_BATCH = int(os.getenv("METRICS_FLUSH_BATCH", "500"))
+COMPACT_SECONDS = float(os.getenv("METRICS_COMPACT_INTERVAL_SECONDS", "300"))
+
+_table = MetricsPoint.__table__
+_VALUE_COLUMNS = [c for f in FIELDS for c in (f, f"{f}_min", f"{f}_max")]
+RESOLUTIONS = (1, 60, 3600)
+
+
+def _aggregates(step: int):
+    bucket = cast(_table.c.ts / step, Integer) * step
+    cols = []
+    for f in FIELDS:
+        col = _table.c[f]
+        cols.append(func.avg(col))
+        cols.append(func.min(func.coalesce(_table.c[f"{f}_min"], col)))
+        cols.append(func.max(func.coalesce(_table.c[f"{f}_max"], col)))
+    return bucket, cols
+
+
+async def compact(session: AsyncSession, now: Optional[float] = None) -> None:
+    """Roll raw samples into minute rows and minute rows into hour rows, then expire old hours.
+
+    Each row lives in exactly one tier, so a history query can read all tiers at once.
+    """
+    now = time.time() if now is None else now
+    for src, dst, keep in (
+        (1, 60, RETENTION_HOURS * 3600),
+        (60, 3600, MINUTE_RETENTION_DAYS * 86400),
+    ):
+        # Aligned to the target resolution so every rollup bucket is complete when written.
+        cutoff = now - keep
+        cutoff -= cutoff % dst
+        bucket, cols = _aggregates(dst)
+        rows = (
+            select(literal(dst), bucket, *cols)
+            .where(_table.c.resolution == src, _table.c.ts < cutoff)
+            .group_by(bucket)
+        )
+        await session.execute(insert(_table).from_select(["resolution", "ts", *_VALUE_COLUMNS], rows))
+        await session.execute(delete(_table).where(_table.c.resolution == src, _table.c.ts < cutoff))
+    await session.execute(
+        delete(_table).where(_table.c.resolution == 3600, _table.c.ts < now - ROLLUP_RETENTION_DAYS * 86400)
+    )
+    await session.commit()
+
+
+async def query_history(session: AsyncSession, range_s: int, step: int, now: float) -> list[dict]:
+    bucket, cols = _aggregates(step)
+    result = await session.execute(
+        select(bucket, *cols)
+        # Naming every resolution lets SQLite range-scan the (resolution, ts) index.
+        .where(_table.c.resolution.in_(RESOLUTIONS), _table.c.ts >= now - range_s)
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+    points: list[dict] = []
+    for row in result:
+        point: dict = {"ts": datetime.fromtimestamp(row[0], timezone.utc).isoformat(), "min": {}, "max": {}}
+        for i, f in enumerate(FIELDS):
+            point[f] = row[1 + 3 * i]
+            point["min"][f] = row[2 + 3 * i]
+            point["max"][f] = row[3 + 3 * i]
+        points.append(point)
+    return points
+
+
+class MetricsWriter:
+    """Buffers samples in memory and bulk-inserts them in one transaction per flush."""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        flush_seconds: float = FLUSH_SECONDS,
+        batch_size: int = FLUSH_BATCH,
+        compact_seconds: float = COMPACT_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.compact_seconds = compact_seconds
+        self._buffer: list[dict] = []
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, ts: float, values: dict[str, float]) -> None:
+        self._buffer.append({"resolution": 1, "ts": float(int(ts)), **{f: values[f] for f in FIELDS}})
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self) -> int:
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        try:
+            async with self.session_factory() as session:
+                await session.execute(insert(_table), rows)
+                await session.commit()
+        except Exception:
+            # Keep the samples for the next attempt, but never more than a few batches.
+            self._buffer = (rows + self._buffer)[-self.batch_size * 10 :]
+            raise
+        return len(rows)
+
+    async def compact(self, now: Optional[float] = None) -> None:
+        async with self.session_factory() as session:
+            await compact(session, now)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_compact = loop.time()
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+                if loop.time() >= next_compact:
+                    await self.compact()
+                    next_compact = loop.time() + self.compact_seconds
+            except Exception as exc:
+                logger.warning(f"metrics write failed: {exc}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="metrics-writer")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as exc:
+            logger.warning(f"metrics write failed: {exc}")
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import orjson
+import psutil
+from loguru import logger
+
+from .metrics_db import MetricsWriter
+from .metrics_store import MetricsHistory, flatten_snapshot
+
+
+class SystemSampler:
+    # Network rates are deltas between consecutive samples, so this state must have one owner.
+    def __init__(self):
+        self._prev_net: Optional[tuple[datetime, int, int]] = None
+
+    def __call__(self) -> dict:
+        cpu_pct = psutil.cpu_percent(interval=None)
+        per_cpu = psutil.cpu_percent(interval=None, percpu=True)
+        vm = psutil.virtual_memory()
+        du = psutil.disk_usage("/")
+        now = datetime.now(timezone.utc)
+        n = psutil.net_io_counters()
+        rx = tx = 0
+        if self._prev_net is not None:
+            prev_ts, prev_rx, prev_tx = self._prev_net
+            dt = (now - prev_ts).total_seconds() or 1.0
+            rx = int((n.bytes_recv - prev_rx) / dt)
+            tx = int((n.bytes_sent - prev_tx) / dt)
+        self._prev_net = (now, n.bytes_recv, n.bytes_sent)
+        return {
+            "ts": now.isoformat(),
+            "cpu": cpu_pct,
+            "per_cpu": per_cpu,
+            "ram": {"used": vm.used, "total": vm.total},
+            "disk": {"used": du.used, "total": du.total},
+            "net": {"rx": rx, "tx": tx},
+            "top": [],
+        }
+
+
+class MetricsSampler:
+    """Samples system metrics once per interval and fans the encoded snapshot out to subscribers."""
+
+    def __init__(
+        self,
+        interval: float,
+        history: MetricsHistory,
+        sample: Optional[Callable[[], dict]] = None,
+        writer: Optional[MetricsWriter] = None,
+    ):
+        self.interval = interval
+        self.history = history
+        self.writer = writer
+        self.sample = sample or SystemSampler()
+        self.latest: Optional[str] = None
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        # Size 1: a slow client only ever gets the newest snapshot, never a backlog.
+        q: asyncio.Queue = asyncio.Queue(maxsize=1)
+        if self.latest is not None:
+            q.put_nowait(self.latest)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        self._subscribers.discard(q)
+
+    def publish(self, snap: dict) -> None:
+        ts = datetime.fromisoformat(snap["ts"]).timestamp()
+        values = flatten_snapshot(snap)
+        if self.history.add(ts, values) and self.writer is not None:
+            self.writer.add(ts, values)
+        # Encoded once; every subscriber is handed the same string.
+        payload = orjson.dumps(snap).decode("utf-8")
+        self.latest = payload
+        for q in self._subscribers:
+            if q.full():
+                q.get_nowait()
+            q.put_nowait(payload)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                self.publish(await asyncio.to_thread(self.sample))
+            except Exception as exc:
+                logger.warning(f"metrics sample failed: {exc}")
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="metrics-sampler")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import re
+from array import array
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+FIELDS = ("cpu", "ram_used", "ram_total", "disk_used", "disk_total", "net_rx", "net_tx")
+STATS = ("min", "avg", "max")
+
+_DURATION = re.compile(r"^\s*(\d+)\s*([smhd])\s*$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> int:
+    m = _DURATION.match(value or "")
+    if not m or int(m.group(1)) <= 0:
+        raise ValueError(f"Invalid duration: {value!r}")
+    return int(m.group(1)) * _UNIT_SECONDS[m.group(2)]
+
+
+def flatten_snapshot(snap: dict) -> dict[str, float]:
+    return {
+        "cpu": float(snap["cpu"]),
+        "ram_used": float(snap["ram"]["used"]),
+        "ram_total": float(snap["ram"]["total"]),
+        "disk_used": float(snap["disk"]["used"]),
+        "disk_total": float(snap["disk"]["total"]),
+        "net_rx": float(snap["net"]["rx"]),
+        "net_tx": float(snap["net"]["tx"]),
+    }
+
+
+class RingSeries:
+    # Fixed-capacity time series: one packed array('d') per column, overwritten oldest-first.
+    def __init__(self, resolution: int, capacity: int, columns: Iterable[str]):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.ts = array("d", bytes(8 * capacity))
+        self.cols = {c: array("d", bytes(8 * capacity)) for c in columns}
+        self.head = 0  # next slot to write
+        self.size = 0
+
+    @property
+    def span(self) -> int:
+        return self.resolution * self.capacity
+
+    def _slot(self, i: int) -> int:
+        # Logical index i (0 = oldest) to physical slot.
+        return (self.head - self.size + i) % self.capacity
+
+    def last_ts(self) -> Optional[float]:
+        return self.ts[self._slot(self.size - 1)] if self.size else None
+
+    def append(self, ts: float, values: dict[str, float]) -> None:
+        slot = self.head
+        self.ts[slot] = ts
+        for c, col in self.cols.items():
+            col[slot] = values.get(c, 0.0)
+        self.head = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def since(self, start: float) -> Iterable[int]:
+        # Physical slots with ts >= start, oldest first; timestamps are monotonic so bisect works.
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._slot(mid)] < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in range(lo, self.size):
+            yield self._slot(i)
+
+
+class _Bucket:
+    __slots__ = ("start", "count", "sums", "mins", "maxs")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.sums = dict.fromkeys(FIELDS, 0.0)
+        self.mins = dict.fromkeys(FIELDS, float("inf"))
+        self.maxs = dict.fromkeys(FIELDS, float("-inf"))
+
+    def add(self, mins: dict[str, float], avgs: dict[str, float], maxs: dict[str, float]) -> None:
+        self.count += 1
+        for f in FIELDS:
+            self.sums[f] += avgs[f]
+            if mins[f] < self.mins[f]:
+                self.mins[f] = mins[f]
+            if maxs[f] > self.maxs[f]:
+                self.maxs[f] = maxs[f]
+
+    def row(self) -> dict[str, float]:
+        out: dict[str, float] = {}
+        for f in FIELDS:
+            out[f"{f}:min"] = self.mins[f]
+            out[f"{f}:avg"] = self.sums[f] / self.count
+            out[f"{f}:max"] = self.maxs[f]
+        return out
+
+
+class MetricsHistory:
+    """In-memory metrics history: raw 1s samples plus 1m and 1h min/avg/max rollups."""
+
+    def __init__(self, raw_hours: int = 24, minute_days: int = 7, hour_days: int = 90):
+        self.raw = RingSeries(1, max(1, raw_hours) * 3600, FIELDS)
+        rollup_cols = [f"{f}:{s}" for f in FIELDS for s in STATS]
+        self.minutes = RingSeries(60, minute_days * 1440, rollup_cols)
+        self.hours = RingSeries(3600, hour_days * 24, rollup_cols)
+        self._minute: Optional[_Bucket] = None
+        self._hour: Optional[_Bucket] = None
+
+    @property
+    def tiers(self) -> tuple[RingSeries, ...]:
+        return (self.raw, self.minutes, self.hours)
+
+    def add(self, ts: float, values: dict[str, float]) -> bool:
+        second = float(int(ts))
+        last = self.raw.last_ts()
+        if last is not None and second <= last:
+            return False  # one sample per second, however many producers there are
+        self.raw.append(second, values)
+        self._roll(second, values, values, values)
+        return True
+
+    def _roll(self, ts: float, mins: dict, avgs: dict, maxs: dict) -> None:
+        start = ts - ts % 60
+        if self._minute is not None and self._minute.start != start:
+            done = self._minute
+            self.minutes.append(done.start, done.row())
+            self._roll_hour(done)
+            self._minute = None
+        if self._minute is None:
+            self._minute = _Bucket(start)
+        self._minute.add(mins, avgs, maxs)
+
+    def _roll_hour(self, minute: _Bucket) -> None:
+        start = minute.start - minute.start % 3600
+        if self._hour is not None and self._hour.start != start:
+            self.hours.append(self._hour.start, self._hour.row())
+            self._hour = None
+        if self._hour is None:
+            self._hour = _Bucket(start)
+        self._hour.add(minute.mins, {f: minute.sums[f] / minute.count for f in FIELDS}, minute.maxs)
+
+    def _usable(self, granularity: int) -> list[RingSeries]:
+        return [t for t in self.tiers if t.resolution <= granularity] or [self.raw]
+
+    def covers(self, range_s: int, granularity: int, now: float) -> bool:
+        start = now - range_s
+        return any(t.size and t.ts[t._slot(0)] <= start for t in self._usable(granularity))
+
+    def _pick_tier(self, range_s: int, granularity: int, now: float) -> RingSeries:
+        # Coarsest tier that is fine enough and already reaches back to the start of the range;
+        # right after startup only the finer tiers have data, so fall back to those.
+        usable = self._usable(granularity)
+        start = now - range_s
+        for t in reversed(usable):
+            if t.size and t.ts[t._slot(0)] <= start:
+                return t
+        for t in usable:
+            if t.span >= range_s:
+                return t
+        return usable[-1]
+
+    def _rows(self, tier: RingSeries, start: float) -> Iterator[tuple[float, dict, dict, dict]]:
+        if tier is self.raw:
+            for slot in tier.since(start):
+                vals = {f: tier.cols[f][slot] for f in FIELDS}
+                yield tier.ts[slot], vals, vals, vals
+            return
+        for slot in tier.since(start):
+            yield (
+                tier.ts[slot],
+                {f: tier.cols[f"{f}:min"][slot] for f in FIELDS},
+                {f: tier.cols[f"{f}:avg"][slot] for f in FIELDS},
+                {f: tier.cols[f"{f}:max"][slot] for f in FIELDS},
+            )
+        # Buckets still being filled have not reached the ring yet but belong in the answer.
+        pending = [self._minute] if tier is self.minutes else [self._hour, self._minute]
+        for b in pending:
+            if b is not None and b.count and b.start >= start - tier.resolution:
+                yield b.start, b.mins, {f: b.sums[f] / b.count for f in FIELDS}, b.maxs
+
+    def query(self, range_s: int, granularity: int, now: float) -> list[dict]:
+        tier = self._pick_tier(range_s, granularity, now)
+        step = max(granularity, tier.resolution)
+        points: list[dict] = []
+        bucket: Optional[_Bucket] = None
+        for ts, mins, avgs, maxs in self._rows(tier, now - range_s):
+            start = ts - ts % step
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    points.append(_point(bucket))
+                bucket = _Bucket(start)
+            bucket.add(mins, avgs, maxs)
+        if bucket is not None:
+            points.append(_point(bucket))
+        return points
+
+
+def _point(b: _Bucket) -> dict:
+    point: dict = {"ts": datetime.fromtimestamp(b.start, timezone.utc).isoformat()}
+    for f in FIELDS:
+        point[f] = b.sums[f] / b.count
+    point["min"] = dict(b.mins)
+    point["max"] = dict(b.maxs)
+    return point
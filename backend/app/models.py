@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, LargeBinary, String, Text
+from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Text, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -29,30 +29,117 @@ class SyncJob(Base):
     options: Mapped[str] = mapped_column(Text, default="{}")
     status: Mapped[str] = mapped_column(String(32), default="idle")
     progress: Mapped[int] = mapped_column(Integer, default=0)
+    stats: Mapped[str] = mapped_column(Text, default="{}")  # JSON counters from the last report
+    checkpoint: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON, see SyncEngine.start
     error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
 
 class FileIndex(Base):
     __tablename__ = "file_index"
+    __table_args__ = (
+        # Upsert target and the key every per-path lookup goes through.
+        UniqueConstraint("user_id", "path", name="uq_file_index_user_path"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    path: Mapped[str] = mapped_column(Text, index=True)
+    path: Mapped[str] = mapped_column(Text)
     sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    size: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     mtime: Mapped[Optional[float]] = mapped_column()
+    inode: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     remote_id: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
     remote_etag: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    # Content hash as of the last completed transfer; sha256 follows the local file.
+    synced_sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
+
+class RemoteFile(Base):
+    __tablename__ = "remote_files"
+    __table_args__ = (UniqueConstraint("user_id", "file_id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    file_id: Mapped[str] = mapped_column(String(256))
+    parent_id: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    name: Mapped[str] = mapped_column(Text)
+    path: Mapped[str] = mapped_column(Text, index=True)
+    mime_type: Mapped[str] = mapped_column(String(128))
+    md5: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    size: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    modified_time: Mapped[Optional[str]] = mapped_column(String(40), nullable=True)
+
+
+class DriveState(Base):
+    __tablename__ = "drive_state"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    start_page_token: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    # What the "root" alias resolved to, so cached snapshots can be read for it offline.
+    root_id: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Chunk(Base):
+    __tablename__ = "chunks"
+    __table_args__ = (UniqueConstraint("user_id", "hash"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    hash: Mapped[str] = mapped_column(String(64))
+    size: Mapped[int] = mapped_column(Integer)
+    remote_id: Mapped[str] = mapped_column(String(256))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ChunkManifest(Base):
+    __tablename__ = "chunk_manifests"
+    __table_args__ = (UniqueConstraint("user_id", "path"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    path: Mapped[str] = mapped_column(Text)
+    size: Mapped[int] = mapped_column(Integer, default=0)
+    manifest: Mapped[str] = mapped_column(Text)  # JSON: ordered [sha256, length] pairs
+    remote_id: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
 class MetricsPoint(Base):
     __tablename__ = "metrics_points"
+    # Raw samples (resolution 1) plus 1m/1h rollups. Queries and compaction select (resolution, ts)
+    # ranges; the table is write-heavy, so the index stays narrow and rows are read from the table.
+    __table_args__ = (Index("ix_metrics_points_resolution_ts", "resolution", "ts"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    ts: Mapped[datetime] = mapped_column(DateTime, index=True)
-    cpu: Mapped[float] = mapped_column()
-    ram_used: Mapped[int] = mapped_column()
-    ram_total: Mapped[int] = mapped_column()
+    resolution: Mapped[int] = mapped_column(Integer, default=1)
+    # Unix seconds, so range scans and rollup bucketing stay plain arithmetic.
+    ts: Mapped[float] = mapped_column(Float)
+    cpu: Mapped[float] = mapped_column(Float)
+    ram_used: Mapped[float] = mapped_column(Float)
+    ram_total: Mapped[float] = mapped_column(Float)
+    disk_used: Mapped[float] = mapped_column(Float)
+    disk_total: Mapped[float] = mapped_column(Float)
+    net_rx: Mapped[float] = mapped_column(Float)
+    net_tx: Mapped[float] = mapped_column(Float)
+    # Only set on rollup rows; for raw samples min == max == value.
+    cpu_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    cpu_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    ram_used_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    ram_used_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    ram_total_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    ram_total_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    disk_used_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    disk_used_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    disk_total_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    disk_total_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    net_rx_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    net_rx_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    net_tx_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    net_tx_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
 
 
 class ScheduleJob(Base):
@@ -64,3 +151,16 @@ class ScheduleJob(Base):
     days: Mapped[str] = mapped_column(String(32))  # e.g. Mon,Wed,Fri
     time_of_day: Mapped[str] = mapped_column(String(8))  # HH:MM
     enabled: Mapped[bool] = mapped_column(Boolean, default=True)
+
+
+class DirSize(Base):
+    __tablename__ = "dir_sizes"
+
+    # Absolute local path; the size index is host-wide, like the /api/fs browser.
+    path: Mapped[str] = mapped_column(Text, primary_key=True)
+    mtime_ns: Mapped[int] = mapped_column(Integer)
+    own_size: Mapped[int] = mapped_column(Integer, default=0)
+    own_files: Mapped[int] = mapped_column(Integer, default=0)
+    exts: Mapped[str] = mapped_column(Text, default="{}")  # JSON {suffix: [files, bytes]} of own files
+    total_size: Mapped[int] = mapped_column(Integer, default=0)
+    total_files: Mapped[int] = mapped_column(Integer, default=0)
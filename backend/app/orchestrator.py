@@ -0,0 +1,404 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import uuid
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .db import AsyncSessionLocal
+from .drive_pool import get_drive_pool
+from .hashing import HashPool
+from .models import SyncJob
+from .sync_engine import SyncEngine, SyncOptions
+from .transfers import TransferScheduler
+from .utils import utcnow
+from .watcher import ContinuousSync
+
+SYNC_MAX_JOBS = int(os.getenv("SYNC_MAX_JOBS", "4"))
+SYNC_JOBS_PER_DISK = int(os.getenv("SYNC_JOBS_PER_DISK", "1"))
+SYNC_STATE_FLUSH_SECONDS = float(os.getenv("SYNC_STATE_FLUSH_SECONDS", "2"))
+SYNC_SHUTDOWN_GRACE_SECONDS = float(os.getenv("SYNC_SHUTDOWN_GRACE_SECONDS", "10"))
+SYNC_RESUME_ON_START = os.getenv("SYNC_RESUME_ON_START", "false").lower() in ("1", "true", "yes")
+
+ACTIVE = ("queued", "running")
+_table = SyncJob.__table__
+
+
+def options_from_dict(options: dict) -> SyncOptions:
+    return SyncOptions(
+        keep_both_on_conflict=bool(options.get("keep_both", False)),
+        incremental=bool(options.get("incremental", True)),
+        remote_root=options.get("remote_root") or None,
+        chunk_min_size=options.get("chunk_min_size"),
+    )
+
+
+def options_to_dict(options: SyncOptions) -> dict:
+    return {
+        "keep_both": options.keep_both_on_conflict,
+        "incremental": options.incremental,
+        "remote_root": options.remote_root,
+        "chunk_min_size": options.chunk_min_size,
+    }
+
+
+def _row_snapshot(row: SyncJob) -> dict:
+    return {
+        "sync_id": row.sync_id,
+        "status": row.status,
+        "progress": row.progress,
+        "error": row.error,
+        "stats": json.loads(row.stats or "{}"),
+    }
+
+
+def _disk_of(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+@dataclass
+class RunningJob:
+    id: int
+    sync_id: str
+    user_id: int
+    engine: SyncEngine
+    status: str = "queued"
+    error: Optional[str] = None
+    stop_requested: bool = False
+    started: bool = False
+    task: Optional[asyncio.Task] = None
+    persisted: Optional[tuple] = None
+    checkpoint: Optional[dict] = None
+
+    def snapshot(self) -> dict:
+        st = self.engine.status()
+        return {
+            "sync_id": self.sync_id,
+            "status": self.status,
+            "progress": st["progress"] if self.status != "queued" else 0,
+            "error": self.error,
+            "stats": {k: st[k] for k in ("scanned", "skipped", "changed", "removed")},
+            "errors": len(st["errors"]),
+        }
+
+
+class SyncOrchestrator:
+    """Runs sync jobs concurrently and mirrors their state into the sync_jobs table.
+
+    A global slot count caps concurrent jobs and each disk (st_dev) has its own smaller
+    budget, so backup sets on different disks run in parallel while jobs on the same disk
+    do not thrash it. Hashing across all jobs shares one HashPool, which bounds CPU use.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        max_jobs: int = SYNC_MAX_JOBS,
+        jobs_per_disk: int = SYNC_JOBS_PER_DISK,
+        flush_seconds: float = SYNC_STATE_FLUSH_SECONDS,
+        hash_pool: Optional[HashPool] = None,
+    ):
+        self.session_factory = session_factory
+        self.jobs_per_disk = jobs_per_disk
+        self.flush_seconds = flush_seconds
+        self.hash_pool = hash_pool
+        self.jobs: dict[str, RunningJob] = {}
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._disks: dict[int, asyncio.Semaphore] = {}
+        self._reporter: Optional[asyncio.Task] = None
+        self.watches: dict[str, ContinuousSync] = {}
+
+    async def submit(
+        self,
+        user_id: int,
+        mode: str,
+        paths: list[str],
+        exclusions: list[str],
+        options: SyncOptions,
+        sync_id: Optional[str] = None,
+    ) -> str:
+        sync_id = sync_id or uuid.uuid4().hex
+        self._check_idle(sync_id)
+        async with self.session_factory() as session:
+            result = await session.execute(select(SyncJob).where(SyncJob.sync_id == sync_id, SyncJob.user_id == user_id))
+            row = result.scalars().first()
+            if row is None:
+                row = SyncJob(sync_id=sync_id, user_id=user_id)
+                session.add(row)
+            row.mode = mode
+            row.paths = json.dumps(paths)
+            row.exclusions = json.dumps(exclusions)
+            row.options = json.dumps(options_to_dict(options))
+            row.status = "queued"
+            row.progress = 0
+            row.error = None
+            row.checkpoint = None
+            row.updated_at = utcnow()
+            await session.commit()
+            self._launch(row.id, sync_id, user_id, mode, paths, exclusions, options)
+        return sync_id
+
+    async def resume(self, sync_id: str, user_id: int) -> None:
+        self._check_idle(sync_id)
+        async with self.session_factory() as session:
+            result = await session.execute(select(SyncJob).where(SyncJob.sync_id == sync_id, SyncJob.user_id == user_id))
+            row = result.scalars().first()
+            if row is None:
+                raise LookupError(sync_id)
+            row.status = "queued"
+            row.error = None
+            row.updated_at = utcnow()
+            await session.commit()
+            self._launch(
+                row.id,
+                sync_id,
+                user_id,
+                row.mode,
+                json.loads(row.paths),
+                json.loads(row.exclusions or "[]"),
+                options_from_dict(json.loads(row.options or "{}")),
+                checkpoint=json.loads(row.checkpoint) if row.checkpoint else None,
+            )
+
+    def stop(self, sync_id: str) -> bool:
+        job = self.jobs.get(sync_id)
+        if job is None or job.status not in ACTIVE:
+            return False
+        job.stop_requested = True
+        # A running engine stops cooperatively at its next batch and writes a checkpoint.
+        job.engine.stop()
+        # A job waiting for a slot is simply cancelled. A task cancelled before its first step
+        # never enters _run, so one that has not started yet sees stop_requested instead.
+        if job.started and job.status == "queued" and job.task is not None:
+            job.task.cancel()
+        return True
+
+    def status(self, sync_id: str) -> Optional[dict]:
+        job = self.jobs.get(sync_id)
+        return job.snapshot() if job is not None else None
+
+    def running(self, user_id: Optional[int] = None) -> list[RunningJob]:
+        return [j for j in self.jobs.values() if j.status in ACTIVE and (user_id is None or j.user_id == user_id)]
+
+    async def list_jobs(self, user_id: int) -> list[dict]:
+        async with self.session_factory() as session:
+            result = await session.execute(select(SyncJob).where(SyncJob.user_id == user_id).order_by(SyncJob.id))
+            rows = result.scalars().all()
+        out = []
+        for row in rows:
+            live = self.jobs.get(row.sync_id)
+            out.append(live.snapshot() if live is not None and live.user_id == user_id else _row_snapshot(row))
+        return out
+
+    async def job_status(self, sync_id: str, user_id: int) -> Optional[dict]:
+        # Finished jobs leave self.jobs, so fall back to the persisted row as list_jobs does.
+        live = self.jobs.get(sync_id)
+        if live is not None:
+            return live.snapshot() if live.user_id == user_id else None
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(SyncJob).where(SyncJob.sync_id == sync_id, SyncJob.user_id == user_id).order_by(SyncJob.id.desc())
+            )
+            row = result.scalars().first()
+        return _row_snapshot(row) if row is not None else None
+
+    async def recover(self) -> int:
+        """Mark jobs left active by a previous process as interrupted, resuming them if configured."""
+        async with self.session_factory() as session:
+            result = await session.execute(select(SyncJob.sync_id, SyncJob.user_id).where(SyncJob.status.in_(ACTIVE)))
+            stale = result.all()
+            await session.execute(
+                update(SyncJob).where(SyncJob.status.in_(ACTIVE)).values(status="interrupted", updated_at=utcnow())
+            )
+            await session.commit()
+        if SYNC_RESUME_ON_START:
+            for sync_id, user_id in stale:
+                await self.resume(sync_id, user_id)
+        return len(stale)
+
+    async def shutdown(self) -> None:
+        for sync_id in list(self.watches):
+            await self.unwatch(sync_id)
+        jobs = [j for j in self.jobs.values() if j.task is not None]
+        for j in jobs:
+            j.engine.stop()
+            if j.status == "queued":
+                j.task.cancel()
+        # Give running engines time to checkpoint before they are cancelled outright.
+        _, late = await asyncio.wait([j.task for j in jobs], timeout=SYNC_SHUTDOWN_GRACE_SECONDS) if jobs else ((), ())
+        for t in late:
+            t.cancel()
+        await asyncio.gather(*(j.task for j in jobs), return_exceptions=True)
+        if self._reporter is not None:
+            self._reporter.cancel()
+            try:
+                await self._reporter
+            except asyncio.CancelledError:
+                pass
+            self._reporter = None
+
+    async def watch(self, sync_id: str, user_id: int) -> None:
+        """Keep a configured job's paths in sync continuously from filesystem events."""
+        if sync_id in self.watches:
+            return
+        async with self.session_factory() as session:
+            result = await session.execute(select(SyncJob).where(SyncJob.sync_id == sync_id, SyncJob.user_id == user_id))
+            row = result.scalars().first()
+            if row is None:
+                raise LookupError(sync_id)
+            mode = row.mode
+            paths = json.loads(row.paths)
+            exclusions = json.loads(row.exclusions or "[]")
+            options = options_from_dict(json.loads(row.options or "{}"))
+        if not options.incremental:
+            raise ValueError("Continuous sync needs incremental mode")
+        transfers = None
+        if options.remote_root and mode == "oneway":
+            transfers = TransferScheduler(await get_drive_pool().get(user_id))
+        live = ContinuousSync(
+            user_id,
+            paths,
+            exclusions,
+            options,
+            hash_pool=self.hash_pool,
+            is_busy=lambda: (j := self.jobs.get(sync_id)) is not None and j.status in ACTIVE,
+            transfers=transfers,
+        )
+        await live.start()
+        self.watches[sync_id] = live
+
+    async def unwatch(self, sync_id: str) -> bool:
+        live = self.watches.pop(sync_id, None)
+        if live is None:
+            return False
+        await live.stop()
+        return True
+
+    def _check_idle(self, sync_id: str) -> None:
+        job = self.jobs.get(sync_id)
+        if job is not None and job.status in ACTIVE:
+            raise ValueError(f"Sync {sync_id} is already running")
+
+    def _launch(self, job_id, sync_id, user_id, mode, paths, exclusions, options, checkpoint=None) -> None:
+        job = RunningJob(job_id, sync_id, user_id, SyncEngine(hash_pool=self.hash_pool), checkpoint=checkpoint)
+        self.jobs[sync_id] = job
+        job.task = asyncio.create_task(self._run(job, mode, paths, exclusions, options), name=f"sync-{sync_id}")
+        if self._reporter is None or self._reporter.done():
+            self._reporter = asyncio.create_task(self._report(), name="sync-reporter")
+
+    def _disk(self, dev: int) -> asyncio.Semaphore:
+        sem = self._disks.get(dev)
+        if sem is None:
+            sem = self._disks[dev] = asyncio.Semaphore(self.jobs_per_disk)
+        return sem
+
+    async def _run(self, job: RunningJob, mode, paths, exclusions, options) -> None:
+        # Sorted so two jobs spanning the same disks always acquire them in the same order.
+        disks = sorted({d for d in map(_disk_of, paths) if d is not None})
+        job.started = True
+        transfers: Optional[TransferScheduler] = None
+        try:
+            if not job.stop_requested:
+                async with AsyncExitStack() as stack:
+                    for dev in disks:
+                        await stack.enter_async_context(self._disk(dev))
+                    # The global slot last: a job waiting for a busy disk must not hold one
+                    # that a job on an idle disk could use.
+                    await stack.enter_async_context(self._slots)
+                    job.status = "running"
+                    if options.remote_root and mode == "oneway":
+                        transfers = TransferScheduler(await get_drive_pool().get(job.user_id))
+                    finished = await job.engine.start(
+                        mode,
+                        paths,
+                        exclusions,
+                        options,
+                        user_id=job.user_id,
+                        checkpoint=job.checkpoint,
+                        on_checkpoint=lambda cp: self._save_checkpoint(job, cp),
+                        transfers=transfers,
+                    )
+                    if finished:
+                        job.status = "completed"
+            if job.status != "completed":
+                job.status = "stopped" if job.stop_requested else "interrupted"
+        except asyncio.CancelledError:
+            job.status = "stopped" if job.stop_requested else "interrupted"
+        except Exception as exc:
+            logger.exception(f"sync {job.sync_id} failed")
+            job.status = "failed"
+            job.error = str(exc)
+        finally:
+            if transfers is not None:
+                transfers.shutdown()
+            try:
+                await self._persist([job])
+            except Exception as exc:
+                logger.warning(f"sync state write failed: {exc}")
+            if self.jobs.get(job.sync_id) is job:
+                del self.jobs[job.sync_id]
+
+    async def _save_checkpoint(self, job: RunningJob, checkpoint: Optional[dict]) -> None:
+        job.checkpoint = checkpoint
+        async with self.session_factory() as session:
+            await session.execute(
+                update(SyncJob)
+                .where(SyncJob.id == job.id)
+                .values(checkpoint=json.dumps(checkpoint) if checkpoint is not None else None, updated_at=utcnow())
+            )
+            await session.commit()
+
+    async def _persist(self, jobs: list[RunningJob]) -> None:
+        rows = []
+        for j in jobs:
+            snap = j.snapshot()
+            key = (snap["status"], snap["progress"], snap["error"], tuple(snap["stats"].values()))
+            if key == j.persisted:
+                continue
+            j.persisted = key
+            rows.append(
+                {
+                    "b_id": j.id,
+                    "b_status": snap["status"],
+                    "b_progress": snap["progress"],
+                    "b_stats": json.dumps(snap["stats"]),
+                    "b_error": snap["error"],
+                    "b_updated": utcnow(),
+                }
+            )
+        if not rows:
+            return
+        async with self.session_factory() as session:
+            await session.execute(
+                update(_table)
+                .where(_table.c.id == bindparam("b_id"))
+                .values(
+                    status=bindparam("b_status"),
+                    progress=bindparam("b_progress"),
+                    stats=bindparam("b_stats"),
+                    error=bindparam("b_error"),
+                    updated_at=bindparam("b_updated"),
+                ),
+                rows,
+            )
+            await session.commit()
+
+    async def _report(self) -> None:
+        # One writer for every job's progress: a single executemany per interval instead of a
+        # write per file per job.
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self._persist(list(self.jobs.values()))
+            except Exception as exc:
+                logger.warning(f"sync state write failed: {exc}")
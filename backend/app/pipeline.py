@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Optional, TypeVar, Union
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def bounded_map(
+    items: Union[Iterable[T], AsyncIterable[T]],
+    fn: Callable[[T], Awaitable[R]],
+    limit: int,
+) -> AsyncIterator[tuple[T, Optional[R], Optional[Exception]]]:
+    # Runs fn over items concurrently and yields (item, result, error) in completion order.
+    # At most `limit` items are in flight or waiting to be consumed, so a slow consumer
+    # stalls the producer instead of buffering the whole input.
+    results: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max(1, limit))
+    done = object()
+
+    async def run_one(item: T) -> None:
+        try:
+            results.put_nowait((item, await fn(item), None))
+        except Exception as exc:
+            results.put_nowait((item, None, exc))
+
+    async def produce() -> None:
+        tasks: set[asyncio.Task] = set()
+
+        async def submit(item: T) -> None:
+            await slots.acquire()
+            t = asyncio.create_task(run_one(item))
+            tasks.add(t)
+            t.add_done_callback(tasks.discard)
+
+        try:
+            if hasattr(items, "__aiter__"):
+                async for item in items:  # type: ignore[union-attr]
+                    await submit(item)
+            else:
+                for item in items:  # type: ignore[union-attr]
+                    await submit(item)
+            if tasks:
+                await asyncio.gather(*list(tasks))
+        finally:
+            for t in list(tasks):
+                t.cancel()
+            results.put_nowait(done)
+            # An abandoned source generator would otherwise hold its resources until GC.
+            aclose = getattr(items, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            res = await results.get()
+            if res is done:
+                break
+            slots.release()
+            yield res
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import os
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional
+
+from .file_index import IndexEntry
+from .remote_tree import RemoteEntry
+
+# Execution order: nothing is deleted before the renames and copies that might still need it.
+ACTION_ORDER = ("conflict_copy", "rename", "upload", "download", "delete", "forget", "record")
+PLAN_BATCH_SIZE = int(os.getenv("PLAN_BATCH_SIZE", "100"))
+
+@dataclass(slots=True)
+class LocalFile:
+    path: str  # relative, "/"-separated like RemoteEntry.path
+    size: int
+    mtime: float
+    sha256: str
+
+
+@dataclass(slots=True)
+class Action:
+    kind: str  # one of ACTION_ORDER
+    side: str  # where it is applied: local|remote|index
+    path: str  # destination for renames and conflict copies
+    src: Optional[str] = None
+    remote_id: Optional[str] = None
+    size: int = 0
+    folder: bool = False
+    reason: str = ""
+
+    def to_dict(self) -> dict:
+        out = {"kind": self.kind, "side": self.side, "path": self.path, "size": self.size, "reason": self.reason}
+        if self.src is not None:
+            out["src"] = self.src
+        if self.remote_id is not None:
+            out["remote_id"] = self.remote_id
+        if self.folder:
+            out["folder"] = True
+        return out
+
+
+@dataclass
+class Plan:
+    actions: list[Action] = field(default_factory=list)
+
+    def ordered(self) -> list[Action]:
+        rank = {k: i for i, k in enumerate(ACTION_ORDER)}
+        # Folder renames go first so file actions below them see the new layout.
+        return sorted(self.actions, key=lambda a: (rank[a.kind], not a.folder))
+
+    def batches(self, size: int = PLAN_BATCH_SIZE) -> Iterator[list[Action]]:
+        """Yield runs of same-kind actions, at most ``size`` long, in execution order."""
+        for _, group in groupby(self.ordered(), key=lambda a: (a.kind, a.side)):
+            group = list(group)
+            for i in range(0, len(group), size):
+                yield group[i : i + size]
+
+    def summary(self) -> dict:
+        counts: Counter = Counter(f"{a.kind}_{a.side}" if a.kind in ("rename", "delete") else a.kind for a in self.actions)
+        return {
+            **counts,
+            "upload_bytes": sum(a.size for a in self.actions if a.kind == "upload"),
+            "download_bytes": sum(a.size for a in self.actions if a.kind == "download"),
+            # Content that moved instead of being transferred again.
+            "renamed_bytes": sum(a.size for a in self.actions if a.kind == "rename"),
+        }
+
+    def to_dict(self, limit: Optional[int] = None) -> dict:
+        ordered = self.ordered()
+        return {
+            "summary": self.summary(),
+            "actions": [a.to_dict() for a in ordered[:limit]],
+            "truncated": limit is not None and len(ordered) > limit,
+        }
+
+
+def path_key(path: str) -> str:
+    # Same order as comparing component tuples (walker.sort_key), but a flat string is far
+    # cheaper to build and compare: NUL sorts below every character a name can contain.
+    return path.replace("/", "\0")
+
+
+def relative_path(path: str, roots: list[str]) -> Optional[str]:
+    # Each backup root maps to a top-level remote folder named after it.
+    for r in roots:
+        if path == r:
+            return os.path.basename(r)
+        prefix = r.rstrip(os.sep) + os.sep
+        if path.startswith(prefix):
+            return os.path.basename(r.rstrip(os.sep)) + "/" + path[len(prefix) :].replace(os.sep, "/")
+    return None
+
+
+def conflict_name(path: str, tag: str = "conflict copy") -> str:
+    head, sep, name = path.rpartition("/")
+    stem, ext = os.path.splitext(name)
+    return f"{head}{sep}{stem} ({tag}){ext}"
+
+
+def _remote_mtime(r: RemoteEntry) -> float:
+    try:
+        return datetime.fromisoformat(r.modified_time).timestamp() if r.modified_time else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _ancestors(path: str) -> Iterator[str]:
+    parts = path.split("/")
+    for i in range(1, len(parts)):
+        yield "/".join(parts[:i])
+
+
+def _dir_counts(paths: Iterable[str]) -> Counter:
+    # Files per folder, counted once per distinct parent and then pushed up to the ancestors.
+    parents = Counter(p.rpartition("/")[0] for p in paths)
+    counts: Counter = Counter()
+    for d, n in parents.items():
+        while d:
+            counts[d] += n
+            d = d.rpartition("/")[0]
+    return counts
+
+
+def _merged(*sides: list) -> Iterator[list]:
+    """Yield ``[local, base, remote]`` per path, in path order; absent sides are None."""
+    # Every side is normally in path order already (walker and index both produce it), so
+    # sorting the concatenation is a C-level merge of three runs.
+    rows = [(path_key(x.path), tag, x) for tag, items in enumerate(sides) for x in items]
+    rows.sort(key=itemgetter(0))
+    i, n = 0, len(rows)
+    while i < n:
+        key = rows[i][0]
+        found: list = [None, None, None]
+        while i < n and rows[i][0] == key:
+            found[rows[i][1]] = rows[i][2]
+            i += 1
+        yield found
+
+
+def _collapse(
+    renames: list[Action],
+    base_under: Counter,
+    side_under: Counter,
+    folder_ids: Optional[dict[str, str]],
+) -> list[Action]:
+    """Replace file renames that together move a whole folder with one folder rename.
+
+    A folder qualifies when every synced file below it moved to the same relative place under
+    one new folder, nothing else lives in it on the side being changed, and the target does
+    not exist there yet. The highest qualifying folder wins.
+    """
+    # Renames between the same two folders share their candidate folder pairs.
+    by_dirs: dict[tuple[str, str, bool], list[Action]] = defaultdict(list)
+    for a in renames:
+        src_dir, _, src_name = a.src.rpartition("/")
+        dst_dir, _, dst_name = a.path.rpartition("/")
+        by_dirs[(src_dir, dst_dir, src_name == dst_name)].append(a)
+    candidates: dict[tuple[str, str, bool], list[tuple[str, str]]] = {}
+    groups: Counter = Counter()
+    for (src_dir, dst_dir, same_name), members in by_dirs.items():
+        pairs: list[tuple[str, str]] = []
+        if same_name and src_dir and dst_dir:
+            s, d = src_dir.split("/"), dst_dir.split("/")
+            k = 0
+            while k < min(len(s), len(d)) - 1 and s[-1 - k] == d[-1 - k]:
+                k += 1
+            # Highest folder first: ("a/x", "b/x") before ("a/x/y", "b/x/y").
+            pairs = [("/".join(s[: len(s) - m]), "/".join(d[: len(d) - m])) for m in range(k, -1, -1)]
+        candidates[(src_dir, dst_dir, same_name)] = pairs
+        for p in pairs:
+            groups[p] += len(members)
+
+    def complete(pair: tuple[str, str]) -> bool:
+        src, dst = pair
+        if folder_ids is not None and (src not in folder_ids or dst in folder_ids):
+            return False
+        n = groups[pair]
+        return n == base_under[src] == side_under[src] and side_under[dst] == 0
+
+    out: list[Action] = []
+    folders: dict[tuple[str, str], Action] = {}
+    for dirs, members in by_dirs.items():
+        pair = next((p for p in candidates[dirs] if complete(p)), None)
+        if pair is None:
+            out += members
+            continue
+        folder = folders.get(pair)
+        if folder is None:
+            folder = folders[pair] = Action(
+                "rename",
+                members[0].side,
+                pair[1],
+                src=pair[0],
+                remote_id=folder_ids.get(pair[0]) if folder_ids is not None else None,
+                folder=True,
+                reason="folder moved",
+            )
+            out.append(folder)
+        folder.size += sum(a.size for a in members)
+    return out
+
+
+def plan_sync(
+    local: Iterable[LocalFile],
+    base: Iterable[IndexEntry],
+    remote: Iterable[RemoteEntry],
+    mode: str = "twoway",
+    keep_both: bool = False,
+    skip: Iterable[str] = (),
+) -> Plan:
+    """Reconcile the local scan, the index (last synced state) and the remote snapshot.
+
+    All three are keyed by relative path and joined in one sort-merge pass; inputs that are
+    already in path order cost nothing to sort. In ``oneway`` mode local is authoritative and
+    the remote side is only ever changed. Paths whose local state is unknown (``skip``: files
+    or whole folders that could not be read) get no actions at all. A path present on both
+    sides but never synced is only recorded in the index when Drive's SHA-256 matches the
+    local hash. Renames and moves are found by content hash (local) and by Drive file id or
+    md5 (remote), so moving files turns into metadata-only operations.
+    """
+    twoway = mode == "twoway"
+    skip = set(skip)
+    remote = list(remote)
+    folder_ids = {r.path: r.id for r in remote if r.is_folder}
+    remote_files = [r for r in remote if not r.is_folder]
+    # The base is what the last completed transfer left on both sides. A row that never went
+    # through one only says the file was scanned, so its path counts as never synced.
+    base = [b for b in base if b.remote_id is not None]
+    local = list(local)
+
+    actions: list[Action] = []
+    # Candidates for rename pairing, resolved after the merge.
+    new_local: dict[str, list[LocalFile]] = defaultdict(list)
+    gone_local: list[tuple[IndexEntry, RemoteEntry]] = []
+    new_remote: list[RemoteEntry] = []
+    gone_remote: list[tuple[LocalFile, IndexEntry]] = []
+
+    def upload(f: LocalFile, r: Optional[RemoteEntry], reason: str) -> None:
+        actions.append(Action("upload", "remote", f.path, remote_id=r.id if r else None, size=f.size, reason=reason))
+
+    def download(r: RemoteEntry, reason: str) -> None:
+        actions.append(Action("download", "local", r.path, remote_id=r.id, size=r.size or 0, reason=reason))
+
+    def delete_remote(r: RemoteEntry, reason: str) -> None:
+        actions.append(Action("delete", "remote", r.path, remote_id=r.id, size=r.size or 0, reason=reason))
+
+    def conflict(f: LocalFile, r: RemoteEntry) -> None:
+        if not twoway:
+            return upload(f, r, "local wins")
+        if keep_both:
+            copy = conflict_name(f.path)
+            actions.append(Action("conflict_copy", "local", copy, src=f.path, size=f.size, reason="both changed"))
+            actions.append(Action("upload", "remote", copy, size=f.size, reason="conflict copy"))
+            return download(r, "both changed")
+        if f.mtime >= _remote_mtime(r):
+            upload(f, r, "both changed, local newer")
+        else:
+            download(r, "both changed, remote newer")
+
+    for L, B, R in _merged(local, base, remote_files):
+        path = (L or B or R).path
+        if skip and (path in skip or any(a in skip for a in _ancestors(path))):
+            continue
+        local_changed = L is not None and (B is None or L.sha256 != B.synced_sha256)
+        remote_changed = R is not None and (B is None or R.id != B.remote_id or R.etag != B.remote_etag)
+
+        if L is not None and R is not None:
+            if B is None and R.sha256 == L.sha256:
+                # Already identical (a first sync over an existing copy): only the base is missing.
+                actions.append(Action("record", "index", path, remote_id=R.id, size=L.size, reason="identical on both sides"))
+            elif local_changed and remote_changed:
+                conflict(L, R)
+            elif local_changed:
+                upload(L, R, "changed locally")
+            elif remote_changed:
+                if twoway:
+                    download(R, "changed remotely")
+                else:
+                    upload(L, R, "restore remote copy")
+        elif L is not None:
+            if B is None:
+                new_local[L.sha256].append(L)
+            elif twoway and not local_changed:
+                gone_remote.append((L, B))
+            else:
+                upload(L, None, "changed locally" if local_changed else "missing remotely")
+        elif R is not None:
+            if B is None:
+                if twoway:
+                    new_remote.append(R)
+                else:
+                    delete_remote(R, "not in local tree")
+            elif remote_changed and twoway:
+                download(R, "changed remotely")
+            elif remote_changed:
+                delete_remote(R, "deleted locally")
+            else:
+                gone_local.append((B, R))
+        elif B is not None:
+            actions.append(Action("forget", "index", path, reason="deleted on both sides"))
+
+    # Local moves: a file that vanished locally reappeared elsewhere with the same content.
+    remote_renames: list[Action] = []
+    for B, R in gone_local:
+        same = new_local.get(B.synced_sha256) if B.synced_sha256 else None
+        if same:
+            f = same.pop(0)
+            remote_renames.append(Action("rename", "remote", f.path, src=R.path, remote_id=R.id, size=f.size, reason="moved locally"))
+        else:
+            delete_remote(R, "deleted locally")
+    for files in new_local.values():
+        for f in files:
+            upload(f, None, "new locally")
+
+    # Remote moves: the same Drive file (or a byte-identical one) now lives at another path.
+    local_renames: list[Action] = []
+    if gone_remote:
+        by_id = {B.remote_id: (L, B) for L, B in gone_remote}
+        by_md5 = {B.remote_etag: (L, B) for L, B in gone_remote if B.remote_etag}
+        renamed: set[str] = set()
+        for R in new_remote:
+            match = by_id.pop(R.id, None) or (by_md5.pop(R.md5, None) if R.md5 else None)
+            if match is None or match[0].path in renamed:
+                download(R, "new remotely")
+                continue
+            L, _ = match
+            renamed.add(L.path)
+            local_renames.append(Action("rename", "local", R.path, src=L.path, remote_id=R.id, size=L.size, reason="moved remotely"))
+        for L, B in gone_remote:
+            if L.path not in renamed:
+                actions.append(Action("delete", "local", L.path, remote_id=B.remote_id, size=L.size, reason="deleted remotely"))
+    else:
+        for R in new_remote:
+            download(R, "new remotely")
+
+    base_under = _dir_counts(b.path for b in base)
+    if remote_renames:
+        actions += _collapse(remote_renames, base_under, _dir_counts(r.path for r in remote_files), folder_ids)
+    if local_renames:
+        actions += _collapse(local_renames, base_under, _dir_counts(f.path for f in local), None)
+    return Plan(actions)
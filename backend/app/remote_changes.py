@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Optional
+
+from googleapiclient.errors import HttpError
+from loguru import logger
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .google_drive import GoogleDriveClient
+from .models import DriveState, RemoteFile
+from .remote_tree import RemoteEntry, RemoteTree, load_snapshot, save_snapshot
+
+
+@dataclass
+class RemoteDelta:
+    token: str
+    changed: list[RemoteEntry] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    full_listing: bool = False
+
+
+async def load_page_token(session: AsyncSession, user_id: int) -> Optional[str]:
+    result = await session.execute(select(DriveState.start_page_token).where(DriveState.user_id == user_id))
+    return result.scalar_one_or_none()
+
+
+async def save_page_token(session: AsyncSession, user_id: int, token: str, root_id: Optional[str] = None) -> None:
+    state = await session.get(DriveState, user_id)
+    if state is None:
+        state = DriveState(user_id=user_id)
+        session.add(state)
+    state.start_page_token = token
+    if root_id is not None:
+        state.root_id = root_id
+    await session.commit()
+
+
+async def resolve_root(session: AsyncSession, user_id: int, root_id: str) -> str:
+    """The folder id behind ``root_id``, with the "root" alias mapped to the id Drive gave it.
+
+    Stays "root" until a refresh has resolved it once.
+    """
+    if root_id != "root":
+        return root_id
+    result = await session.execute(select(DriveState.root_id).where(DriveState.user_id == user_id))
+    return result.scalar_one_or_none() or root_id
+
+
+def _row(user_id: int, e: RemoteEntry) -> dict:
+    return {
+        "user_id": user_id,
+        "file_id": e.id,
+        "parent_id": e.parent_id,
+        "name": e.name,
+        "path": e.path,
+        "mime_type": e.mime_type,
+        "md5": e.md5,
+        "sha256": e.sha256,
+        "size": e.size,
+        "modified_time": e.modified_time,
+    }
+
+
+async def _persist_delta(session: AsyncSession, user_id: int, changed: list[RemoteEntry], removed: list[str]) -> None:
+    ids = [e.id for e in changed] + removed
+    for i in range(0, len(ids), 500):
+        await session.execute(
+            delete(RemoteFile).where(RemoteFile.user_id == user_id, RemoteFile.file_id.in_(ids[i : i + 500]))
+        )
+    if changed:
+        await session.execute(insert(RemoteFile), [_row(user_id, e) for e in changed])
+    # The file index is left alone: it is the last synced state the planner diffs this
+    # snapshot against, and only a completed transfer moves it.
+    await session.commit()
+
+
+async def refresh_remote_tree(user_id: int, client: GoogleDriveClient, root_id: str) -> tuple[RemoteTree, RemoteDelta]:
+    """Bring the persisted remote snapshot up to date using the Drive changes feed.
+
+    The first call records a start token and does one full listing; later calls only fetch
+    and apply the changes made since the previous run. A token Drive no longer accepts is
+    replaced by a fresh one and a full listing. Drive is called with no session open
+    and the result is written afterwards, so the single writer connection is never held
+    across network I/O.
+    """
+    from .db import AsyncSessionLocal, ReadSessionLocal
+
+    async with ReadSessionLocal() as session:
+        root_id = await resolve_root(session, user_id, root_id)
+        token = await load_page_token(session, user_id)
+    resolved: Optional[str] = None
+    if root_id == "root":
+        root_id = resolved = (await asyncio.to_thread(client.get_file, "root", "id"))["id"]
+
+    if token is not None:
+        try:
+            changes, new_token = await asyncio.to_thread(client.list_changes, token)
+        except HttpError as exc:
+            # 400/410: the token is malformed or too old for Drive to replay from.
+            if exc.resp.status not in (400, 410):
+                raise
+            logger.warning(f"Drive rejected the saved changes token ({exc.resp.status}), relisting")
+            new_token = None
+        if new_token is not None:
+            async with ReadSessionLocal() as session:
+                tree = await load_snapshot(session, user_id, root_id)
+            changed, removed = tree.apply_changes(changes)
+            tree.warm(client)
+            # Changes outside root_id are stored too; a refresh of another root needs them.
+            touched = {c.get("fileId") for c in changes}
+            stored = {e.id: e for e in changed} | {i: tree.entries[i] for i in touched if i in tree.entries}
+            gone = [i for i in touched if i is not None and i not in tree.entries]
+            async with AsyncSessionLocal() as session:
+                await _persist_delta(session, user_id, list(stored.values()), gone)
+                await save_page_token(session, user_id, new_token, resolved)
+            return tree, RemoteDelta(token=new_token, changed=changed, removed=removed)
+
+    # Take the token before listing so nothing changed during the listing is missed.
+    token = await asyncio.to_thread(client.get_start_page_token)
+    tree = await asyncio.to_thread(RemoteTree.fetch, client, root_id)
+    async with AsyncSessionLocal() as session:
+        await save_snapshot(session, user_id, tree)
+        await save_page_token(session, user_id, token, resolved)
+    return tree, RemoteDelta(token=token, changed=tree.files(), full_listing=True)
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .google_drive import FOLDER_MIME, GoogleDriveClient
+from .models import RemoteFile
+
+TREE_FIELDS = "files(id,name,md5Checksum,sha256Checksum,mimeType,modifiedTime,parents,size)"
+
+
+@dataclass(slots=True)
+class RemoteEntry:
+    id: str
+    name: str
+    parent_id: Optional[str]
+    mime_type: str
+    md5: Optional[str] = None
+    size: Optional[int] = None
+    modified_time: Optional[str] = None
+    path: str = ""
+    sha256: Optional[str] = None
+
+    @property
+    def is_folder(self) -> bool:
+        return self.mime_type == FOLDER_MIME
+
+    @property
+    def etag(self) -> Optional[str]:
+        # Drive v3 has no etag on files; the content checksum (or mtime for native docs) plays that role.
+        return self.md5 or self.modified_time
+
+    @classmethod
+    def from_api(cls, f: dict) -> "RemoteEntry":
+        parents = f.get("parents") or []
+        size = f.get("size")
+        return cls(
+            id=f["id"],
+            name=f.get("name", ""),
+            parent_id=parents[0] if parents else None,
+            mime_type=f.get("mimeType", ""),
+            md5=f.get("md5Checksum"),
+            size=int(size) if size is not None else None,
+            modified_time=f.get("modifiedTime"),
+            sha256=f.get("sha256Checksum"),
+        )
+
+
+class RemoteTree:
+    """Snapshot of everything below a Drive folder, addressable by id and by relative path.
+
+    ``entries`` keeps the whole listing, including what lies outside ``root_id``: the changes
+    token is per user, so a persisted snapshot has to serve a tree for any root.
+    """
+
+    def __init__(self, root_id: str, entries: Iterable[RemoteEntry]):
+        self.root_id = root_id
+        self.entries: dict[str, RemoteEntry] = {e.id: e for e in entries}
+        self._index()
+
+    def _index(self) -> None:
+        for e in self.entries.values():
+            e.path = ""
+        self.by_id: dict[str, RemoteEntry] = dict(self.entries)
+        self.by_path: dict[str, RemoteEntry] = {}
+        self._resolve_paths()
+
+    def _resolve_paths(self) -> None:
+        # Entries whose parent chain never reaches root_id (other folders, orphans) are dropped.
+        resolved: dict[str, Optional[str]] = {self.root_id: ""}
+
+        def path_of(entry_id: str) -> Optional[str]:
+            chain: list[str] = []
+            cur: Optional[str] = entry_id
+            while cur is not None and cur not in resolved:
+                if cur in chain or cur not in self.by_id:
+                    break
+                chain.append(cur)
+                cur = self.by_id[cur].parent_id
+            base = resolved.get(cur) if cur is not None else None
+            for eid in reversed(chain):
+                if base is not None:
+                    name = self.by_id[eid].name
+                    base = f"{base}/{name}" if base else name
+                resolved[eid] = base
+            return resolved.get(entry_id)
+
+        for entry_id in list(self.by_id):
+            p = path_of(entry_id)
+            if p is None or entry_id == self.root_id:
+                del self.by_id[entry_id]
+                continue
+            entry = self.by_id[entry_id]
+            entry.path = p
+            self.by_path.setdefault(p, entry)
+
+    def apply_changes(self, changes: Iterable[dict]) -> tuple[list[RemoteEntry], list[str]]:
+        # Applies a Drive changes feed page set in place. Returns the entries that were added,
+        # modified or re-pathed (e.g. children of a moved folder) and the ids that left the tree.
+        old_paths = {eid: e.path for eid, e in self.by_id.items()}
+        touched: set[str] = set()
+        for c in changes:
+            fid = c.get("fileId")
+            f = c.get("file")
+            touched.add(fid)
+            if c.get("removed") or not f or f.get("trashed"):
+                self.entries.pop(fid, None)
+            else:
+                self.entries[fid] = RemoteEntry.from_api(f)
+        self._index()
+        changed = [e for eid, e in self.by_id.items() if eid in touched or old_paths.get(eid) != e.path]
+        removed = [eid for eid in old_paths if eid not in self.by_id]
+        return changed, removed
+
+    @classmethod
+    def fetch(cls, client: GoogleDriveClient, root_id: str = "root") -> "RemoteTree":
+        # One paginated listing of every file the app can see, instead of a query per folder.
+        if root_id == "root":
+            root_id = client.get_file("root", fields="id")["id"]
+        entries = [RemoteEntry.from_api(f) for f in client.iter_files("trashed=false", fields=TREE_FIELDS)]
+        tree = cls(root_id, entries)
+        tree.warm(client)
+        return tree
+
+    def warm(self, client: GoogleDriveClient) -> None:
+        for e in self.by_id.values():
+            if e.is_folder:
+                client.folders.put(e.parent_id, e.name, e.id)
+
+    def folder_id(self, path: str) -> Optional[str]:
+        if not path:
+            return self.root_id
+        e = self.by_path.get(path)
+        return e.id if e is not None and e.is_folder else None
+
+    def files(self) -> list[RemoteEntry]:
+        return [e for e in self.by_id.values() if not e.is_folder]
+
+
+async def save_snapshot(session: AsyncSession, user_id: int, tree: RemoteTree) -> None:
+    await session.execute(delete(RemoteFile).where(RemoteFile.user_id == user_id))
+    rows = [
+        {
+            "user_id": user_id,
+            "file_id": e.id,
+            "parent_id": e.parent_id,
+            "name": e.name,
+            "path": e.path,
+            "mime_type": e.mime_type,
+            "md5": e.md5,
+            "sha256": e.sha256,
+            "size": e.size,
+            "modified_time": e.modified_time,
+        }
+        for e in tree.entries.values()
+    ]
+    if rows:
+        await session.execute(insert(RemoteFile), rows)
+    await session.commit()
+
+
+async def load_snapshot(session: AsyncSession, user_id: int, root_id: str) -> RemoteTree:
+    result = await session.execute(
+        select(
+            RemoteFile.file_id,
+            RemoteFile.name,
+            RemoteFile.parent_id,
+            RemoteFile.mime_type,
+            RemoteFile.md5,
+            RemoteFile.size,
+            RemoteFile.modified_time,
+            RemoteFile.sha256,
+        ).where(RemoteFile.user_id == user_id)
+    )
+    return RemoteTree(root_id, (RemoteEntry(*row[:-1], sha256=row[-1]) for row in result))
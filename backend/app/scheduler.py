@@ -51,7 +51,7 @@ class PowerScheduler:
                         self.notify(evt)
                     except Exception:
                         pass
-                await notifications_manager.broadcast(evt)
+                await notifications_manager.broadcast(evt, key=f"power_countdown:{job_id}")
                 
                 # Sleep until next checkpoint or end
                 next_sleep = seconds
@@ -1,17 +1,107 @@
+from __future__ import annotations
+
 import os
-from typing import Optional
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
 
-from fastapi import Cookie, Depends, HTTPException
+from fastapi import Cookie, Depends, HTTPException, WebSocket
+from sqlalchemy import select
 
+from .models import User
 from .utils import verify_jwt
 
+# Read once at import; every HTTP and WebSocket auth check shares it.
 JWT_SECRET = os.getenv("JWT_SECRET", "change-me-jwt")
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+
+
+@dataclass(frozen=True, slots=True)
+class AuthUser:
+    sub: str
+    id: Optional[int]  # None when no User row exists for the subject
+
+
+class TokenCache:
+    """Bounded LRU of verified tokens, each kept no longer than its own ``exp``."""
+
+    def __init__(self, size: int = AUTH_CACHE_SIZE, clock: Callable[[], float] = time.time):
+        self.size = max(1, size)
+        self.clock = clock
+        self._entries: OrderedDict[str, tuple[AuthUser, float]] = OrderedDict()
+
+    def get(self, token: str) -> Optional[AuthUser]:
+        hit = self._entries.get(token)
+        if hit is None:
+            return None
+        if hit[1] <= self.clock():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return hit[0]
+
+    def put(self, token: str, user: AuthUser, exp: float) -> None:
+        self._entries[token] = (user, exp)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache()
 
 
-async def get_current_user_sub(access_token: Optional[str] = Cookie(default=None)) -> str:
+async def _user_id(sub: str) -> Optional[int]:
+    from .db import ReadSessionLocal
+
+    async with ReadSessionLocal() as session:
+        result = await session.execute(select(User.id).where(User.google_sub == sub))
+        return result.scalar_one_or_none()
+
+
+async def authenticate(token: Optional[str]) -> Optional[AuthUser]:
+    """Verify a session token and resolve its user; repeated calls are served from memory."""
+    if not token:
+        return None
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    payload = verify_jwt(token, JWT_SECRET)
+    if not payload or payload.get("sub") is None:
+        return None
+    sub = str(payload["sub"])
+    user = AuthUser(sub, await _user_id(sub))
+    # Only resolved users are cached, so a user created after the token was issued is picked up.
+    if user.id is not None and payload.get("exp"):
+        token_cache.put(token, user, float(payload["exp"]))
+    return user
+
+
+async def get_current_user(access_token: Optional[str] = Cookie(default=None)) -> AuthUser:
     if not access_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    payload = verify_jwt(access_token, JWT_SECRET)
-    if not payload:
+    user = await authenticate(access_token)
+    if user is None:
         raise HTTPException(status_code=401, detail="Invalid token")
-    return str(payload.get("sub"))
+    return user
+
+
+async def get_current_user_sub(user: AuthUser = Depends(get_current_user)) -> str:
+    return user.sub
+
+
+async def get_current_user_id(user: AuthUser = Depends(get_current_user)) -> int:
+    if user.id is None:
+        raise HTTPException(status_code=401, detail="Unknown user")
+    return user.id
+
+
+async def websocket_user(ws: WebSocket) -> Optional[AuthUser]:
+    # For WebSocket routes, which check the cookie before accepting and close with 4401 on failure.
+    return await authenticate(ws.cookies.get("access_token"))
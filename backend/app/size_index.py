@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import stat
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import orjson
+from loguru import logger
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import DirSize, SyncJob
+from .utils import GLOB_MAGIC, ExclusionMatcher, compile_exclusions
+
+# Separated by os.pathsep, on top of the folders sync jobs back up.
+SIZE_INDEX_ROOTS = os.getenv("SIZE_INDEX_ROOTS", "")
+SIZE_INDEX_INTERVAL_SECONDS = float(os.getenv("SIZE_INDEX_INTERVAL_SECONDS", "300"))
+SIZE_INDEX_WRITE_CHUNK = 5000
+
+
+@dataclass(slots=True)
+class DirNode:
+    mtime_ns: int
+    own_size: int
+    own_files: int
+    exts: dict[str, list[int]]  # suffix -> [files, bytes] of the files directly inside
+    subdirs: tuple[str, ...]
+    total_size: int = 0
+    total_files: int = 0
+
+    def same(self, other: DirNode) -> bool:
+        return (
+            self.mtime_ns == other.mtime_ns
+            and self.total_size == other.total_size
+            and self.total_files == other.total_files
+            and self.exts == other.exts
+        )
+
+
+def _scan(path: str, mtime_ns: int) -> DirNode:
+    # Same rules as walker.walk_files: real directories are descended into, symlinks to
+    # directories are skipped, anything else that stats (including symlinked files) is a file.
+    size = files = 0
+    exts: dict[str, list[int]] = {}
+    subdirs: list[str] = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                if entry.is_symlink() and entry.is_dir():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            # Everything from the last dot, so "*.bashrc" can be matched against ".bashrc" too.
+            dot = entry.name.rfind(".")
+            bucket = exts.setdefault(entry.name[dot:] if dot >= 0 else "", [0, 0])
+            bucket[0] += 1
+            bucket[1] += st.st_size
+            size += st.st_size
+            files += 1
+    return DirNode(mtime_ns, size, files, exts, tuple(sorted(subdirs)))
+
+
+def _own_files(path: str, matcher: ExclusionMatcher) -> tuple[int, int]:
+    # Bytes and count of the files directly inside ``path`` that no pattern excludes.
+    size = files = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if not matcher.match(entry.path):
+                    size, files = size + st.st_size, files + 1
+    except OSError:
+        pass
+    return size, files
+
+
+def _by_suffix(matcher: ExclusionMatcher) -> bool:
+    """Whether the per-suffix buckets are enough to apply these exclusions.
+
+    True when every pattern either names a single extension (``*.log``, ``**/*.log``) or
+    covers whole directories, which are pruned before their files are looked at.
+    """
+    for pat in matcher.patterns:
+        if pat.endswith(("/*", "/**")):
+            continue
+        ext = pat[4:] if pat.startswith("**/*") else pat[1:] if pat.startswith("*") else ""
+        if not ext.startswith(".") or "." in ext[1:] or "/" in ext or GLOB_MAGIC.search(ext):
+            return False
+    return True
+
+
+class SizeIndex:
+    """Recursive size and file count per directory, kept up to date in the background.
+
+    A refresh stats every directory but only lists those whose mtime moved, then re-adds
+    totals bottom-up. A directory's mtime does not change when a file in it is rewritten in
+    place, so such growth shows up once the directory changes for another reason.
+    """
+
+    def __init__(self, roots: Iterable[str] = (), interval: float = SIZE_INDEX_INTERVAL_SECONDS):
+        self.roots: list[str] = []
+        for root in roots:
+            self.track(root)
+        self.interval = interval
+        self.nodes: dict[str, DirNode] = {}
+        # Moves whenever any size changes; part of the fs tree ETag. Seeded from the clock so
+        # an ETag from before a restart cannot match a different state after it.
+        self.generation = time.time_ns()
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, path: str) -> None:
+        path = os.path.abspath(path)
+        if any(path == r or path.startswith(r.rstrip(os.sep) + os.sep) for r in self.roots):
+            return
+        prefix = path.rstrip(os.sep) + os.sep
+        self.roots = [r for r in self.roots if not r.startswith(prefix)] + [path]
+
+    def size_of(self, path: str) -> Optional[tuple[int, int]]:
+        node = self.nodes.get(path)
+        return None if node is None else (node.total_size, node.total_files)
+
+    def _drop(self, path: str, removed: list[str]) -> None:
+        stack = [path]
+        while stack:
+            node = self.nodes.pop(p := stack.pop(), None)
+            if node is not None:
+                removed.append(p)
+                stack.extend(os.path.join(p, n) for n in node.subdirs)
+
+    def _refresh(self, root: str) -> tuple[list[str], list[str]]:
+        changed: list[str] = []
+        removed: list[str] = []
+        dev: Optional[int] = None
+        with self._lock:
+            pending: dict[str, tuple[Optional[DirNode], DirNode]] = {}
+            stack: list[tuple[str, bool]] = [(root, False)]
+            while stack:
+                path, expanded = stack.pop()
+                if expanded:
+                    old, node = pending.pop(path)
+                    node.total_size, node.total_files = node.own_size, node.own_files
+                    for name in node.subdirs:
+                        child = self.nodes.get(os.path.join(path, name))
+                        if child is not None:
+                            node.total_size += child.total_size
+                            node.total_files += child.total_files
+                    if old is None or not old.same(node):
+                        changed.append(path)
+                    self.nodes[path] = node
+                    continue
+                old = self.nodes.get(path)
+                try:
+                    st = os.stat(path)
+                    if not stat.S_ISDIR(st.st_mode):
+                        raise NotADirectoryError(path)
+                    if dev is None:
+                        dev = st.st_dev
+                    elif st.st_dev != dev:
+                        # Another filesystem mounted below the root is not part of its size.
+                        raise NotADirectoryError(path)
+                    if old is not None and old.mtime_ns == st.st_mtime_ns:
+                        node = DirNode(old.mtime_ns, old.own_size, old.own_files, old.exts, old.subdirs)
+                    else:
+                        node = _scan(path, st.st_mtime_ns)
+                except OSError:
+                    self._drop(path, removed)
+                    continue
+                if old is not None:
+                    for name in set(old.subdirs) - set(node.subdirs):
+                        self._drop(os.path.join(path, name), removed)
+                pending[path] = (old, node)
+                stack.append((path, True))
+                stack.extend((os.path.join(path, n), False) for n in reversed(node.subdirs))
+        return changed, removed
+
+    async def refresh(self, root: Optional[str] = None) -> None:
+        for r in [os.path.abspath(root)] if root else list(self.roots):
+            changed, removed = await asyncio.to_thread(self._refresh, r)
+            await self._save(changed, removed)
+
+    async def track_backup_roots(self) -> None:
+        from .db import ReadSessionLocal
+
+        async with ReadSessionLocal() as session:
+            result = await session.execute(select(SyncJob.paths).distinct())
+            for paths in result.scalars():
+                for path in orjson.loads(paths or "[]"):
+                    if os.path.isdir(path):
+                        self.track(path)
+
+    async def load(self) -> None:
+        from .db import ReadSessionLocal
+
+        async with ReadSessionLocal() as session:
+            result = await session.stream(
+                select(
+                    DirSize.path, DirSize.mtime_ns, DirSize.own_size, DirSize.own_files, DirSize.exts,
+                    DirSize.total_size, DirSize.total_files,
+                ).execution_options(yield_per=SIZE_INDEX_WRITE_CHUNK)
+            )
+            async for rows in result.partitions():
+                for path, mtime_ns, own_size, own_files, exts, total_size, total_files in rows:
+                    self.nodes[path] = DirNode(
+                        mtime_ns, own_size, own_files, orjson.loads(exts), (), total_size, total_files
+                    )
+        children: dict[str, list[str]] = {}
+        for path in self.nodes:
+            parent = os.path.dirname(path)
+            if parent != path and parent in self.nodes:
+                children.setdefault(parent, []).append(os.path.basename(path))
+            else:
+                # Top of an indexed subtree, e.g. one an earlier estimate asked for: keep it fresh.
+                self.track(path)
+        for parent, names in children.items():
+            self.nodes[parent].subdirs = tuple(sorted(names))
+        self._loaded = True
+        self.generation += 1
+
+    async def _save(self, changed: list[str], removed: list[str]) -> None:
+        if not changed and not removed:
+            return
+        self.generation += 1
+        from .db import AsyncSessionLocal
+
+        async with AsyncSessionLocal() as session:
+            dialect = session.get_bind().dialect
+            insert = postgresql.insert if dialect.name == "postgresql" else sqlite.insert
+            stmt = insert(DirSize)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DirSize.path],
+                set_={c: stmt.excluded[c] for c in ("mtime_ns", "own_size", "own_files", "exts", "total_size", "total_files")},
+            )
+            for i in range(0, len(changed), SIZE_INDEX_WRITE_CHUNK):
+                rows = []
+                for path in changed[i : i + SIZE_INDEX_WRITE_CHUNK]:
+                    node = self.nodes.get(path)
+                    if node is not None:
+                        rows.append({
+                            "path": path,
+                            "mtime_ns": node.mtime_ns,
+                            "own_size": node.own_size,
+                            "own_files": node.own_files,
+                            "exts": orjson.dumps(node.exts).decode(),
+                            "total_size": node.total_size,
+                            "total_files": node.total_files,
+                        })
+                if rows:
+                    await session.execute(stmt, rows)
+            for i in range(0, len(removed), 500):
+                await session.execute(delete(DirSize).where(DirSize.path.in_(removed[i : i + 500])))
+            await session.commit()
+
+    def _sum(self, roots: list[str], exclusions: Iterable[str]) -> dict:
+        matcher = compile_exclusions(exclusions)
+        by_suffix = _by_suffix(matcher)
+        size = files = 0
+        missing: list[str] = []
+        for root in roots:
+            if root not in self.nodes:
+                try:
+                    st = os.stat(root)
+                except OSError:
+                    missing.append(root)
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    missing.append(root)  # could not be listed
+                elif not matcher.match(root):
+                    size, files = size + st.st_size, files + 1
+                continue
+            if matcher.prune_dir(root):
+                continue
+            stack = [root]
+            while stack:
+                node = self.nodes.get(path := stack.pop())
+                if node is None:
+                    continue
+                if not matcher:
+                    size, files = size + node.total_size, files + node.total_files
+                    continue
+                if by_suffix:
+                    # Extension patterns are checked once per suffix bucket, against a stand-in name.
+                    for ext, (count, total) in node.exts.items():
+                        if not matcher.match(os.path.join(path, "_" + ext)):
+                            size, files = size + total, files + count
+                else:
+                    own_size, own_files = _own_files(path, matcher)
+                    size, files = size + own_size, files + own_files
+                stack.extend(
+                    child for name in node.subdirs if not matcher.prune_dir(child := os.path.join(path, name))
+                )
+        return {"size": size, "files": files, "missing": missing}
+
+    async def estimate(self, paths: Iterable[str], exclusions: Iterable[str] = ()) -> dict:
+        """Bytes and files a backup of ``paths`` would cover, from the index instead of a walk.
+
+        Paths not indexed yet are indexed now and tracked from then on.
+        """
+        roots: list[str] = []
+        for p in sorted({os.path.abspath(p) for p in paths}):
+            if not any(p.startswith(r.rstrip(os.sep) + os.sep) for r in roots):
+                roots.append(p)
+        for root in roots:
+            if root not in self.nodes and os.path.isdir(root):
+                self.track(root)
+                await self.refresh(root)
+        return await asyncio.to_thread(self._sum, roots, list(exclusions))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if not self._loaded:
+                    await self.load()
+                await self.track_backup_roots()
+                await self.refresh()
+            except Exception as exc:
+                logger.warning(f"size index refresh failed: {exc}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="size-index")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_index: Optional[SizeIndex] = None
+
+
+def get_size_index() -> SizeIndex:
+    global _index
+    if _index is None:
+        _index = SizeIndex(r for r in SIZE_INDEX_ROOTS.split(os.pathsep) if r)
+    return _index
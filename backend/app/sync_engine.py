@@ -1,61 +1,590 @@
 from __future__ import annotations
 
 import asyncio
-import hashlib
 import json
 import os
-from dataclasses import dataclass
-from typing import Iterable, Optional
+import stat
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional
 
-from .utils import match_exclusions
+from .chunking import CHUNKS_FOLDER, MANIFESTS_FOLDER, ChunkStore, DriveChunkTarget, backup_file
+from .drive_batch import DriveBatch
+from .file_index import FileIndexRepository, IndexEntry, load_index, save_index
+from .hashing import HashPool, get_hash_pool, hash_file
+from .planner import LocalFile, Plan, plan_sync, relative_path
+from .remote_tree import RemoteEntry
+from .transfers import Transfer, TransferScheduler
+from .utils import compile_exclusions
+from .walker import FileEntry, sort_key, walk_batches
+
+INDEX_FLUSH_SIZE = 5000
+CHECKPOINT_SECONDS = float(os.getenv("SYNC_CHECKPOINT_SECONDS", "30"))
+# Changed files waiting for an upload slot before hashing pauses.
+UPLOAD_QUEUE_SIZE = int(os.getenv("SYNC_UPLOAD_QUEUE_SIZE", "1000"))
 
 
 @dataclass
 class SyncOptions:
     keep_both_on_conflict: bool = False
+    incremental: bool = True
+    # Drive folder id that one-way runs upload into; None only indexes.
+    remote_root: Optional[str] = None
+    # Files at least this large are uploaded as deduplicated chunks plus a manifest.
+    chunk_min_size: Optional[int] = None
+
+
+def _not_after(path: str, checkpoint: str) -> bool:
+    return sort_key(path) <= sort_key(checkpoint)
+
+
+class _LowWaterMark:
+    # Files finish out of order (hashing is concurrent), so the checkpoint is the last path
+    # in walk order before which every walked file has completed.
+    def __init__(self, start: Optional[str] = None):
+        self.value = start
+        self._order: deque[str] = deque()
+        self._done: set[str] = set()
+
+    def walked(self, path: str) -> None:
+        self._order.append(path)
+
+    def completed(self, path: str) -> None:
+        self._done.add(path)
+        while self._order and self._order[0] in self._done:
+            self.value = self._order.popleft()
+            self._done.discard(self.value)
+
+
+def _in_sync(e: IndexEntry) -> bool:
+    return e.remote_id is not None and e.synced_sha256 == e.sha256
+
+
+def _under(path: str, roots: list[str]) -> bool:
+    for r in roots:
+        if path == r or path.startswith(r.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+class _Uploader:
+    """Uploads one run's changed files into ``options.remote_root`` while the run goes on.
+
+    Files handed to ``put`` are fed to the TransferScheduler as they come, so uploads overlap
+    hashing instead of waiting for a checkpoint. Whole files go through the scheduler; with
+    ``options.chunk_min_size`` set, files at least that large go up as deduplicated chunks
+    plus a manifest instead. ``on_done`` gets every path that is finished with, uploaded or
+    failed; a cancelled transfer is not finished and does not get it.
+    """
+
+    def __init__(
+        self,
+        engine: SyncEngine,
+        transfers: TransferScheduler,
+        options: SyncOptions,
+        roots: list[str],
+        user_id: int,
+        on_done: Callable[[str], None] = lambda path: None,
+    ):
+        self.engine = engine
+        self.transfers = transfers
+        self.options = options
+        self.roots = roots
+        self.user_id = user_id
+        self.on_done = on_done
+        # Entries now in sync, remote columns filled in; collected by ``take``.
+        self.synced: list[IndexEntry] = []
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        self._task: Optional[asyncio.Task] = None
+        self._parents: dict[str, str] = {"": options.remote_root}
+        self._entries: dict[str, IndexEntry] = {}
+        self._chunk_target: Optional[DriveChunkTarget] = None
+
+    async def put(self, f: FileEntry, e: IndexEntry) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._consume(), name="sync-uploads")
+        await self._enqueue((f, e))
+
+    async def _enqueue(self, item) -> None:
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+        put = asyncio.ensure_future(self._queue.put(item))
+        await asyncio.wait((put, self._task), return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            # The consumer died and nothing drains the queue any more: surface its error.
+            put.cancel()
+            self._task.result()
+
+    def take(self) -> list[IndexEntry]:
+        synced, self.synced = self.synced, []
+        return synced
+
+    async def close(self) -> None:
+        """Wait for everything put so far to finish (or be cancelled)."""
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._enqueue(None)
+        await self._task
+
+    def abort(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def run(self, batch: list[tuple[FileEntry, IndexEntry]]) -> list[IndexEntry]:
+        for f, e in batch:
+            await self.put(f, e)
+        await self.close()
+        return self.take()
+
+    async def _jobs(self) -> AsyncIterator[Transfer]:
+        min_size = self.options.chunk_min_size
+        while True:
+            items = [await self._queue.get()]
+            # Whatever else is already waiting shares one batched folder lookup.
+            while items[-1] is not None and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            batch = [i for i in items if i is not None]
+            if min_size is not None:
+                await self._run_chunked([(f, e) for f, e in batch if f.size >= min_size])
+                batch = [(f, e) for f, e in batch if f.size < min_size]
+            targets: list[tuple[FileEntry, IndexEntry, str, str]] = []
+            for f, e in batch:
+                folder, _, name = relative_path(f.path, self.roots).rpartition("/")
+                targets.append((f, e, folder, name))
+            missing = {folder for _, _, folder, _ in targets if folder not in self._parents}
+            if missing:
+                # Created level by level in batched calls, not one round trip each.
+                self._parents.update(
+                    await asyncio.to_thread(
+                        DriveBatch(self.transfers.client).ensure_folders, missing, self.options.remote_root
+                    )
+                )
+            for f, e, folder, name in targets:
+                self._entries[f.path] = e
+                yield Transfer("upload", f.path, f.size, self._parents[folder], file_id=e.remote_id, name=name)
+            if items[-1] is None:
+                return
+
+    async def _consume(self) -> None:
+        engine = self.engine
+        async for t in self.transfers.run(self._jobs(), engine._cancel, engine.uploads, engine.transfer_progress):
+            e = self._entries.pop(t.local_path)
+            engine.transfer_finished(t.local_path, t.size if t.error is None else None)
+            if t.error == "cancelled":
+                continue
+            self.on_done(t.local_path)
+            if t.error is not None:
+                engine._errors.append(f"{t.local_path}: {t.error}")
+                continue
+            e.remote_id, e.remote_etag, e.synced_sha256 = t.result["id"], t.result.get("md5Checksum"), e.sha256
+            self.synced.append(e)
+
+    async def _run_chunked(self, batch: list[tuple[FileEntry, IndexEntry]]) -> None:
+        engine = self.engine
+        for f, e in batch:
+            if engine._cancel.is_set():
+                break
+            try:
+                if self._chunk_target is None:
+                    folders = await asyncio.to_thread(
+                        DriveBatch(self.transfers.client).ensure_folders,
+                        [CHUNKS_FOLDER, MANIFESTS_FOLDER],
+                        self.options.remote_root,
+                    )
+                    self._chunk_target = DriveChunkTarget(
+                        self.transfers.client, folders[CHUNKS_FOLDER], folders[MANIFESTS_FOLDER]
+                    )
+                result = await backup_file(ChunkStore(self.user_id), self._chunk_target, f.path, f.path)
+            except Exception as exc:
+                self.on_done(f.path)
+                engine._errors.append(f"{f.path}: {exc}")
+                continue
+            self.on_done(f.path)
+            engine.transfer_finished(f.path, result.bytes_total)
+            e.remote_id, e.remote_etag, e.synced_sha256 = result.manifest_id, None, e.sha256
+            self.synced.append(e)
 
 
 class SyncEngine:
-    def __init__(self):
+    def __init__(self, hash_pool: Optional[HashPool] = None):
+        self._hash_pool = hash_pool
         self._running = False
         self._progress = 0
         self._errors: list[str] = []
+        self._stats = {"scanned": 0, "skipped": 0, "changed": 0, "removed": 0, "uploaded": 0}
+        self._walk_done = False
+        self._total_hint = 0
+        self._done = 0
+        self._cancel = threading.Event()
+        # Resumable upload session URIs by local path, carried across checkpoints.
+        self.uploads: dict[str, str] = {}
+        # Byte progress of running transfers by local path, fed from transfer threads.
+        self._transfers: dict[str, tuple[int, int]] = {}
+        # Finished transfers, folded in as each one ends so status() only adds up running ones.
+        self._bytes_done = 0
+        self._bytes_total = 0
 
     @staticmethod
-    def sha256_file(path: str, chunk: int = 1024 * 1024) -> str:
-        h = hashlib.sha256()
-        with open(path, "rb") as f:
-            while True:
-                b = f.read(chunk)
-                if not b:
-                    break
-                h.update(b)
-        return h.hexdigest()
+    def sha256_file(path: str, chunk: int = 4 * 1024 * 1024) -> str:
+        return hash_file(path, chunk)
+
+    @property
+    def hash_pool(self) -> HashPool:
+        return self._hash_pool or get_hash_pool()
+
+    @staticmethod
+    async def _load_index(user_id: int) -> dict[str, IndexEntry]:
+        from .db import ReadSessionLocal
+
+        async with ReadSessionLocal() as session:
+            return await load_index(session, user_id)
+
+    @staticmethod
+    async def _save_index(
+        user_id: int, entries: list[IndexEntry], removed: list[IndexEntry], synced: list[IndexEntry] = ()
+    ) -> None:
+        from .db import AsyncSessionLocal
+
+        async with AsyncSessionLocal() as session:
+            await save_index(session, user_id, entries, removed, synced)
 
-    async def start(self, mode: str, paths: list[str], exclusions: list[str], options: SyncOptions):
+    async def start(
+        self,
+        mode: str,
+        paths: list[str],
+        exclusions: list[str],
+        options: SyncOptions,
+        user_id: Optional[int] = None,
+        checkpoint: Optional[dict] = None,
+        on_checkpoint: Optional[Callable[[Optional[dict]], Awaitable[None]]] = None,
+        transfers: Optional[TransferScheduler] = None,
+    ) -> bool:
+        """Run one sync pass; returns False if it was stopped before finishing.
+
+        ``checkpoint`` is the last dict passed to ``on_checkpoint`` by an interrupted run of the
+        same job: everything up to its ``last_path`` is already processed and is not walked again.
+        A one-way run given ``transfers`` and ``options.remote_root`` uploads every file whose
+        content differs from its last upload, and records each upload in the index as it lands.
+        Files of ``options.chunk_min_size`` bytes or more go up through ``chunking.backup_file``.
+        """
         self._running = True
+        self._cancel.clear()
         self._progress = 0
-        all_files: list[str] = []
-        for p in paths:
-            if os.path.isdir(p):
-                for root, _, files in os.walk(p):
-                    for fn in files:
-                        fp = os.path.join(root, fn)
-                        if match_exclusions(fp, exclusions):
+        self._errors = []
+        self._stats = {"scanned": 0, "skipped": 0, "changed": 0, "removed": 0, "uploaded": 0}
+        self._walk_done = False
+        checkpoint = checkpoint or {}
+        resume_after: Optional[str] = checkpoint.get("last_path")
+        self.uploads = dict(checkpoint.get("uploads") or {})
+        self._transfers = {}
+        self._bytes_done = self._bytes_total = 0
+        # Without a user there is nothing to persist against, so every file counts as changed.
+        use_index = options.incremental and user_id is not None
+        uploading = use_index and mode == "oneway" and transfers is not None and options.remote_root is not None
+        index = await self._load_index(user_id) if use_index else {}
+        # The previous index size is the best guess of the tree size until the walk finishes.
+        self._total_hint = len(index)
+        self._done = 0
+
+        def on_error(path: str, exc: OSError) -> None:
+            self._errors.append(f"{path}: {exc}")
+
+        matcher = compile_exclusions(exclusions)
+        roots = [os.path.abspath(p) for p in paths]
+        mark = _LowWaterMark(resume_after)
+
+        async def changed_files() -> AsyncIterator[tuple[FileEntry, Optional[IndexEntry]]]:
+            async with aclosing(walk_batches(roots, matcher, on_error=on_error, start_after=resume_after)) as batches:
+                async for batch in batches:
+                    if not self._running:
+                        return
+                    for f in batch:
+                        self._stats["scanned"] += 1
+                        mark.walked(f.path)
+                        entry = index.pop(f.path, None)
+                        if entry is not None and entry.unchanged(f) and (not uploading or _in_sync(entry)):
+                            self._stats["skipped"] += 1
+                            mark.completed(f.path)
+                            self._advance()
+                            continue
+                        yield f, entry
+            self._walk_done = True
+
+        updated: list[IndexEntry] = []
+        last_checkpoint = time.monotonic()
+        # Uploads complete their paths in the mark; cancelled ones are not completed, so a
+        # checkpoint stays before them and a resumed run walks them again.
+        uploader = _Uploader(self, transfers, options, roots, user_id, mark.completed) if uploading else None
+
+        async def save_checkpoint() -> None:
+            nonlocal updated, last_checkpoint
+            synced = uploader.take() if uploader else []
+            # Index rows first: a checkpoint must never point past work that is not persisted.
+            if use_index and (updated or synced):
+                await self._save_index(user_id, updated, [], synced)
+            updated = []
+            last_checkpoint = time.monotonic()
+            if on_checkpoint is not None and mark.value is not None:
+                await on_checkpoint({"last_path": mark.value, "uploads": dict(self.uploads)})
+
+        try:
+            if not use_index:
+                async with aclosing(changed_files()) as files:
+                    async for f, _ in files:
+                        # Placeholder: here we would compare with remote and upload/download as needed
+                        await asyncio.sleep(0.001)
+                        self._stats["changed"] += 1
+                        mark.completed(f.path)
+                        self._advance()
+                        if time.monotonic() - last_checkpoint >= CHECKPOINT_SECONDS:
+                            await save_checkpoint()
+            else:
+                async with aclosing(self.hash_pool.imap(changed_files(), lambda c: c[0].path)) as hashed:
+                    async for (f, entry), digest, exc in hashed:
+                        if not self._running:
+                            break
+                        self._advance()
+                        if exc is not None:
+                            mark.completed(f.path)
+                            self._errors.append(f"{f.path}: {exc}")
                             continue
-                        all_files.append(fp)
-            elif os.path.isfile(p):
-                if not match_exclusions(p, exclusions):
-                    all_files.append(p)
-        total = max(1, len(all_files))
-        for idx, f in enumerate(all_files, 1):
-            # Placeholder: here we would compare with remote and upload/download as needed
-            await asyncio.sleep(0.001)
-            self._progress = int(idx * 100 / total)
+                        if entry is None:
+                            entry = IndexEntry(path=f.path)
+                        if entry.sha256 != digest:
+                            entry.sha256 = digest
+                            self._stats["changed"] += 1
+                        entry.refresh(f)
+                        if uploading and not _in_sync(entry):
+                            # Completed once uploaded; until then a checkpoint must not pass it.
+                            await uploader.put(f, entry)
+                        else:
+                            mark.completed(f.path)
+                            updated.append(entry)
+                        pending = len(updated) + (len(uploader.synced) if uploader else 0)
+                        if pending >= INDEX_FLUSH_SIZE or time.monotonic() - last_checkpoint >= CHECKPOINT_SECONDS:
+                            await save_checkpoint()
+
+            if uploader:
+                await uploader.close()
+        finally:
+            if uploader:
+                uploader.abort()
+        if not self._running:
+            await save_checkpoint()
+            return False
+
+        # Whatever is left in the index under the scanned roots no longer exists locally; paths up
+        # to the resume point were not walked this time, so their absence means nothing.
+        removed = [
+            e for path, e in index.items() if _under(path, roots) and not (resume_after and _not_after(path, resume_after))
+        ]
+        self._stats["removed"] = len(removed)
+        synced = uploader.take() if uploader else []
+        if use_index and (updated or removed or synced):
+            await self._save_index(user_id, updated, removed, synced)
+        if on_checkpoint is not None:
+            await on_checkpoint(None)
+        self._progress = 100
+        self._running = False
+        return True
+
+    @staticmethod
+    async def _index_for(user_id: int, paths: list[str], dirs: list[str]) -> dict[str, IndexEntry]:
+        from .db import ReadSessionLocal
+
+        async with ReadSessionLocal() as session:
+            repo = FileIndexRepository(session, user_id)
+            return {**await repo.under(dirs), **await repo.get(paths)}
+
+    async def sync_changes(
+        self,
+        paths: Iterable[str],
+        exclusions: list[str],
+        options: SyncOptions,
+        user_id: int,
+        roots: Optional[list[str]] = None,
+        transfers: Optional[TransferScheduler] = None,
+    ) -> bool:
+        """Sync just ``paths`` (files or directories, existing or deleted) against the index.
+
+        Directories are walked, and anything indexed below a directory or a deleted path that
+        is no longer there is removed, so a moved or deleted subtree needs one path here.
+        Index reads are per path, never the whole index; the work follows the size of the change.
+        Given ``transfers``, ``options.remote_root`` and the job's ``roots`` (which place files
+        in the remote tree), changed files are uploaded the same way a one-way ``start`` does.
+        """
+        self._running = True
+        self._cancel.clear()
+        # Errors describe the latest call only; a long-lived watcher calls this indefinitely.
+        self._errors = []
+        self._transfers = {}
+        self._bytes_done = self._bytes_total = 0
+        self._stats = {"scanned": 0, "skipped": 0, "changed": 0, "removed": 0, "uploaded": 0}
+        matcher = compile_exclusions(exclusions)
+        files: dict[str, FileEntry] = {}
+        dirs: list[str] = []
+        gone: list[str] = []
+
+        def on_error(path: str, exc: OSError) -> None:
+            self._errors.append(f"{path}: {exc}")
+
+        def classify() -> None:
+            for p in dict.fromkeys(os.path.abspath(p) for p in paths):
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    gone.append(p)
+                    continue
+                except OSError as exc:
+                    on_error(p, exc)
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    if os.path.islink(p):
+                        continue  # not followed, as in walk_files
+                    if not matcher.prune_dir(p):
+                        dirs.append(p)
+                elif not matcher.match(p):
+                    files[p] = FileEntry.from_stat(p, st)
+
+        await asyncio.to_thread(classify)
+        if dirs:
+            async with aclosing(walk_batches(dirs, matcher, on_error=on_error)) as batches:
+                async for batch in batches:
+                    files.update((f.path, f) for f in batch)
+        known = await self._index_for(user_id, list(files) + gone, dirs + gone)
+        removed = [e for path, e in known.items() if path not in files]
+        uploading = transfers is not None and options.remote_root is not None and roots is not None
+        to_hash = [
+            f
+            for f in files.values()
+            if not (e := known.get(f.path)) or not e.unchanged(f) or (uploading and not _in_sync(e))
+        ]
+        self._stats.update(scanned=len(files), skipped=len(files) - len(to_hash), removed=len(removed))
+        self._done, self._walk_done = len(files) - len(to_hash), True
+
+        async def pending() -> AsyncIterator[FileEntry]:
+            for f in to_hash:
+                yield f
+
+        updated: list[IndexEntry] = []
+        to_upload: list[tuple[FileEntry, IndexEntry]] = []
+        async with aclosing(self.hash_pool.imap(pending(), lambda f: f.path)) as hashed:
+            async for f, digest, exc in hashed:
+                if not self._running:
+                    break
+                self._advance()
+                if exc is not None:
+                    self._errors.append(f"{f.path}: {exc}")
+                    continue
+                entry = known.get(f.path) or IndexEntry(path=f.path)
+                if entry.sha256 != digest:
+                    entry.sha256 = digest
+                    self._stats["changed"] += 1
+                entry.refresh(f)
+                updated.append(entry)
+                if uploading and not _in_sync(entry):
+                    to_upload.append((f, entry))
+        synced: list[IndexEntry] = []
+        if to_upload and self._running:
+            uploader = _Uploader(self, transfers, options, [os.path.abspath(r) for r in roots], user_id)
+            try:
+                synced = await uploader.run(to_upload)
+            finally:
+                uploader.abort()
+        finished = self._running
+        if updated or (removed and finished):
+            await self._save_index(user_id, updated, removed if finished else [], synced)
+        self._progress = 100 if finished else self._progress
         self._running = False
+        return finished
+
+    async def plan(
+        self,
+        mode: str,
+        paths: list[str],
+        exclusions: list[str],
+        options: SyncOptions,
+        user_id: Optional[int] = None,
+        remote: Iterable[RemoteEntry] = (),
+    ) -> Plan:
+        """Scan the local tree and return what a sync would do, without changing anything.
+
+        Files whose size, mtime and inode match the index reuse its hash; only the rest are read.
+        """
+        roots = [os.path.abspath(p) for p in paths]
+        index = await self._load_index(user_id) if user_id is not None else {}
+        local: list[LocalFile] = []
+        skip: list[str] = []
+
+        def on_error(path: str, exc: OSError) -> None:
+            self._errors.append(f"{path}: {exc}")
+            rel = relative_path(path, roots)
+            if rel is not None:
+                skip.append(rel)
+
+        async def to_hash() -> AsyncIterator[FileEntry]:
+            async with aclosing(walk_batches(roots, compile_exclusions(exclusions), on_error=on_error)) as batches:
+                async for batch in batches:
+                    for f in batch:
+                        entry = index.get(f.path)
+                        if entry is not None and entry.sha256 and entry.unchanged(f):
+                            local.append(LocalFile(relative_path(f.path, roots), f.size, f.mtime, entry.sha256))
+                        else:
+                            yield f
+
+        async with aclosing(self.hash_pool.imap(to_hash(), lambda f: f.path)) as hashed:
+            async for f, digest, exc in hashed:
+                if exc is not None:
+                    on_error(f.path, exc)
+                    continue
+                local.append(LocalFile(relative_path(f.path, roots), f.size, f.mtime, digest))
+
+        base = []
+        for e in index.values():
+            rel = relative_path(e.path, roots)
+            if rel is not None:
+                base.append(replace(e, path=rel))
+        return plan_sync(local, base, remote, mode, options.keep_both_on_conflict, skip)
+
+    def _advance(self) -> None:
+        self._done += 1
+        if self._walk_done:
+            total = self._stats["scanned"]
+        else:
+            total = max(self._stats["scanned"], self._total_hint)
+        # Stay below 100 until the run has really finished.
+        self._progress = min(99, int(self._done * 100 / max(1, total)))
 
     def stop(self):
+        # Checked between walk batches and hash results; running uploads stop at their next chunk.
         self._running = False
+        self._cancel.set()
+
+    def transfer_progress(self, path: str, done: int, total: int) -> None:
+        # Called from transfer threads for every acknowledged chunk.
+        self._transfers[path] = (done, total)
+
+    def transfer_finished(self, path: str, size: Optional[int]) -> None:
+        # ``size`` is None for a transfer that failed or was cancelled.
+        self._transfers.pop(path, None)
+        if size is not None:
+            self._bytes_done += size
+            self._bytes_total += size
+            self._stats["uploaded"] += 1
 
     def status(self) -> dict:
-        return {"running": self._running, "progress": self._progress, "errors": self._errors}
+        return {
+            "running": self._running,
+            "progress": self._progress,
+            "progress_estimated": self._running and not self._walk_done,
+            "errors": self._errors,
+            # Only running transfers are summed here; there are at most as many as transfer workers.
+            "bytes_done": self._bytes_done + sum(d for d, _ in list(self._transfers.values())),
+            "bytes_total": self._bytes_total + sum(t for _, t in list(self._transfers.values())),
+            **self._stats,
+        }
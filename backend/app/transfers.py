@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Iterable, MutableMapping, Optional, Union
+
+from googleapiclient.errors import HttpError
+
+from .google_drive import GoogleDriveClient, TransferCancelled
+
+TRANSFER_WORKERS = int(os.getenv("TRANSFER_WORKERS", "8"))
+TRANSFER_LARGE_WORKERS = int(os.getenv("TRANSFER_LARGE_WORKERS", "2"))
+TRANSFER_LARGE_FILE_BYTES = int(os.getenv("TRANSFER_LARGE_FILE_BYTES", str(8 * 1024 * 1024)))
+
+# Called from lane threads as (local_path, bytes_done, total).
+ProgressCallback = Callable[[str, int, int], None]
+
+
+@dataclass
+class Transfer:
+    direction: str  # upload|download
+    local_path: str
+    size: int = 0
+    remote_parent_id: Optional[str] = None
+    file_id: Optional[str] = None  # download source; for uploads, the file whose content is replaced
+    name: Optional[str] = None
+    md5: Optional[str] = None  # Drive's md5Checksum when already known; saves a metadata request
+    result: Optional[dict[str, Any]] = None
+    error: Optional[str] = None
+
+
+class _Lane:
+    def __init__(self, name: str, workers: int):
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"xfer-{name}")
+        self.slots = asyncio.Semaphore(self.workers)
+
+
+class TransferScheduler:
+    # Small files are latency-bound, large ones bandwidth-bound: giving each its own lane
+    # keeps a few multi-GB uploads from starving thousands of small ones.
+    def __init__(
+        self,
+        client: GoogleDriveClient,
+        workers: int = TRANSFER_WORKERS,
+        large_workers: int = TRANSFER_LARGE_WORKERS,
+        large_threshold: int = TRANSFER_LARGE_FILE_BYTES,
+    ):
+        self.client = client
+        self.large_threshold = large_threshold
+        self._small = _Lane("small", workers)
+        self._large = _Lane("large", large_workers)
+
+    def _lane(self, t: Transfer) -> _Lane:
+        return self._large if t.size >= self.large_threshold else self._small
+
+    def _run_sync(
+        self,
+        t: Transfer,
+        cancel: Optional[threading.Event] = None,
+        sessions: Optional[MutableMapping[str, str]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Optional[dict[str, Any]]:
+        # Runs on a lane thread; the client keeps one Drive service per thread and retries 429/5xx.
+        if cancel is not None and cancel.is_set():
+            raise TransferCancelled(t.local_path)
+        progress = (lambda done, total: on_progress(t.local_path, done, total)) if on_progress else None
+        if t.direction == "upload":
+            if sessions is None:
+                sessions = {}
+
+            def remember(uri: Optional[str]) -> None:
+                if uri:
+                    sessions[t.local_path] = uri
+                else:
+                    sessions.pop(t.local_path, None)
+
+            def upload(file_id: Optional[str]) -> dict[str, Any]:
+                return self.client.upload_file(
+                    t.local_path,
+                    t.remote_parent_id,
+                    t.name,
+                    file_id=file_id,
+                    session_uri=sessions.get(t.local_path),
+                    on_session=remember,
+                    on_progress=progress,
+                    cancel=cancel,
+                )
+
+            try:
+                result = upload(t.file_id)
+            except HttpError as exc:
+                if not t.file_id or exc.resp.status != 404:
+                    raise
+                # The remote copy was deleted since it was recorded: upload a new one.
+                sessions.pop(t.local_path, None)
+                result = upload(None)
+            sessions.pop(t.local_path, None)
+            return result
+        if t.direction == "download":
+            if not t.file_id:
+                raise ValueError("download requires file_id")
+            # Returns size/md5/sha256 computed while streaming, ready for the FileIndex.
+            return self.client.download_file(
+                t.file_id, t.local_path, cancel=cancel, expected_md5=t.md5, on_progress=progress
+            )
+        raise ValueError(f"Unknown transfer direction: {t.direction}")
+
+    async def transfer(
+        self,
+        t: Transfer,
+        cancel: Optional[threading.Event] = None,
+        sessions: Optional[MutableMapping[str, str]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Transfer:
+        lane = self._lane(t)
+        loop = asyncio.get_running_loop()
+        async with lane.slots:
+            try:
+                t.result = await loop.run_in_executor(lane.executor, self._run_sync, t, cancel, sessions, on_progress)
+            except TransferCancelled:
+                t.error = "cancelled"
+            except Exception as exc:
+                t.error = str(exc)
+        return t
+
+    async def run(
+        self,
+        transfers: Union[Iterable[Transfer], AsyncIterable[Transfer]],
+        cancel: Optional[threading.Event] = None,
+        sessions: Optional[MutableMapping[str, str]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> AsyncIterator[Transfer]:
+        # Each lane has its own bounded queue of waiting transfers and admits up to twice its
+        # worker count (running or waiting to be consumed), so a backlog of large files never
+        # takes the room small ones need; the source is only held up once the lane the next
+        # transfer needs is full. Results come back in completion order.
+        # Once `cancel` is set, queued transfers finish immediately as cancelled and running
+        # ones stop at their next chunk. Resumable upload sessions are kept in `sessions`
+        # (local path -> session URI) until the upload completes, so a caller that persists
+        # the mapping can continue interrupted uploads in a later run.
+        lanes = (self._small, self._large)
+        backlog = 2 * (self._small.workers + self._large.workers)
+        queues: dict[_Lane, asyncio.Queue] = {lane: asyncio.Queue(maxsize=backlog) for lane in lanes}
+        admit = {lane: asyncio.Semaphore(2 * lane.workers) for lane in lanes}
+        results: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def work(lane: _Lane) -> None:
+            while True:
+                await admit[lane].acquire()
+                t = await queues[lane].get()
+                if t is None:
+                    admit[lane].release()
+                    return
+                results.put_nowait(await self.transfer(t, cancel, sessions, on_progress))
+
+        async def produce() -> None:
+            workers = [asyncio.create_task(work(lane)) for lane in lanes for _ in range(lane.workers)]
+            try:
+                if hasattr(transfers, "__aiter__"):
+                    async for t in transfers:  # type: ignore[union-attr]
+                        await queues[self._lane(t)].put(t)
+                else:
+                    for t in transfers:  # type: ignore[union-attr]
+                        await queues[self._lane(t)].put(t)
+                for lane in lanes:
+                    for _ in range(lane.workers):
+                        await queues[lane].put(None)
+                await asyncio.gather(*workers)
+            finally:
+                for w in workers:
+                    w.cancel()
+                results.put_nowait(done)
+                aclose = getattr(transfers, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (t := await results.get()) is not done:
+                admit[self._lane(t)].release()
+                yield t
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+
+    def shutdown(self) -> None:
+        self._small.executor.shutdown(wait=False, cancel_futures=True)
+        self._large.executor.shutdown(wait=False, cancel_futures=True)
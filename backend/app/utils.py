@@ -1,8 +1,10 @@
 import base64
+import fnmatch
 import os
 import re
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from functools import lru_cache
+from typing import Iterable, Optional
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
@@ -24,7 +26,9 @@ def derive_fernet_key(master_key: str, salt: bytes) -> bytes:
     return base64.urlsafe_b64encode(key)
 
 
+@lru_cache(maxsize=8)
 def get_fernet(master_key: str) -> Fernet:
+    # PBKDF2 at 390k iterations costs ~100ms+ of CPU, so each key is derived once per process.
     # Salt can be a fixed env var; here we derive from MASTER_KEY itself for simplicity
     salt = hashes.Hash(hashes.SHA256())
     salt.update(master_key.encode("utf-8"))
@@ -65,11 +69,69 @@ def safe_join(base: str, *paths: str) -> Optional[str]:
 GLOB_MAGIC = re.compile(r"[\*\?\[]")
 
 
-def match_exclusions(path: str, patterns: list[str]) -> bool:
-    import fnmatch
-
-    norm = path.replace("\\", "/")
-    for pat in patterns:
-        if fnmatch.fnmatch(norm, pat):
+_CASE_INSENSITIVE = os.name == "nt"
+
+
+def _norm(path: str) -> str:
+    path = path.replace("\\", "/")
+    return path.lower() if _CASE_INSENSITIVE else path
+
+
+class ExclusionMatcher:
+    """Precompiled form of a list of fnmatch-style exclusion patterns.
+
+    Plain ``*<literal>`` and ``**/*<literal>`` patterns (extensions, file names) are checked
+    with ``str.endswith``; everything else is folded into a single alternation regex.
+    Patterns ending in ``/*`` or ``/**`` also let whole directories be pruned.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = tuple(dict.fromkeys(_norm(p) for p in patterns if p))
+        suffixes: list[str] = []
+        nested_suffixes: list[str] = []
+        regexes: list[str] = []
+        dir_regexes: list[str] = []
+        for pat in self.patterns:
+            if pat.startswith("**/*") and not GLOB_MAGIC.search(pat[4:]):
+                nested_suffixes.append(pat[4:])
+            elif pat.startswith("*") and not GLOB_MAGIC.search(pat[1:]):
+                suffixes.append(pat[1:])
+            else:
+                regexes.append(fnmatch.translate(pat))
+            for tail in ("/**", "/*"):
+                if pat.endswith(tail) and len(pat) > len(tail):
+                    dir_regexes.append(fnmatch.translate(pat[: -len(tail)]))
+                    break
+        self._suffixes = tuple(suffixes)
+        self._nested_suffixes = tuple(nested_suffixes)
+        self._regex = re.compile("|".join(regexes)) if regexes else None
+        self._dir_regex = re.compile("|".join(dir_regexes)) if dir_regexes else None
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def match(self, path: str) -> bool:
+        norm = _norm(path)
+        if self._suffixes and norm.endswith(self._suffixes):
             return True
-    return False
+        for suffix in self._nested_suffixes:
+            if norm.endswith(suffix) and "/" in norm[: len(norm) - len(suffix)]:
+                return True
+        return self._regex is not None and self._regex.match(norm) is not None
+
+    def prune_dir(self, path: str) -> bool:
+        # True when every path below this directory is excluded, so the walk can skip it.
+        return self._dir_regex is not None and self._dir_regex.match(_norm(path)) is not None
+
+
+@lru_cache(maxsize=64)
+def _compile_exclusions(patterns: tuple[str, ...]) -> ExclusionMatcher:
+    return ExclusionMatcher(patterns)
+
+
+def compile_exclusions(patterns: Iterable[str]) -> ExclusionMatcher:
+    return _compile_exclusions(tuple(patterns))
+
+
+def match_exclusions(path: str, patterns: list[str]) -> bool:
+    return compile_exclusions(patterns).match(path)
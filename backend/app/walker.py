@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from .utils import ExclusionMatcher
+
+WALK_BATCH_SIZE = int(os.getenv("WALK_BATCH_SIZE", "512"))
+WALK_QUEUE_BATCHES = 8
+
+# SQLite integers are signed 64-bit; some filesystems report wider inode numbers.
+_INODE_MASK = (1 << 63) - 1
+
+OnError = Callable[[str, OSError], None]
+
+
+@dataclass(slots=True)
+class FileEntry:
+    path: str
+    size: int
+    mtime: float
+    inode: int
+
+    @classmethod
+    def from_stat(cls, path: str, st: os.stat_result) -> "FileEntry":
+        return cls(path, st.st_size, st.st_mtime, st.st_ino & _INODE_MASK)
+
+
+def sort_key(path: str) -> tuple[str, ...]:
+    # Order produced by walk_files: component-wise, so a directory's children stay contiguous.
+    return tuple(path.split(os.sep))
+
+
+def _before(key: tuple[str, ...], after: Optional[tuple[str, ...]], is_dir: bool = False) -> bool:
+    # True when everything at `key` (for a directory, its whole subtree) sorts at or before `after`.
+    if after is None:
+        return False
+    if is_dir:
+        return key < after and after[: len(key)] != key
+    return key <= after
+
+
+def walk_files(
+    roots: Iterable[str],
+    matcher: ExclusionMatcher,
+    on_error: Optional[OnError] = None,
+    start_after: Optional[str] = None,
+) -> Iterator[FileEntry]:
+    """Yield files under ``roots`` in sort_key order without building the tree in memory.
+
+    Uses os.scandir so the type (and on Windows the stat) cached in each DirEntry is reused,
+    and skips directories the matcher can prune instead of rejecting their files one by one.
+    Symlinks to directories below the roots are skipped; symlinks to files count as files.
+    With ``start_after`` (a checkpoint), subtrees that sort entirely before it are never opened.
+    """
+    after = sort_key(start_after) if start_after else None
+    for root in sorted((os.path.abspath(r) for r in roots), key=sort_key):
+        if os.path.isfile(root):
+            if not matcher.match(root) and not _before(sort_key(root), after):
+                try:
+                    yield FileEntry.from_stat(root, os.stat(root))
+                except OSError as exc:
+                    if on_error:
+                        on_error(root, exc)
+            continue
+        if not os.path.isdir(root) or _before(sort_key(root), after, is_dir=True):
+            continue
+        # Holds directory paths still to expand and files ready to yield, in reverse order.
+        stack: list[str | FileEntry] = [root]
+        while stack:
+            top = stack.pop()
+            if isinstance(top, FileEntry):
+                yield top
+                continue
+            try:
+                with os.scandir(top) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as exc:
+                if on_error:
+                    on_error(top, exc)
+                continue
+            children: list[str | FileEntry] = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not matcher.prune_dir(entry.path) and not _before(sort_key(entry.path), after, is_dir=True):
+                            children.append(entry.path)
+                        continue
+                    if entry.is_symlink() and entry.is_dir():
+                        # Not followed: the target can be outside the roots or loop back into them.
+                        continue
+                    if matcher.match(entry.path) or _before(sort_key(entry.path), after):
+                        continue
+                    st = entry.stat()
+                    children.append(FileEntry(entry.path, st.st_size, st.st_mtime, entry.inode() & _INODE_MASK))
+                except OSError as exc:
+                    if on_error:
+                        on_error(entry.path, exc)
+            stack.extend(reversed(children))
+
+
+def iter_batches(items: Iterable[FileEntry], size: int) -> Iterator[list[FileEntry]]:
+    batch: list[FileEntry] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def walk_batches(
+    roots: Iterable[str],
+    matcher: ExclusionMatcher,
+    batch_size: int = WALK_BATCH_SIZE,
+    on_error: Optional[OnError] = None,
+    max_pending: int = WALK_QUEUE_BATCHES,
+    start_after: Optional[str] = None,
+) -> AsyncIterator[list[FileEntry]]:
+    # The walk runs on a worker thread; at most max_pending batches wait for the consumer.
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = threading.Semaphore(max_pending)
+    stop = threading.Event()
+    done = object()
+
+    def produce() -> None:
+        try:
+            for batch in iter_batches(walk_files(roots, matcher, on_error, start_after), batch_size):
+                slots.acquire()
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, batch)
+        finally:
+            if not stop.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    fut = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            slots.release()
+            yield item
+        await fut
+    finally:
+        stop.set()
+        slots.release()
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+from loguru import logger
+from watchdog.events import (
+    DirModifiedEvent,
+    FileClosedNoWriteEvent,
+    FileOpenedEvent,
+    FileSystemEvent,
+    FileSystemEventHandler,
+)
+from watchdog.observers import Observer
+
+from .hashing import HashPool
+from .sync_engine import SyncEngine, SyncOptions
+from .transfers import TransferScheduler
+from .utils import compile_exclusions
+from .walker import sort_key
+
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_MAX_PENDING = int(os.getenv("WATCH_MAX_PENDING", "10000"))
+WATCH_RECONCILE_SECONDS = float(os.getenv("WATCH_RECONCILE_SECONDS", "3600"))
+
+OnChanges = Callable[[list[str]], Awaitable[None]]
+# Opening or reading a file changes nothing worth syncing, and a directory's own "modified"
+# event accompanies the events of the entries that changed in it; taking it would rescan it.
+_IGNORED = (FileOpenedEvent, FileClosedNoWriteEvent, DirModifiedEvent)
+
+
+def _parent_within(path: str, roots: list[str]) -> str:
+    parent = os.path.dirname(path)
+    for r in roots:
+        if path == r:
+            return path
+        if parent == r or parent.startswith(r.rstrip(os.sep) + os.sep):
+            return parent
+    return path
+
+
+def coarsen(paths: Iterable[str], roots: list[str], limit: int) -> list[str]:
+    """Replace paths by ancestors (never above their root) until at most ``limit`` remain.
+
+    Used when events arrive faster than they drain: each directory kept here is rescanned,
+    which is still far less than the whole tree when the burst is local.
+    """
+    current = sorted(set(paths), key=sort_key)
+    while True:
+        kept: list[str] = []
+        for p in current:
+            if not kept or not (p == kept[-1] or p.startswith(kept[-1].rstrip(os.sep) + os.sep)):
+                kept.append(p)
+        if len(kept) <= limit:
+            return kept
+        # One level at a time from the deepest, so a burst in one subtree does not widen the rest.
+        movable = [p for p in kept if _parent_within(p, roots) != p]
+        if not movable:
+            return kept
+        deepest = max(p.count(os.sep) for p in movable)
+        current = sorted(
+            {_parent_within(p, roots) if p.count(os.sep) == deepest else p for p in kept}, key=sort_key
+        )
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher: ChangeWatcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        # Runs on the observer thread: filter here, hand the paths to the loop.
+        if isinstance(event, _IGNORED):
+            return
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        w = self.watcher
+        kept = [
+            p
+            for p in (os.fsdecode(p) for p in paths if p)
+            if not (w.matcher.prune_dir(p) if event.is_directory else w.matcher.match(p))
+        ]
+        if kept and w.loop is not None:
+            w.loop.call_soon_threadsafe(w.add, kept)
+
+
+class ChangeWatcher:
+    """Watches ``roots`` and hands changed paths to ``on_changes`` once they go quiet.
+
+    Events are coalesced per path: a path is delivered after ``debounce`` seconds without a
+    new event for it, however many events it got before. Excluded paths never get queued.
+    If more than ``max_pending`` paths are waiting, they are merged into their parent
+    directories, which the consumer rescans.
+
+    Events the kernel drops never reach us: watchdog discards inotify's queue-overflow
+    notice. So every ``reconcile`` seconds (0 disables it) the roots themselves are queued,
+    and the consumer's index comparison picks up whatever was missed.
+    """
+
+    def __init__(
+        self,
+        roots: Iterable[str],
+        exclusions: Iterable[str],
+        on_changes: OnChanges,
+        debounce: float = WATCH_DEBOUNCE_SECONDS,
+        max_pending: int = WATCH_MAX_PENDING,
+        reconcile: float = WATCH_RECONCILE_SECONDS,
+        observer_factory: Callable[[], object] = Observer,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.matcher = compile_exclusions(exclusions)
+        self.on_changes = on_changes
+        self.debounce = debounce
+        self.max_pending = max(1, max_pending)
+        self.reconcile = reconcile
+        self.observer_factory = observer_factory
+        self.clock = clock
+        self.handler = _Handler(self)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.overflows = 0
+        self.reconciles = 0
+        self._pending: dict[str, float] = {}
+        self._wake = asyncio.Event()
+        self._observer = None
+        self._task: Optional[asyncio.Task] = None
+        self._reconciler: Optional[asyncio.Task] = None
+
+    def add(self, paths: Iterable[str]) -> None:
+        now = self.clock()
+        for p in paths:
+            self._pending.pop(p, None)
+            self._pending[p] = now
+        if len(self._pending) > self.max_pending:
+            self.overflows += 1
+            logger.warning(f"watch queue over {self.max_pending} paths, rescanning their directories")
+            self._pending = dict.fromkeys(coarsen(self._pending, self.roots, self.max_pending // 2 or 1), now)
+        self._wake.set()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._pending:
+                now = self.clock()
+                ready = [p for p, t in self._pending.items() if now - t >= self.debounce]
+                if not ready:
+                    # Insertion order is event order, so the first path is the next one due.
+                    first = next(iter(self._pending.values()))
+                    await asyncio.sleep(max(0.0, first + self.debounce - now))
+                    continue
+                for p in ready:
+                    del self._pending[p]
+                try:
+                    await self.on_changes(ready)
+                except Exception:
+                    logger.exception("applying watched changes failed")
+
+    async def _reconcile(self) -> None:
+        while True:
+            await asyncio.sleep(self.reconcile)
+            self.reconciles += 1
+            self.add(self.roots)
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="change-watcher")
+        if self.reconcile > 0 and (self._reconciler is None or self._reconciler.done()):
+            self._reconciler = asyncio.create_task(self._reconcile(), name="change-reconciler")
+        observer = self.observer_factory()
+        watched: list[str] = []
+        for root in self.roots:
+            try:
+                observer.schedule(self.handler, root, recursive=True)
+                watched.append(root)
+            except OSError as exc:
+                # E.g. the inotify watch limit: what cannot be watched is scanned once instead.
+                logger.warning(f"cannot watch {root}: {exc}")
+                self.add([root])
+        if not watched:
+            return
+        try:
+            # Adding the watches walks every directory below the roots, which can take a while.
+            await asyncio.to_thread(observer.start)
+        except OSError as exc:
+            logger.warning(f"cannot watch {', '.join(watched)}: {exc}")
+            observer.stop()  # removes the watches that did get added
+            self.add(watched)
+            return
+        self._observer = observer
+
+    async def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            await asyncio.to_thread(self._observer.join)
+            self._observer = None
+        for task in (self._task, self._reconciler):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._reconciler = None
+
+
+class ContinuousSync:
+    """Keeps one backup set in sync by feeding watched changes into SyncEngine.sync_changes.
+
+    Given ``transfers``, changed files are uploaded as well, so the remote copy follows the
+    local tree within a debounce interval instead of waiting for the next full run.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        paths: list[str],
+        exclusions: list[str],
+        options: SyncOptions,
+        hash_pool: Optional[HashPool] = None,
+        is_busy: Callable[[], bool] = lambda: False,
+        transfers: Optional[TransferScheduler] = None,
+        **watcher_args,
+    ):
+        self.user_id = user_id
+        self.exclusions = exclusions
+        self.options = options
+        self.is_busy = is_busy
+        # With options.remote_root set, changed files are uploaded as they settle.
+        self.transfers = transfers
+        self.engine = SyncEngine(hash_pool=hash_pool)
+        self.watcher = ChangeWatcher(paths, exclusions, self.apply, **watcher_args)
+        self.applied = 0
+
+    async def apply(self, paths: list[str]) -> None:
+        if self.is_busy():
+            # A full pass of the same job owns the index right now; try again after it.
+            self.watcher.add(paths)
+            return
+        await self.engine.sync_changes(
+            paths, self.exclusions, self.options, self.user_id, roots=self.watcher.roots, transfers=self.transfers
+        )
+        self.applied += len(paths)
+
+    def status(self) -> dict:
+        return {
+            "roots": self.watcher.roots,
+            "pending": self.watcher.pending(),
+            "applied": self.applied,
+            "overflows": self.watcher.overflows,
+            "reconciles": self.watcher.reconciles,
+            **self.engine.status(),
+        }
+
+    async def start(self) -> None:
+        await self.watcher.start()
+
+    async def stop(self) -> None:
+        self.engine.stop()
+        await self.watcher.stop()
+        if self.transfers is not None:
+            self.transfers.shutdown()
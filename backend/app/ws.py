@@ -1,33 +1,100 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Set
+import os
+from collections import deque
+from typing import Optional
 
-from fastapi import WebSocket, WebSocketDisconnect
+import orjson
+from fastapi import WebSocket
+from loguru import logger
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "32"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+
+def encode(message: dict) -> str:
+    return orjson.dumps(message).decode("utf-8")
+
+
+class Connection:
+    # One socket plus its outbound queue; a dedicated writer task drains it so broadcasts never await a client.
+    def __init__(self, websocket: WebSocket, maxsize: int = WS_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.pending: deque[tuple[Optional[str], str]] = deque()
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+
+    def push(self, payload: str, key: Optional[str] = None) -> None:
+        if key is not None:
+            # Coalesce: a newer message with the same key replaces the queued one in place.
+            for i, (k, _) in enumerate(self.pending):
+                if k == key:
+                    self.pending[i] = (key, payload)
+                    self._ready.set()
+                    return
+        if len(self.pending) >= self.maxsize:
+            self.pending.popleft()
+            self.dropped += 1
+        self.pending.append((key, payload))
+        self._ready.set()
+
+    async def next(self) -> str:
+        while not self.pending:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.pending.popleft()[1]
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active: Set[WebSocket] = set()
-        self._lock = asyncio.Lock()
+    def __init__(self, send_timeout: float = WS_SEND_TIMEOUT_SECONDS):
+        self.active: dict[WebSocket, Connection] = {}
+        self.send_timeout = send_timeout
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        async with self._lock:
-            self.active.add(websocket)
+    async def connect(self, websocket: WebSocket, accept: bool = True) -> Connection:
+        if accept:
+            await websocket.accept()
+        conn = Connection(websocket)
+        conn.writer = asyncio.create_task(self._write(conn), name="ws-writer")
+        self.active[websocket] = conn
+        return conn
 
     async def disconnect(self, websocket: WebSocket):
-        async with self._lock:
-            self.active.discard(websocket)
+        conn = self.active.pop(websocket, None)
+        if conn is not None and conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
 
-    async def broadcast(self, message: dict):
-        async with self._lock:
-            conns = list(self.active)
-        for ws in conns:
+    async def _write(self, conn: Connection) -> None:
+        try:
+            while True:
+                payload = await conn.next()
+                await asyncio.wait_for(conn.websocket.send_text(payload), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.debug(f"websocket writer stopped: {exc!r}")
+            self.active.pop(conn.websocket, None)
             try:
-                await ws.send_json(message)
+                await conn.websocket.close()
             except Exception:
-                await self.disconnect(ws)
+                pass
+
+    def send(self, websocket: WebSocket, message: dict) -> None:
+        conn = self.active.get(websocket)
+        if conn is not None:
+            conn.push(encode(message))
+
+    def publish(self, message: dict, key: Optional[str] = None) -> int:
+        # Encoded once; every connection queues the same string. Never blocks on a client.
+        payload = encode(message)
+        for conn in list(self.active.values()):
+            conn.push(payload, key)
+        return len(self.active)
+
+    async def broadcast(self, message: dict, key: Optional[str] = None):
+        self.publish(message, key)
 
 
 notifications_manager = ConnectionManager()
@@ -0,0 +1,74 @@
+"""FileIndex write throughput under the default and tuned SQLite profiles.
+
+Run from backend/:  python -m benchmarks.bench_file_index --rows 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.db import Base, make_engines
+from app.file_index import IndexEntry, load_index, save_index
+from app.models import User
+
+
+async def run(profile: str, rows: int, batch: int) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        writer, reader = make_engines(url, profile)
+        async with writer.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        Session = async_sessionmaker(writer, expire_on_commit=False, class_=AsyncSession)
+        ReadSession = async_sessionmaker(reader, expire_on_commit=False, class_=AsyncSession)
+        async with Session() as s:
+            user = User(google_sub="bench", email="bench@example.com")
+            s.add(user)
+            await s.commit()
+            user_id = user.id
+
+        entries = [IndexEntry(path=f"/data/dir{i % 1000}/file{i}.bin", size=i, mtime=float(i), inode=i) for i in range(rows)]
+        timings: dict[str, float] = {}
+
+        started = time.perf_counter()
+        for i in range(0, rows, batch):
+            async with Session() as s:
+                await save_index(s, user_id, entries[i : i + batch])
+        timings["insert"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        async with ReadSession() as s:
+            index = await load_index(s, user_id)
+        timings["load"] = time.perf_counter() - started
+
+        updated = list(index.values())
+        for e in updated:
+            e.sha256 = "0" * 64
+        started = time.perf_counter()
+        for i in range(0, rows, batch):
+            async with Session() as s:
+                await save_index(s, user_id, updated[i : i + batch])
+        timings["update"] = time.perf_counter() - started
+
+        await writer.dispose()
+        await reader.dispose()
+        return timings
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--profiles", default="default,tuned")
+    args = parser.parse_args()
+    for profile in args.profiles.split(","):
+        t = await run(profile, args.rows, args.batch)
+        rates = ", ".join(f"{k} {v:.2f}s ({args.rows / v:,.0f} rows/s)" for k, v in t.items())
+        print(f"{profile:>8}: {rates}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import models  # noqa: F401  (registers the tables on Base.metadata)
+from app.db import DATABASE_URL, Base
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("connection") is None:
+    fileConfig(config.config_file_name)
+target_metadata = Base.metadata
+
+
+def _run(connection) -> None:
+    # Batch mode: SQLite can only add constraints or change columns by rebuilding the table.
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def _run_async() -> None:
+    engine = create_async_engine(DATABASE_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(_run)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    context.configure(url=DATABASE_URL, target_metadata=target_metadata, literal_binds=True, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+elif config.attributes.get("connection") is not None:
+    # Called from app.db.migrate with a connection that is already open.
+    _run(config.attributes["connection"])
+else:
+    asyncio.run(_run_async())
@@ -0,0 +1,81 @@
+"""Baseline schema, as created by create_all before migrations existed.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("google_sub", sa.String(255), nullable=False),
+        sa.Column("email", sa.String(255), nullable=False),
+        sa.Column("refresh_token_enc", sa.Text, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_users_google_sub", "users", ["google_sub"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"])
+
+    op.create_table(
+        "sync_jobs",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("sync_id", sa.String(64), nullable=False),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("mode", sa.String(16), nullable=False),
+        sa.Column("paths", sa.Text, nullable=False),
+        sa.Column("exclusions", sa.Text, nullable=False),
+        sa.Column("options", sa.Text, nullable=False),
+        sa.Column("status", sa.String(32), nullable=False),
+        sa.Column("progress", sa.Integer, nullable=False),
+        sa.Column("error", sa.Text, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_sync_jobs_sync_id", "sync_jobs", ["sync_id"])
+
+    op.create_table(
+        "file_index",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("path", sa.Text, nullable=False),
+        sa.Column("sha256", sa.String(64), nullable=True),
+        sa.Column("mtime", sa.Float, nullable=True),
+        sa.Column("remote_id", sa.String(256), nullable=True),
+        sa.Column("remote_etag", sa.String(256), nullable=True),
+    )
+    op.create_index("ix_file_index_path", "file_index", ["path"])
+
+    op.create_table(
+        "metrics_points",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("ts", sa.DateTime, nullable=False),
+        sa.Column("cpu", sa.Float, nullable=False),
+        sa.Column("ram_used", sa.Integer, nullable=False),
+        sa.Column("ram_total", sa.Integer, nullable=False),
+    )
+    op.create_index("ix_metrics_points_ts", "metrics_points", ["ts"])
+
+    op.create_table(
+        "schedule_jobs",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("action", sa.String(16), nullable=False),
+        sa.Column("days", sa.String(32), nullable=False),
+        sa.Column("time_of_day", sa.String(8), nullable=False),
+        sa.Column("enabled", sa.Boolean, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    for table in ("schedule_jobs", "metrics_points", "file_index", "sync_jobs", "users"):
+        op.drop_table(table)
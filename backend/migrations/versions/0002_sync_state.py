@@ -0,0 +1,172 @@
+"""Sync state, file index keys, remote snapshot, chunk store, metrics tiers and size index.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+Each step checks what is already there. A database created by create_all from any later
+models (before migrations existed) is stamped at 0001 and brought to this revision too.
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+_METRIC_FIELDS = ("cpu", "ram_used", "ram_total", "disk_used", "disk_total", "net_rx", "net_tx")
+
+
+def _tables() -> set[str]:
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _columns(table: str) -> set[str]:
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _indexes(table: str) -> set[str]:
+    return {i["name"] for i in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _has_unique(table: str, columns: list[str]) -> bool:
+    insp = sa.inspect(op.get_bind())
+    found = [c["column_names"] for c in insp.get_unique_constraints(table)]
+    found += [i["column_names"] for i in insp.get_indexes(table) if i.get("unique")]
+    return columns in found
+
+
+def upgrade() -> None:
+    tables = _tables()
+
+    cols = _columns("sync_jobs")
+    with op.batch_alter_table("sync_jobs") as batch:
+        if "stats" not in cols:
+            batch.add_column(sa.Column("stats", sa.Text, nullable=False, server_default="{}"))
+        if "checkpoint" not in cols:
+            batch.add_column(sa.Column("checkpoint", sa.Text, nullable=True))
+        if "updated_at" not in cols:
+            batch.add_column(sa.Column("updated_at", sa.DateTime, nullable=True))
+
+    # (user_id, path) becomes the upsert key: keep the newest row of any duplicates first.
+    op.execute("DELETE FROM file_index WHERE id NOT IN (SELECT MAX(id) FROM file_index GROUP BY user_id, path)")
+    cols = _columns("file_index")
+    indexes = _indexes("file_index")
+    with op.batch_alter_table("file_index") as batch:
+        if "size" not in cols:
+            batch.add_column(sa.Column("size", sa.Integer, nullable=True))
+        if "inode" not in cols:
+            batch.add_column(sa.Column("inode", sa.Integer, nullable=True))
+        if "ix_file_index_path" in indexes:
+            batch.drop_index("ix_file_index_path")
+        if not _has_unique("file_index", ["user_id", "path"]):
+            batch.create_unique_constraint("uq_file_index_user_path", ["user_id", "path"])
+    if "ix_file_index_user_remote" not in _indexes("file_index"):
+        op.create_index("ix_file_index_user_remote", "file_index", ["user_id", "remote_id"])
+
+    if "resolution" not in _columns("metrics_points"):
+        # The baseline defined this table but never wrote to it, so it is rebuilt, not converted.
+        op.drop_table("metrics_points")
+        op.create_table(
+            "metrics_points",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("resolution", sa.Integer, nullable=False),
+            sa.Column("ts", sa.Float, nullable=False),
+            *(sa.Column(f, sa.Float, nullable=False) for f in _METRIC_FIELDS),
+            *(sa.Column(f"{f}_{agg}", sa.Float, nullable=True) for f in _METRIC_FIELDS for agg in ("min", "max")),
+        )
+    indexes = _indexes("metrics_points")
+    if "ix_metrics_points_covering" in indexes:
+        op.drop_index("ix_metrics_points_covering", table_name="metrics_points")
+    if "ix_metrics_points_resolution_ts" not in indexes:
+        op.create_index("ix_metrics_points_resolution_ts", "metrics_points", ["resolution", "ts"])
+
+    if "remote_files" not in tables:
+        op.create_table(
+            "remote_files",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("file_id", sa.String(256), nullable=False),
+            sa.Column("parent_id", sa.String(256), nullable=True),
+            sa.Column("name", sa.Text, nullable=False),
+            sa.Column("path", sa.Text, nullable=False),
+            sa.Column("mime_type", sa.String(128), nullable=False),
+            sa.Column("md5", sa.String(32), nullable=True),
+            sa.Column("size", sa.Integer, nullable=True),
+            sa.Column("modified_time", sa.String(40), nullable=True),
+            sa.UniqueConstraint("user_id", "file_id"),
+        )
+        op.create_index("ix_remote_files_path", "remote_files", ["path"])
+
+    if "drive_state" not in tables:
+        op.create_table(
+            "drive_state",
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("start_page_token", sa.String(256), nullable=True),
+            sa.Column("updated_at", sa.DateTime, nullable=False),
+        )
+
+    if "chunks" not in tables:
+        op.create_table(
+            "chunks",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("hash", sa.String(64), nullable=False),
+            sa.Column("size", sa.Integer, nullable=False),
+            sa.Column("remote_id", sa.String(256), nullable=False),
+            sa.Column("created_at", sa.DateTime, nullable=False),
+            sa.UniqueConstraint("user_id", "hash"),
+        )
+
+    if "chunk_manifests" not in tables:
+        op.create_table(
+            "chunk_manifests",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("path", sa.Text, nullable=False),
+            sa.Column("size", sa.Integer, nullable=False),
+            sa.Column("manifest", sa.Text, nullable=False),
+            sa.Column("remote_id", sa.String(256), nullable=True),
+            sa.Column("updated_at", sa.DateTime, nullable=False),
+            sa.UniqueConstraint("user_id", "path"),
+        )
+
+    if "dir_sizes" not in tables:
+        op.create_table(
+            "dir_sizes",
+            sa.Column("path", sa.Text, primary_key=True),
+            sa.Column("mtime_ns", sa.Integer, nullable=False),
+            sa.Column("own_size", sa.Integer, nullable=False),
+            sa.Column("own_files", sa.Integer, nullable=False),
+            sa.Column("exts", sa.Text, nullable=False),
+            sa.Column("total_size", sa.Integer, nullable=False),
+            sa.Column("total_files", sa.Integer, nullable=False),
+        )
+
+
+def downgrade() -> None:
+    for table in ("dir_sizes", "chunk_manifests", "chunks", "drive_state", "remote_files"):
+        op.drop_table(table)
+    op.drop_table("metrics_points")
+    op.create_table(
+        "metrics_points",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("ts", sa.DateTime, nullable=False),
+        sa.Column("cpu", sa.Float, nullable=False),
+        sa.Column("ram_used", sa.Integer, nullable=False),
+        sa.Column("ram_total", sa.Integer, nullable=False),
+    )
+    op.create_index("ix_metrics_points_ts", "metrics_points", ["ts"])
+    op.drop_index("ix_file_index_user_remote", table_name="file_index")
+    with op.batch_alter_table("file_index") as batch:
+        batch.drop_constraint("uq_file_index_user_path", type_="unique")
+        batch.drop_column("inode")
+        batch.drop_column("size")
+        batch.create_index("ix_file_index_path", ["path"])
+    with op.batch_alter_table("sync_jobs") as batch:
+        batch.drop_column("updated_at")
+        batch.drop_column("checkpoint")
+        batch.drop_column("stats")
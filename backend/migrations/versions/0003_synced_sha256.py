@@ -0,0 +1,29 @@
+"""Content hash of the last completed transfer on file_index.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if "synced_sha256" in {c["name"] for c in sa.inspect(op.get_bind()).get_columns("file_index")}:
+        return
+    with op.batch_alter_table("file_index") as batch:
+        batch.add_column(sa.Column("synced_sha256", sa.String(64), nullable=True))
+    # Rows with a remote copy were written by a transfer, so their hash is the synced one.
+    op.execute("UPDATE file_index SET synced_sha256 = sha256 WHERE remote_id IS NOT NULL")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("file_index") as batch:
+        batch.drop_column("synced_sha256")
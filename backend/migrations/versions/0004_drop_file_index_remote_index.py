@@ -0,0 +1,27 @@
+"""Drop the (user_id, remote_id) index on file_index.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+The changes feed no longer updates file_index rows by Drive file id, and nothing else
+looks them up that way.
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if "ix_file_index_user_remote" in {i["name"] for i in sa.inspect(op.get_bind()).get_indexes("file_index")}:
+        op.drop_index("ix_file_index_user_remote", table_name="file_index")
+
+
+def downgrade() -> None:
+    op.create_index("ix_file_index_user_remote", "file_index", ["user_id", "remote_id"])
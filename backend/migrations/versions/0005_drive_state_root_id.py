@@ -0,0 +1,27 @@
+"""Resolved id of the Drive "root" alias on drive_state.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if "root_id" in {c["name"] for c in sa.inspect(op.get_bind()).get_columns("drive_state")}:
+        return
+    with op.batch_alter_table("drive_state") as batch:
+        batch.add_column(sa.Column("root_id", sa.String(256), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("drive_state") as batch:
+        batch.drop_column("root_id")
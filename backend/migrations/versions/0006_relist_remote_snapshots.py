@@ -0,0 +1,25 @@
+"""Drop saved Drive changes tokens so filtered remote snapshots are relisted in full.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+Snapshots used to keep only the subtree of the last refreshed folder. Without a token the
+next refresh lists everything again and stores the unfiltered listing.
+"""
+from __future__ import annotations
+
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE drive_state SET start_page_token = NULL")
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,30 @@
+"""Drive's SHA-256 checksum on remote_files.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+Saved changes tokens are dropped so the next refresh relists every file with its checksum.
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if "sha256" in {c["name"] for c in sa.inspect(op.get_bind()).get_columns("remote_files")}:
+        return
+    with op.batch_alter_table("remote_files") as batch:
+        batch.add_column(sa.Column("sha256", sa.String(64), nullable=True))
+    op.execute("UPDATE drive_state SET start_page_token = NULL")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("remote_files") as batch:
+        batch.drop_column("sha256")
@@ -0,0 +1,15 @@
+import os
+
+import pytest_asyncio
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.db import engine, read_engine
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def _dispose_engines():
+    # Pooled connections belong to the event loop that opened them; each test gets a new loop.
+    yield
+    await engine.dispose()
+    await read_engine.dispose()
@@ -0,0 +1,371 @@
+"""Minimal in-process stand-in for the Drive v3 REST API used by the backend tests."""
+
+import email
+import hashlib
+import io
+import itertools
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+class _Captured:
+    """Handler stand-in that records one response, for the requests inside a batch."""
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.wfile = io.BytesIO()
+        self.status = 500
+        self.out_headers: list[tuple[str, str]] = []
+
+    def send_response(self, status):
+        self.status = status
+
+    def send_header(self, key, value):
+        self.out_headers.append((key, value))
+
+    def end_headers(self):
+        pass
+
+
+class FakeDrive:
+    def __init__(self):
+        self.files: dict[str, dict] = {}
+        self.sessions: dict[str, dict] = {}
+        self.changes: list[dict] = []
+        self.requests: list[tuple[str, str]] = []
+        # Calls that arrived inside a batch request; `requests` holds one entry per round trip.
+        self.batched: list[tuple[str, str]] = []
+        # (method, path prefix) -> number of 503 responses still to return
+        self.failures: dict[tuple[str, str], int] = {}
+        # Same, but the call is carried out before the 503: a response lost on the way back.
+        self.lost: dict[tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Id the "root" alias resolves to, as files().get("root") reports it.
+        self.root_id = "root"
+        # Answer media downloads with the whole file, as a server that ignores Range does.
+        self.ignore_ranges = False
+        drive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method):
+                drive._handle(self, method)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def endpoint(self) -> str:
+        return self.base + "/drive/v3/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, method: str, prefix: str, times: int = 1) -> None:
+        self.failures[(method, prefix)] = times
+
+    def lose(self, method: str, prefix: str, times: int = 1) -> None:
+        self.lost[(method, prefix)] = times
+
+    def add_file(self, name: str, content: bytes = b"", parents=None, mime: str = "application/octet-stream") -> dict:
+        with self.lock:
+            return self._create({"name": name, "parents": parents or [], "mimeType": mime}, content)
+
+    def _create(self, meta: dict, content: bytes = b"") -> dict:
+        fid = meta.get("id") or f"f{next(self._ids)}"
+        f = {
+            "id": fid,
+            "name": meta.get("name", "untitled"),
+            "mimeType": meta.get("mimeType", "application/octet-stream"),
+            "parents": meta.get("parents") or ["root"],
+            "trashed": False,
+            "modifiedTime": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "etag": f"etag-{fid}-1",
+            "content": content,
+        }
+        if f["mimeType"] != FOLDER_MIME:
+            f["md5Checksum"] = hashlib.md5(content).hexdigest()
+            f["sha256Checksum"] = hashlib.sha256(content).hexdigest()
+            f["size"] = str(len(content))
+        self.files[fid] = f
+        self._log(f)
+        return f
+
+    def _store(self, fid, meta: dict, content: bytes) -> dict:
+        if fid is None:
+            return self._create(meta, content)
+        return self._update(fid, content, meta)
+
+    def _log(self, f: dict, removed: bool = False) -> None:
+        change = {"fileId": f["id"], "removed": removed}
+        if not removed:
+            change["file"] = self.public(f)
+        self.changes.append(change)
+
+    def update_file(self, fid: str, content=None, **meta) -> dict:
+        with self.lock:
+            return self._update(fid, content, meta)
+
+    def _update(self, fid: str, content, meta: dict) -> dict:
+        f = self.files[fid]
+        f.update(meta)
+        if content is not None:
+            f["content"] = content
+            f["md5Checksum"] = hashlib.md5(content).hexdigest()
+            f["sha256Checksum"] = hashlib.sha256(content).hexdigest()
+            f["size"] = str(len(content))
+        version = int(f["etag"].rsplit("-", 1)[1]) + 1
+        f["etag"] = f"etag-{fid}-{version}"
+        f["modifiedTime"] = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        self._log(f)
+        return f
+
+    def delete_file(self, fid: str) -> None:
+        with self.lock:
+            self._log(self.files.pop(fid), removed=True)
+
+    @staticmethod
+    def public(f: dict) -> dict:
+        return {k: v for k, v in f.items() if k != "content"}
+
+    def _matches(self, f: dict, q: str) -> bool:
+        for clause in filter(None, (c.strip() for c in q.split(" and "))):
+            m = re.fullmatch(r"'([^']*)' in parents", clause)
+            if m:
+                if m.group(1) not in f["parents"]:
+                    return False
+                continue
+            m = re.fullmatch(r"(\w+)\s*(=|!=)\s*'((?:[^'\\]|\\.)*)'", clause)
+            if m:
+                value = m.group(3).replace("\\'", "'").replace("\\\\", "\\")
+                equal = str(f.get(m.group(1))) == value
+                if equal != (m.group(2) == "="):
+                    return False
+                continue
+            m = re.fullmatch(r"trashed\s*=\s*(true|false)", clause)
+            if m:
+                if f["trashed"] != (m.group(1) == "true"):
+                    return False
+        return True
+
+    def _handle(self, h: BaseHTTPRequestHandler, method: str) -> None:
+        length = int(h.headers.get("Content-Length") or 0)
+        body = h.rfile.read(length) if length else b""
+        if method == "POST" and urlparse(h.path).path == "/batch/drive/v3":
+            with self.lock:
+                self.requests.append((method, "/batch/drive/v3"))
+            return self._batch(h, body)
+        self._serve(h, method, h.path, body)
+
+    def _batch(self, h, body: bytes) -> None:
+        # multipart/mixed of embedded HTTP requests in, multipart/mixed of responses out.
+        outer = email.message_from_bytes(b"Content-Type: " + h.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+        out = []
+        for part in outer.get_payload():
+            raw = part.get_payload()
+            head, _, sub_body = re.split(r"(\r?\n\r?\n)", raw, maxsplit=1)
+            request_line, _, header_text = head.partition("\n")
+            method, target, _ = request_line.strip().split(" ")
+            sub = _Captured(email.message_from_string(header_text))
+            self._serve(sub, method, target, sub_body.encode(), log=self.batched)
+            headers = "".join(f"{k}: {v}\r\n" for k, v in sub.out_headers)
+            cid = part["Content-ID"].strip("<>")
+            out.append(
+                f"--fakebatch\r\nContent-Type: application/http\r\nContent-ID: <response-{cid}>\r\n\r\n"
+                f"HTTP/1.1 {sub.status} {HTTPStatus(sub.status).phrase}\r\n{headers}\r\n"
+                + sub.wfile.getvalue().decode()
+                + "\r\n"
+            )
+        data = ("".join(out) + "--fakebatch--\r\n").encode()
+        h.send_response(200)
+        h.send_header("Content-Type", "multipart/mixed; boundary=fakebatch")
+        h.send_header("Content-Length", str(len(data)))
+        h.end_headers()
+        h.wfile.write(data)
+
+    def _serve(self, h, method: str, target: str, body: bytes, log=None) -> None:
+        url = urlparse(target)
+        qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+        with self.lock:
+            (self.requests if log is None else log).append((method, url.path))
+            for (m, prefix), left in list(self.failures.items()):
+                if m == method and url.path.startswith(prefix) and left > 0:
+                    self.failures[(m, prefix)] = left - 1
+                    return self._send(h, 503, {"error": {"code": 503, "message": "backend error"}})
+            for (m, prefix), left in list(self.lost.items()):
+                if m == method and url.path.startswith(prefix) and left > 0:
+                    self.lost[(m, prefix)] = left - 1
+                    self._route(_Captured(h.headers), method, url.path, qs, body)
+                    return self._send(h, 503, {"error": {"code": 503, "message": "backend error"}})
+            return self._route(h, method, url.path, qs, body)
+
+    def _route(self, h, method, path, qs, body):
+        if method == "GET" and path == "/drive/v3/files":
+            matched = [f for f in self.files.values() if self._matches(f, qs.get("q", ""))]
+            matched.sort(key=lambda f: f["id"])
+            size = int(qs.get("pageSize", 100))
+            start = int(qs.get("pageToken", 0))
+            page = matched[start : start + size]
+            out = {"files": [self.public(f) for f in page]}
+            if start + size < len(matched):
+                out["nextPageToken"] = str(start + size)
+            return self._send(h, 200, out)
+        if method == "GET" and path == "/drive/v3/changes/startPageToken":
+            return self._send(h, 200, {"startPageToken": str(len(self.changes))})
+        if method == "GET" and path == "/drive/v3/changes":
+            if not qs["pageToken"].isdigit() or int(qs["pageToken"]) > len(self.changes):
+                return self._send(h, 400, {"error": {"code": 400, "message": "Invalid Value"}})
+            start = int(qs["pageToken"])
+            size = int(qs.get("pageSize", 100))
+            out = {"changes": self.changes[start : start + size]}
+            if start + size < len(self.changes):
+                out["nextPageToken"] = str(start + size)
+            else:
+                out["newStartPageToken"] = str(len(self.changes))
+            return self._send(h, 200, out)
+        if method == "GET" and path == "/drive/v3/files/generateIds":
+            return self._send(h, 200, {"ids": [f"f{next(self._ids)}" for _ in range(int(qs.get("count", 10)))]})
+        if method == "POST" and path == "/drive/v3/files":
+            meta = json.loads(body or b"{}")
+            if meta.get("id") in self.files:
+                return self._send(h, 409, {"error": {"code": 409, "message": "A file already exists with the provided ID."}})
+            return self._send(h, 200, self.public(self._create(meta)))
+        m = re.fullmatch(r"/drive/v3/files/([^/]+)", path)
+        if m:
+            f = self.files.get(m.group(1))
+            if f is None and m.group(1) == "root" and method == "GET":
+                return self._send(h, 200, {"id": self.root_id, "name": "My Drive", "mimeType": FOLDER_MIME})
+            if f is None:
+                return self._send(h, 404, {"error": {"code": 404, "message": "not found"}})
+            if method == "GET" and qs.get("alt") == "media":
+                return self._send_media(h, f["content"], not self.ignore_ranges)
+            if method == "GET":
+                return self._send(h, 200, self.public(f))
+            if method == "DELETE":
+                self._log(self.files.pop(f["id"]), removed=True)
+                return self._send(h, 204, None)
+            if method == "PATCH":
+                f.update(json.loads(body or b"{}"))
+                parents = [p for p in f["parents"] if p not in qs.get("removeParents", "").split(",")]
+                f["parents"] = parents + [p for p in qs.get("addParents", "").split(",") if p]
+                self._log(f)
+                return self._send(h, 200, self.public(f))
+        # POST creates a file; PATCH on /upload/drive/v3/files/<id> replaces an existing one's content.
+        m = re.fullmatch(r"/upload/drive/v3/files(?:/([^/]+))?", path)
+        if m and (method == "POST") == (m.group(1) is None) and method in ("POST", "PATCH"):
+            fid = m.group(1)
+            if fid is not None and fid not in self.files:
+                return self._send(h, 404, {"error": {"code": 404, "message": "not found"}})
+            if qs.get("uploadType") == "resumable":
+                sid = f"s{next(self._ids)}"
+                total = h.headers.get("X-Upload-Content-Length")
+                self.sessions[sid] = {
+                    "meta": json.loads(body or b"{}"),
+                    "data": b"",
+                    "total": int(total) if total else None,
+                    "file_id": fid,
+                }
+                return self._send(h, 200, {}, {"Location": f"{self.base}/upload/session/{sid}"})
+            if qs.get("uploadType") == "multipart":
+                boundary = h.headers.get_content_type() and h.headers.get_param("boundary")
+                parts = body.split(b"--" + boundary.encode())[1:-1]
+                # Part headers end with a blank line; the client may use \n or \r\n line endings.
+                meta_part, media_part = (re.split(rb"\r?\n\r?\n", p, maxsplit=1)[1] for p in parts)
+                content = re.sub(rb"\r?\n\Z", b"", media_part)
+                return self._send(h, 200, self.public(self._store(fid, json.loads(meta_part), content)))
+        m = re.fullmatch(r"/upload/session/([^/]+)", path)
+        if m and method == "PUT":
+            return self._upload_chunk(h, m.group(1), body)
+        return self._send(h, 404, {"error": {"code": 404, "message": f"no route {method} {path}"}})
+
+    def _upload_chunk(self, h, sid, body):
+        s = self.sessions.get(sid)
+        if s is None:
+            return self._send(h, 404, {"error": {"code": 404, "message": "no session"}})
+        rng = h.headers.get("Content-Range", "")
+        m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", rng)
+        if m:
+            start = int(m.group(1))
+            s["data"] = s["data"][:start] + body
+            if m.group(3) != "*":
+                s["total"] = int(m.group(3))
+        elif rng.startswith("bytes */"):
+            # Status query for an interrupted session.
+            if rng[8:] != "*":
+                s["total"] = int(rng[8:])
+        else:
+            s["data"] = body
+            s["total"] = len(body)
+        if s["total"] is not None and len(s["data"]) >= s["total"]:
+            f = self._store(s.get("file_id"), s["meta"], s["data"])
+            del self.sessions[sid]
+            return self._send(h, 200, self.public(f))
+        headers = {"Range": f"bytes=0-{len(s['data']) - 1}"} if s["data"] else {}
+        return self._send(h, 308, None, headers)
+
+    @staticmethod
+    def _send(h, status, payload, headers=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        h.send_response(status)
+        if payload is not None:
+            h.send_header("Content-Type", "application/json")
+        for k, v in (headers or {}).items():
+            h.send_header(k, v)
+        h.send_header("Content-Length", str(len(data)))
+        h.end_headers()
+        h.wfile.write(data)
+
+    @staticmethod
+    def _send_media(h, content: bytes, ranges: bool = True):
+        rng = h.headers.get("Range") if ranges else None
+        status = 200
+        start, end = 0, len(content) - 1
+        if rng:
+            m = re.fullmatch(r"bytes=(\d+)-(\d*)", rng)
+            start = int(m.group(1))
+            end = min(int(m.group(2)) if m.group(2) else end, len(content) - 1)
+            status = 206 if start <= end else 416
+        data = content[start : end + 1]
+        h.send_response(status)
+        h.send_header("Content-Type", "application/octet-stream")
+        h.send_header("Content-Length", str(len(data)))
+        if status == 206:
+            h.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        elif status == 416:
+            h.send_header("Content-Range", f"bytes */{len(content)}")
+        h.end_headers()
+        h.wfile.write(data)
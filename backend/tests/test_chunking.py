@@ -0,0 +1,83 @@
+import os
+import random
+import shutil
+import uuid
+from pathlib import Path
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.chunking import ChunkParams, ChunkStore, DriveChunkTarget, backup_file, iter_chunks, restore_file
+from app.google_drive import FOLDER_MIME, GoogleDriveClient
+from fake_drive import FakeDrive
+
+PARAMS = ChunkParams.for_average(16 * 1024)
+
+
+def test_chunks_resynchronise_after_insertion(tmp_path: Path):
+    data = random.Random(1).randbytes(400 * 1024)
+    a = tmp_path / "a.bin"
+    b = tmp_path / "b.bin"
+    a.write_bytes(data)
+    b.write_bytes(data[:1000] + b"inserted" + data[1000:])
+    ca = list(iter_chunks(str(a), params=PARAMS))
+    cb = list(iter_chunks(str(b), params=PARAMS))
+    assert sum(c.length for c in ca) == len(data)
+    assert all(PARAMS.min_size <= c.length <= PARAMS.max_size for c in ca[:-1])
+    shared = {c.hash for c in ca} & {c.hash for c in cb}
+    assert len(shared) >= len(ca) - 2
+
+
+@pytest.mark.asyncio
+async def test_backup_uploads_only_new_chunks(tmp_path: Path):
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.models import User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    data = bytearray(random.Random(2).randbytes(300 * 1024))
+    src = tmp_path / "vm.img"
+    src.write_bytes(data)
+    copy = tmp_path / "copy.img"
+    shutil.copy(src, copy)
+
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+        chunks_dir = drive.add_file("chunks", mime=FOLDER_MIME)["id"]
+        manifests_dir = drive.add_file("manifests", mime=FOLDER_MIME)["id"]
+        target = DriveChunkTarget(client, chunks_dir, manifests_dir)
+        async with AsyncSessionLocal() as session:
+            user = User(google_sub=f"chunks-{uuid.uuid4()}", email="c@example.com")
+            session.add(user)
+            await session.commit()
+        store = ChunkStore(user.id)
+
+        first = await backup_file(store, target, str(src), "vm.img", PARAMS)
+        assert first.new_chunks == first.chunks and first.bytes_uploaded == len(data)
+
+        dup = await backup_file(store, target, str(copy), "copy.img", PARAMS)
+        assert dup.new_chunks == 0
+
+        data[150 * 1024 : 150 * 1024 + 10] = b"0123456789"
+        src.write_bytes(data)
+        second = await backup_file(store, target, str(src), "vm.img", PARAMS)
+        assert second.new_chunks == 1
+        assert second.bytes_uploaded < len(data) // 4
+        assert (await store.manifest("vm.img")).remote_id == second.manifest_id
+        # The manifest was rewritten in place: one Drive file per backed-up name.
+        assert second.manifest_id == first.manifest_id
+        assert sum(manifests_dir in f["parents"] for f in drive.files.values()) == 2
+        drive.files.pop(first.manifest_id)
+        third = await backup_file(store, target, str(src), "vm.img", PARAMS)
+        assert third.manifest_id != first.manifest_id and third.new_chunks == 0
+
+        out = tmp_path / "restored.img"
+        await restore_file(store, target, "vm.img", str(out))
+        assert out.read_bytes() == bytes(data)
+
+        # A concurrent backup recording a chunk that is already known keeps the first row.
+        known = await store.known({c.hash for c in iter_chunks(str(src), params=PARAMS)})
+        await store.add([(h, 1, "duplicate") for h in known])
+        assert await store.known(set(known)) == known
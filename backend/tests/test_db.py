@@ -12,3 +12,16 @@ async def test_db_init():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     assert True
+
+
+@pytest.mark.asyncio
+async def test_sqlite_profile_applied():
+    from sqlalchemy import text
+
+    from app.db import read_engine
+
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+        assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == 5000
+    async with read_engine.connect() as conn:
+        assert (await conn.execute(text("PRAGMA query_only"))).scalar() == 1
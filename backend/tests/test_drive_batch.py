@@ -0,0 +1,67 @@
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+
+from app.drive_batch import DriveBatch
+from app.google_drive import FOLDER_MIME, GoogleDriveClient
+from fake_drive import FakeDrive
+
+
+def test_ensure_folders_creates_levels_in_batches():
+    with FakeDrive() as drive:
+        existing = drive.add_file("photos", parents=["root"], mime=FOLDER_MIME)
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+        batch = DriveBatch(client, size=50, sleep=lambda s: None)
+        paths = [f"photos/{y}/{m:02d}" for y in range(2010, 2020) for m in range(1, 13)]
+
+        drive.requests.clear()
+        ids = batch.ensure_folders(paths, "root")
+        folders = [f for f in drive.files.values() if f["mimeType"] == FOLDER_MIME]
+        assert len(ids) == len(folders) == 1 + 10 + 120
+        assert ids["photos"] == existing["id"]
+        parent = {f["id"]: f["parents"][0] for f in folders}
+        assert parent[ids["photos/2015/07"]] == ids["photos/2015"]
+        # photos: one lookup. Years: one lookup batch plus one create batch. Months: their
+        # parents were just created, so three create batches of 50 and no lookups. Each level
+        # that creates folders fetches its ids first.
+        batch_call, ids_call = ("POST", "/batch/drive/v3"), ("GET", "/drive/v3/files/generateIds")
+        assert drive.requests == [batch_call, batch_call, ids_call, batch_call, ids_call] + [batch_call] * 3
+        assert len(drive.batched) == 1 + 10 + 10 + 120
+
+        drive.requests.clear()
+        assert batch.ensure_folders(paths, "root") == ids
+        assert drive.requests == []
+
+
+def test_update_and_delete_report_per_item_results():
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+        batch = DriveBatch(client, sleep=lambda s: None)
+        dest = drive.add_file("dest", mime=FOLDER_MIME)
+        files = [drive.add_file(f"f{i}.txt", b"x") for i in range(5)]
+
+        # A transient failure is retried in the next batch; the rest succeed in the first.
+        drive.fail("PATCH", f"/drive/v3/files/{files[0]['id']}", times=1)
+        out = batch.update(
+            {f["id"]: {"name": f"renamed{i}.txt", "addParents": dest["id"], "removeParents": "root"} for i, f in enumerate(files)}
+        )
+        assert all(exc is None for _, exc in out.values())
+        assert {f["name"] for f in drive.files.values() if f["parents"] == [dest["id"]]} == {
+            f"renamed{i}.txt" for i in range(5)
+        }
+
+        errors = batch.delete([files[1]["id"], "missing"])
+        assert errors[files[1]["id"]] is None
+        assert isinstance(errors["missing"], HttpError) and errors["missing"].resp.status == 404
+        assert files[1]["id"] not in drive.files
+
+
+def test_retried_folder_create_does_not_duplicate():
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+        batch = DriveBatch(client, sleep=lambda s: None)
+        # The create goes through but its response is lost, so the batch sends it again.
+        drive.lose("POST", "/drive/v3/files", times=1)
+        ids = batch.ensure_folders(["new"], "root")
+        folders = [f for f in drive.files.values() if f["name"] == "new"]
+        assert len(folders) == 1 and ids == {"new": folders[0]["id"]}
+        assert drive.batched.count(("POST", "/drive/v3/files")) == 2
@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.drive_pool import DriveClientPool
+from app.utils import decrypt, encrypt, get_fernet
+
+
+def _client(user_id, token=None, expires_in=3600):
+    expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+    return SimpleNamespace(user_id=user_id, creds=SimpleNamespace(refresh_token="r", token=token, expiry=expiry))
+
+
+@pytest.mark.asyncio
+async def test_pool_builds_once_refreshes_early_and_evicts():
+    built, refreshed = [], []
+    now = [0.0]
+
+    async def factory(user_id):
+        built.append(user_id)
+        await asyncio.sleep(0.01)
+        return _client(user_id)
+
+    def refresh(client):
+        refreshed.append(client.user_id)
+        client.creds.token = "fresh"
+        client.creds.expiry = datetime.utcnow() + timedelta(seconds=3600)
+
+    pool = DriveClientPool(factory, size=2, idle_seconds=60, refresh_margin=300, refresh=refresh, clock=lambda: now[0])
+    first = await asyncio.gather(*(pool.get(1) for _ in range(5)))
+    assert built == [1] and refreshed == [1]
+    assert all(c is first[0] for c in first)
+
+    # Within the margin of expiry the token is refreshed before the client is handed out.
+    first[0].creds.expiry = datetime.utcnow() + timedelta(seconds=60)
+    await pool.get(1)
+    assert refreshed == [1, 1]
+
+    await pool.get(2)
+    await pool.get(1)
+    await pool.get(3)  # least recently used: user 2
+    assert built == [1, 2, 3] and len(pool) == 2
+    await pool.get(1)
+    assert built == [1, 2, 3]
+
+    now[0] = 30.0
+    await pool.get(3)
+    now[0] = 80.0
+    await pool.sweep()
+    assert len(pool) == 1
+    await pool.get(1)
+    assert built == [1, 2, 3, 1]
+
+
+def test_fernet_key_is_derived_once():
+    get_fernet.cache_clear()
+    token = encrypt("secret", "master")
+    assert decrypt(token, "master") == "secret"
+    assert get_fernet.cache_info().misses == 1
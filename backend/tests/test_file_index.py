@@ -0,0 +1,54 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.db import AsyncSessionLocal, Base, engine
+from app.file_index import FileIndexRepository, IndexEntry
+from app.models import FileIndex, User
+
+
+@pytest.mark.asyncio
+async def test_repository_upserts_streams_and_deletes():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as s:
+        user = User(google_sub=f"idx-{uuid.uuid4()}", email="idx@example.com")
+        s.add(user)
+        await s.commit()
+
+        repo = FileIndexRepository(s, user.id, chunk_size=7)
+        entries = [IndexEntry(path=f"/r/f{i}", size=i, mtime=1.0, inode=i) for i in range(50)]
+        assert await repo.upsert(entries) == 50
+        await s.commit()
+
+        # Same paths again: rows are updated in place, never duplicated.
+        for e in entries[:10]:
+            e.sha256 = "a" * 64
+            e.remote_id = f"r{e.size}"
+        await repo.upsert(entries[:10] + [IndexEntry(path="/r/new", size=1)])
+        await s.commit()
+
+        count = await s.execute(select(func.count()).select_from(FileIndex).where(FileIndex.user_id == user.id))
+        assert count.scalar_one() == 51
+        loaded = await repo.load()
+        assert len(loaded) == 51
+        # A scan never writes the remote columns; only a recorded transfer does.
+        assert loaded["/r/f3"].sha256 == "a" * 64 and loaded["/r/f3"].remote_id is None
+        synced = IndexEntry(path="/r/f3", size=3, sha256="a" * 64, remote_id="r3", remote_etag="m3", synced_sha256="a" * 64)
+        await repo.record_synced([synced])
+        await repo.upsert([IndexEntry(path="/r/f3", size=4, sha256="b" * 64, remote_id="stale")])
+        await s.commit()
+        f3 = (await repo.get(["/r/f3"]))["/r/f3"]
+        assert (f3.size, f3.sha256, f3.remote_id, f3.remote_etag, f3.synced_sha256) == (4, "b" * 64, "r3", "m3", "a" * 64)
+        assert loaded["/r/f30"].sha256 is None and loaded["/r/f30"].id is not None
+
+        got = await repo.get(["/r/f1", "/r/missing"])
+        assert list(got) == ["/r/f1"]
+
+        await repo.delete([f"/r/f{i}" for i in range(40)])
+        await s.commit()
+        assert len([e async for e in repo.stream()]) == 11
@@ -0,0 +1,62 @@
+import os
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import fs
+from app.security import get_current_user_sub
+
+
+def _client():
+    app = FastAPI()
+    app.include_router(fs.router)
+    app.dependency_overrides[get_current_user_sub] = lambda: "tester"
+    return TestClient(app)
+
+
+def test_tree_pages_sorts_and_revalidates(tmp_path, monkeypatch):
+    monkeypatch.setattr(fs, "listing_cache", fs.ListingCache(size=2))
+    for i in range(3):
+        (tmp_path / f"dir{i}").mkdir()
+    for i in range(7):
+        (tmp_path / f"File{i}.txt").write_bytes(b"x" * (i * 10))
+    client = _client()
+
+    def walk(**params):
+        names, cursor = [], None
+        while True:
+            r = client.get("/api/fs/tree", params={"path": str(tmp_path), "limit": 4, "cursor": cursor, **params})
+            assert r.status_code == 200
+            body = r.json()
+            assert body["total"] == 10
+            names += [e["name"] for e in body["entries"]]
+            cursor = body["next_cursor"]
+            if not cursor:
+                return names
+
+    files = [f"File{i}.txt" for i in range(7)]
+    assert walk() == ["dir0", "dir1", "dir2", *files]
+    assert walk(order="desc") == ["dir2", "dir1", "dir0", *reversed(files)]
+    assert walk(sort="size", order="desc")[3:] == list(reversed(files))
+
+    r = client.get("/api/fs/tree", params={"path": str(tmp_path)})
+    tag = r.headers["etag"]
+    calls = []
+    monkeypatch.setattr(fs.ListingCache, "get", lambda *a: calls.append(a))
+    assert client.get("/api/fs/tree", params={"path": str(tmp_path)}, headers={"If-None-Match": tag}).status_code == 304
+    assert calls == []
+    monkeypatch.undo()
+
+    # New directory sizes from the index change the page, and with it the ETag.
+    fs.get_size_index().generation += 1
+    r = client.get("/api/fs/tree", params={"path": str(tmp_path)}, headers={"If-None-Match": tag})
+    assert r.status_code == 200 and r.headers["etag"] != tag
+    tag = r.headers["etag"]
+
+    (tmp_path / "new.txt").write_bytes(b"")
+    os.utime(tmp_path, ns=(0, os.stat(tmp_path).st_mtime_ns + 10**9))
+    r = client.get("/api/fs/tree", params={"path": str(tmp_path)}, headers={"If-None-Match": tag})
+    assert r.status_code == 200 and r.json()["total"] == 11
+
+    assert client.get("/api/fs/tree", params={"path": str(tmp_path), "cursor": "bogus"}).status_code == 400
+    assert client.get("/api/fs/tree", params={"path": str(tmp_path / "missing")}).status_code == 404
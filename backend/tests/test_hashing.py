@@ -0,0 +1,41 @@
+import asyncio
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from app.hashing import HashPool, hash_file
+
+
+def test_hash_file_matches_hashlib(tmp_path: Path):
+    small = tmp_path / "small.bin"
+    big = tmp_path / "big.bin"
+    empty = tmp_path / "empty.bin"
+    small.write_bytes(b"abc" * 1000)
+    big.write_bytes(bytes(range(256)) * 5000)
+    empty.write_bytes(b"")
+    for p in (small, big, empty):
+        expected = hashlib.sha256(p.read_bytes()).hexdigest()
+        assert hash_file(str(p), chunk=4096) == expected
+        assert hash_file(str(p)) == expected
+
+
+@pytest.mark.asyncio
+async def test_hash_pool_imap_with_backpressure(tmp_path: Path):
+    files = []
+    for i in range(20):
+        p = tmp_path / f"f{i}.txt"
+        p.write_text(str(i))
+        files.append(str(p))
+    files.append(str(tmp_path / "missing.txt"))
+
+    pool = HashPool(workers=4, queue_size=2)
+    seen = {}
+    async for path, digest, exc in pool.imap(files, lambda p: p):
+        await asyncio.sleep(0)
+        seen[path] = digest if exc is None else exc
+    pool.shutdown()
+
+    assert len(seen) == 21
+    assert seen[files[3]] == hashlib.sha256(b"3").hexdigest()
+    assert isinstance(seen[files[-1]], FileNotFoundError)
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+from sqlalchemy import delete, func, select
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.db import AsyncSessionLocal, Base, engine
+from app.metrics_db import MetricsWriter, query_history
+from app.metrics_store import FIELDS
+from app.models import MetricsPoint
+
+
+def _values(cpu: float) -> dict:
+    return {f: cpu if f == "cpu" else 1.0 for f in FIELDS}
+
+
+@pytest.mark.asyncio
+async def test_writer_batches_compacts_and_queries():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as s:
+        await s.execute(delete(MetricsPoint))
+        await s.commit()
+
+    writer = MetricsWriter(batch_size=1000)
+    now = 10 * 86400.0
+    # Two days of samples, one every 10 seconds.
+    start = now - 2 * 86400
+    for i in range(0, 2 * 86400, 10):
+        writer.add(start + i, _values(float(i % 100)))
+    assert await writer.flush() == 2 * 8640
+    assert await writer.flush() == 0
+
+    await writer.compact(now)
+    async with AsyncSessionLocal() as s:
+        counts = dict((await s.execute(select(MetricsPoint.resolution, func.count()).group_by(MetricsPoint.resolution))).all())
+        # Raw rows older than the raw retention became one row per minute.
+        assert counts[1] <= 8640
+        assert counts[60] >= 1440
+        assert 3600 not in counts
+
+        points = await query_history(s, 2 * 86400, 3600, now)
+        assert 47 <= len(points) <= 49
+        p = points[0]
+        assert p["min"]["cpu"] == 0.0 and p["max"]["cpu"] == 90.0
+        assert p["cpu"] == pytest.approx(45.0)
+        assert p["ram_used"] == 1.0
+
+    # Far in the future everything has expired.
+    await writer.compact(now + 400 * 86400)
+    async with AsyncSessionLocal() as s:
+        assert (await s.execute(select(func.count()).select_from(MetricsPoint))).scalar_one() == 0
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from app.metrics_sampler import MetricsSampler
+from app.metrics_store import MetricsHistory
+
+
+def _fake_sample():
+    calls = {"n": 0}
+
+    def sample():
+        calls["n"] += 1
+        return {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "cpu": 1.0,
+            "per_cpu": [1.0],
+            "ram": {"used": 1, "total": 2},
+            "disk": {"used": 1, "total": 2},
+            "net": {"rx": 0, "tx": 0},
+            "top": [],
+        }
+
+    return sample, calls
+
+
+@pytest.mark.asyncio
+async def test_one_sample_is_shared_by_all_subscribers():
+    sample, calls = _fake_sample()
+    sampler = MetricsSampler(0.01, MetricsHistory(raw_hours=1), sample)
+    queues = [sampler.subscribe() for _ in range(20)]
+    sampler.start()
+    payloads = await asyncio.wait_for(asyncio.gather(*(q.get() for q in queues)), 1)
+    await asyncio.sleep(0.05)
+    await sampler.stop()
+
+    assert all(p is payloads[0] for p in payloads)
+    # Sampling cost does not scale with subscribers.
+    assert calls["n"] < 20
+    # Slow subscribers are coalesced to the latest snapshot instead of queueing a backlog.
+    assert all(q.qsize() <= 1 for q in queues)
@@ -0,0 +1,34 @@
+import pytest
+
+from app.metrics_store import FIELDS, MetricsHistory, parse_duration
+
+
+def _values(cpu: float) -> dict:
+    return {f: 0.0 for f in FIELDS} | {"cpu": cpu}
+
+
+def test_rollups_and_downsampled_query():
+    h = MetricsHistory(raw_hours=1, minute_days=1, hour_days=1)
+    t0 = 1_700_000_000 - 1_700_000_000 % 3600
+    for i in range(2 * 3600):
+        h.add(t0 + i, _values(float(i % 60)))
+        h.add(t0 + i + 0.5, _values(999.0))  # second producer within the same second is ignored
+
+    assert h.raw.size == 3600  # ring buffer keeps only the last hour
+    assert h.minutes.size == 119 and h.hours.size == 1
+
+    now = t0 + 2 * 3600
+    pts = h.query(parse_duration("10m"), parse_duration("1m"), now)
+    assert len(pts) == 10
+    assert pts[0]["cpu"] == pytest.approx(29.5)
+    assert pts[0]["min"]["cpu"] == 0.0 and pts[0]["max"]["cpu"] == 59.0
+
+    # Beyond the raw tier's span the minute rollups answer, still downsampled server-side.
+    pts = h.query(parse_duration("2h"), parse_duration("30m"), now)
+    assert [p["max"]["cpu"] for p in pts] == [59.0] * 4
+
+
+def test_parse_duration_rejects_garbage():
+    assert parse_duration("24h") == 86400
+    with pytest.raises(ValueError):
+        parse_duration("soon")
@@ -0,0 +1,73 @@
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import sqlite
+
+from app import models
+from app.db import Base, migrate
+
+# Schema of a database created by the baseline release through create_all.
+LEGACY_DDL = [
+    "CREATE TABLE users (id INTEGER NOT NULL, google_sub VARCHAR(255) NOT NULL, email VARCHAR(255) NOT NULL, "
+    "refresh_token_enc TEXT, created_at DATETIME NOT NULL, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX ix_users_google_sub ON users (google_sub)",
+    "CREATE INDEX ix_users_email ON users (email)",
+    "CREATE TABLE metrics_points (id INTEGER NOT NULL, ts DATETIME NOT NULL, cpu FLOAT NOT NULL, "
+    "ram_used INTEGER NOT NULL, ram_total INTEGER NOT NULL, PRIMARY KEY (id))",
+    "CREATE INDEX ix_metrics_points_ts ON metrics_points (ts)",
+    "CREATE TABLE sync_jobs (id INTEGER NOT NULL, sync_id VARCHAR(64) NOT NULL, user_id INTEGER NOT NULL, "
+    "mode VARCHAR(16) NOT NULL, paths TEXT NOT NULL, exclusions TEXT NOT NULL, options TEXT NOT NULL, "
+    "status VARCHAR(32) NOT NULL, progress INTEGER NOT NULL, error TEXT, created_at DATETIME NOT NULL, "
+    "PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id))",
+    "CREATE INDEX ix_sync_jobs_sync_id ON sync_jobs (sync_id)",
+    "CREATE TABLE file_index (id INTEGER NOT NULL, user_id INTEGER NOT NULL, path TEXT NOT NULL, "
+    "sha256 VARCHAR(64), mtime FLOAT, remote_id VARCHAR(256), remote_etag VARCHAR(256), PRIMARY KEY (id), "
+    "FOREIGN KEY(user_id) REFERENCES users (id))",
+    "CREATE INDEX ix_file_index_path ON file_index (path)",
+    "CREATE TABLE schedule_jobs (id INTEGER NOT NULL, user_id INTEGER NOT NULL, action VARCHAR(16) NOT NULL, "
+    "days VARCHAR(32) NOT NULL, time_of_day VARCHAR(8) NOT NULL, enabled BOOLEAN NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(user_id) REFERENCES users (id))",
+]
+
+
+def _diff(conn) -> list:
+    return compare_metadata(MigrationContext.configure(conn), Base.metadata)
+
+
+def test_legacy_database_is_upgraded_in_place(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        for ddl in LEGACY_DDL:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("INSERT INTO users VALUES (1, 'sub', 'a@b.c', NULL, '2024-01-01 00:00:00')")
+        conn.exec_driver_sql(
+            "INSERT INTO sync_jobs VALUES (1, 's1', 1, 'oneway', '[]', '[]', '{}', 'completed', 100, NULL, '2024-01-01')"
+        )
+        for i, sha in enumerate(("old", "new")):
+            conn.exec_driver_sql(f"INSERT INTO file_index VALUES ({i + 1}, 1, '/r/a.txt', '{sha}', 1.0, NULL, NULL)")
+
+    with engine.begin() as conn:
+        migrate(conn)
+    with engine.begin() as conn:
+        assert _diff(conn) == []
+        assert conn.execute(text("SELECT sha256 FROM file_index")).scalars().all() == ["new"]
+        assert conn.execute(text("SELECT stats, checkpoint FROM sync_jobs")).one() == ("{}", None)
+        table = models.FileIndex.__table__
+        stmt = sqlite.insert(table).values(user_id=1, path="/r/a.txt", sha256="newer")
+        conn.execute(stmt.on_conflict_do_update(index_elements=[table.c.user_id, table.c.path], set_={"sha256": "newer"}))
+        assert conn.execute(text("SELECT count(*), max(sha256) FROM file_index")).one() == (1, "newer")
+
+    # Running again at startup is a no-op.
+    with engine.begin() as conn:
+        migrate(conn)
+    engine.dispose()
+
+
+def test_new_database_matches_models(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    with engine.begin() as conn:
+        migrate(conn)
+    with engine.begin() as conn:
+        assert _diff(conn) == []
+        assert conn.execute(text("SELECT version_num FROM alembic_version")).scalar() == "0007"
+    engine.dispose()
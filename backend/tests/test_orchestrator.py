@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.db import AsyncSessionLocal, Base, engine
+from app.models import SyncJob, User
+from app.orchestrator import SyncOrchestrator
+from app.sync_engine import SyncOptions
+
+
+async def _user() -> int:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as s:
+        user = User(google_sub=f"orch-{uuid.uuid4()}", email="o@example.com")
+        s.add(user)
+        await s.commit()
+        return user.id
+
+
+async def _rows(user_id: int) -> dict[str, SyncJob]:
+    async with AsyncSessionLocal() as s:
+        result = await s.execute(select(SyncJob).where(SyncJob.user_id == user_id))
+        return {r.sync_id: r for r in result.scalars()}
+
+
+def _tree(root: Path, n: int) -> str:
+    root.mkdir()
+    for i in range(n):
+        (root / f"f{i}.txt").write_text(str(i))
+    return str(root)
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_concurrently_and_persist_state(tmp_path: Path):
+    user_id = await _user()
+    orch = SyncOrchestrator(max_jobs=4, jobs_per_disk=4, flush_seconds=0.05)
+    ids = [
+        await orch.submit(user_id, "oneway", [_tree(tmp_path / f"set{i}", 5)], [], SyncOptions(), sync_id=f"set{i}-{user_id}")
+        for i in range(3)
+    ]
+    assert len(orch.running(user_id)) == 3
+    await asyncio.gather(*(orch.jobs[i].task for i in ids if i in orch.jobs))
+
+    rows = await _rows(user_id)
+    for i in ids:
+        assert rows[i].status == "completed"
+        assert rows[i].progress == 100
+        assert json.loads(rows[i].stats)["changed"] == 5
+    assert [j["status"] for j in await orch.list_jobs(user_id)] == ["completed"] * 3
+    # Finished jobs are gone from memory; their status comes from the persisted row.
+    assert ids[0] not in orch.jobs
+    assert (await orch.job_status(ids[0], user_id))["status"] == "completed"
+    assert await orch.job_status(ids[0], user_id + 1) is None
+    await orch.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_queued_job_can_be_stopped_and_resumed(tmp_path: Path):
+    user_id = await _user()
+    orch = SyncOrchestrator(max_jobs=1, flush_seconds=0.05)
+    first = await orch.submit(user_id, "oneway", [_tree(tmp_path / "a", 50)], [], SyncOptions())
+    second = await orch.submit(user_id, "oneway", [_tree(tmp_path / "b", 3)], [], SyncOptions())
+    with pytest.raises(ValueError):
+        await orch.submit(user_id, "oneway", [], [], SyncOptions(), sync_id=second)
+    assert orch.stop(second)
+    await asyncio.gather(*(j.task for j in list(orch.jobs.values())))
+
+    rows = await _rows(user_id)
+    assert rows[first].status == "completed"
+    assert rows[second].status == "stopped"
+
+    await orch.resume(second, user_id)
+    await orch.jobs[second].task
+    assert (await _rows(user_id))[second].status == "completed"
+    await orch.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_recover_marks_interrupted_jobs():
+    user_id = await _user()
+    async with AsyncSessionLocal() as s:
+        s.add(SyncJob(sync_id=f"stale-{user_id}", user_id=user_id, mode="oneway", paths="[]", status="running"))
+        await s.commit()
+    orch = SyncOrchestrator()
+    assert await orch.recover() >= 1
+    assert (await _rows(user_id))[f"stale-{user_id}"].status == "interrupted"
+
+
+@pytest.mark.asyncio
+async def test_running_job_stops_with_checkpoint_and_resumes(tmp_path: Path, monkeypatch):
+    import app.sync_engine as sync_engine
+
+    monkeypatch.setattr(sync_engine, "INDEX_FLUSH_SIZE", 5)
+    user_id = await _user()
+    orch = SyncOrchestrator(flush_seconds=0.05)
+    save = orch._save_checkpoint
+
+    async def save_and_stop(job, cp):
+        await save(job, cp)
+        if cp is not None:
+            orch.stop(job.sync_id)
+
+    monkeypatch.setattr(orch, "_save_checkpoint", save_and_stop)
+    sync_id = await orch.submit(user_id, "oneway", [_tree(tmp_path / "big", 40)], [], SyncOptions())
+    await orch.jobs[sync_id].task
+    row = (await _rows(user_id))[sync_id]
+    assert row.status == "stopped"
+    assert json.loads(row.checkpoint)["last_path"]
+
+    monkeypatch.setattr(orch, "_save_checkpoint", save)
+    await orch.resume(sync_id, user_id)
+    await orch.jobs[sync_id].task
+    row = (await _rows(user_id))[sync_id]
+    assert row.status == "completed" and row.checkpoint is None
+    assert json.loads(row.stats)["scanned"] < 40
+    await orch.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_job_waiting_for_a_busy_disk_leaves_the_global_slot_free(tmp_path: Path, monkeypatch):
+    import app.orchestrator as orchestrator
+    from app.sync_engine import SyncEngine
+
+    monkeypatch.setattr(orchestrator, "_disk_of", lambda path: 1 if os.path.basename(path).startswith("busy") else 2)
+    release = asyncio.Event()
+    started: list[str] = []
+
+    async def fake_start(self, mode, paths, *args, **kwargs):
+        started.append(os.path.basename(paths[0]))
+        await release.wait()
+        return True
+
+    monkeypatch.setattr(SyncEngine, "start", fake_start)
+    user_id = await _user()
+    orch = SyncOrchestrator(max_jobs=2, jobs_per_disk=1, flush_seconds=0.05)
+    for name in ("busy1", "busy2", "idle"):
+        await orch.submit(user_id, "oneway", [str(tmp_path / name)], [], SyncOptions())
+    try:
+        await asyncio.sleep(0.1)
+        assert started == ["busy1", "idle"]
+    finally:
+        release.set()
+        await asyncio.gather(*(j.task for j in list(orch.jobs.values())))
+        await orch.shutdown()
+    assert started == ["busy1", "idle", "busy2"]
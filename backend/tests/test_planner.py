@@ -0,0 +1,165 @@
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.file_index import IndexEntry
+from app.google_drive import FOLDER_MIME
+from app.planner import LocalFile, plan_sync
+from app.remote_tree import RemoteEntry
+from app.sync_engine import SyncEngine, SyncOptions
+
+
+def _synced(path: str, n: int):
+    # One file in sync on all three sides.
+    sha, md5 = f"sha{n}", f"md5{n}"
+    return (
+        LocalFile(path, n, 1.0, sha),
+        IndexEntry(path, n, 1.0, n, sha, f"id{n}", md5, sha),
+        RemoteEntry(f"id{n}", path.rsplit("/", 1)[-1], "p", "text/plain", md5, n, "2020-01-01T00:00:00Z", path),
+    )
+
+
+def _actions(plan):
+    return sorted((a.kind, a.side, a.src, a.path) for a in plan.actions)
+
+
+def test_twoway_merge_covers_every_case():
+    rows = [_synced(f"set/f{i}", i) for i in range(8)]
+    local = [r[0] for r in rows]
+    base = [r[1] for r in rows]
+    remote = [r[2] for r in rows]
+    local[0].sha256 = "edited"  # changed locally
+    remote[1].md5 = "edited"  # changed remotely
+    local[2].sha256 = remote[2].md5 = "both"  # changed on both sides
+    local.remove(local[3])  # deleted locally
+    remote.remove(remote[4])  # deleted remotely
+    local.remove(local[4])  # (was f5) deleted on both sides
+    remote.remove(remote[4])
+    local.append(LocalFile("set/new.txt", 3, 1.0, "fresh"))
+    remote.append(RemoteEntry("r9", "cloud.txt", "p", "text/plain", "m9", 9, None, "set/cloud.txt"))
+
+    plan = plan_sync(local, base, remote, keep_both=True)
+    assert _actions(plan) == [
+        ("conflict_copy", "local", "set/f2", "set/f2 (conflict copy)"),
+        ("delete", "local", None, "set/f4"),
+        ("delete", "remote", None, "set/f3"),
+        ("download", "local", None, "set/cloud.txt"),
+        ("download", "local", None, "set/f1"),
+        ("download", "local", None, "set/f2"),
+        ("forget", "index", None, "set/f5"),
+        ("upload", "remote", None, "set/f0"),
+        ("upload", "remote", None, "set/f2 (conflict copy)"),
+        ("upload", "remote", None, "set/new.txt"),
+    ]
+    kinds = [b[0].kind for b in plan.batches(size=2)]
+    assert kinds.index("conflict_copy") < kinds.index("download") < kinds.index("delete")
+
+    # One-way: local wins and nothing local is touched.
+    oneway = plan_sync(local, base, remote, mode="oneway")
+    assert {a.side for a in oneway.actions} <= {"remote", "index"}
+
+
+def test_first_sync_of_identical_copies_only_records_the_base():
+    local = [LocalFile("set/same", 4, 1.0, "sha-same"), LocalFile("set/differs", 4, 1.0, "sha-local")]
+    remote = [
+        RemoteEntry("r1", "same", "p", "text/plain", "m1", 4, None, "set/same", sha256="sha-same"),
+        RemoteEntry("r2", "differs", "p", "text/plain", "m2", 4, None, "set/differs", sha256="sha-remote"),
+    ]
+    plan = plan_sync(local, [], remote)
+    assert [(a.kind, a.side, a.path, a.remote_id) for a in plan.ordered()] == [
+        ("upload", "remote", "set/differs", "r2"),
+        ("record", "index", "set/same", "r1"),
+    ]
+
+
+def test_moved_folder_becomes_one_remote_rename():
+    rows = [_synced(f"photos/2020/img{i}.jpg", i) for i in range(1, 50)]
+    rows.append(_synced("photos/keep.jpg", 50))
+    local = [r[0] for r in rows]
+    base = [r[1] for r in rows]
+    remote = [r[2] for r in rows] + [
+        RemoteEntry("fp", "photos", "root", FOLDER_MIME, path="photos"),
+        RemoteEntry("f20", "2020", "fp", FOLDER_MIME, path="photos/2020"),
+    ]
+    for f in local[:-1]:
+        f.path = f.path.replace("photos/2020", "archive/2020")
+
+    plan = plan_sync(local, base, remote)
+    assert [(a.kind, a.side, a.src, a.path, a.folder, a.remote_id) for a in plan.actions] == [
+        ("rename", "remote", "photos/2020", "archive/2020", True, "f20")
+    ]
+    assert plan.summary()["upload_bytes"] == 0
+    assert plan.summary()["renamed_bytes"] == sum(range(1, 50))
+
+    # A file moved on its own stays a single metadata rename, never an upload.
+    local[-1].path = "photos/kept.jpg"
+    plan = plan_sync(local, base, remote)
+    assert ("rename", "remote", "photos/keep.jpg", "photos/kept.jpg") in _actions(plan)
+    assert not [a for a in plan.actions if a.kind in ("upload", "delete")]
+
+
+def test_remote_move_renames_locally():
+    rows = [_synced(f"docs/a{i}.txt", i) for i in range(1, 4)]
+    local = [r[0] for r in rows]
+    base = [r[1] for r in rows]
+    remote = [r[2] for r in rows]
+    for r in remote:
+        r.path = r.path.replace("docs/", "papers/")
+    plan = plan_sync(local, base, remote)
+    assert _actions(plan) == [("rename", "local", "docs", "papers")]
+
+
+@pytest.mark.asyncio
+async def test_engine_plan_scans_without_side_effects(tmp_path: Path):
+    root = tmp_path / "set"
+    root.mkdir()
+    for i in range(5):
+        (root / f"f{i}.txt").write_text(str(i))
+    remote = [RemoteEntry("r1", "f1.txt", "p", "text/plain", "x", 1, None, "set/f1.txt")]
+    plan = await SyncEngine().plan("twoway", [str(root)], [], SyncOptions(), remote=remote)
+    summary = plan.summary()
+    assert summary["upload"] == 5 and summary["upload_bytes"] == 5
+    assert sorted(p.name for p in root.iterdir()) == [f"f{i}.txt" for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_engine_plan_is_empty_when_index_and_remote_agree(tmp_path: Path):
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.file_index import FileIndexRepository
+    from app.hashing import hash_file
+    from app.models import User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    root = tmp_path / "set"
+    root.mkdir()
+    remote, synced = [], []
+    for i in range(3):
+        p = root / f"f{i}.txt"
+        p.write_text(str(i))
+        st = p.stat()
+        sha = hash_file(str(p))
+        synced.append(IndexEntry(str(p), st.st_size, st.st_mtime, st.st_ino, sha, f"r{i}", f"md5{i}", sha))
+        remote.append(RemoteEntry(f"r{i}", p.name, "p", "text/plain", f"md5{i}", 1, None, f"set/{p.name}"))
+    # Scanned but never uploaded: not part of the synced base.
+    (root / "new.txt").write_text("new")
+    async with AsyncSessionLocal() as session:
+        user = User(google_sub=f"plan-{uuid.uuid4()}", email="p@example.com")
+        session.add(user)
+        await session.commit()
+        repo = FileIndexRepository(session, user.id)
+        await repo.record_synced(synced)
+        await repo.upsert([IndexEntry(str(root / "new.txt"), 3, 1.0, 1, "x" * 64)])
+        await session.commit()
+        user_id = user.id
+
+    plan = await SyncEngine().plan("twoway", [str(root)], [], SyncOptions(), user_id=user_id, remote=remote)
+    assert _actions(plan) == [("upload", "remote", None, "set/new.txt")]
+
+    # Against the same base, a file gone from the snapshot was deleted remotely.
+    plan = await SyncEngine().plan("twoway", [str(root)], [], SyncOptions(), user_id=user_id, remote=remote[1:])
+    assert _actions(plan) == [("delete", "local", None, "set/f0.txt"), ("upload", "remote", None, "set/new.txt")]
@@ -0,0 +1,199 @@
+import os
+import uuid
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.google_drive import FOLDER_MIME, GoogleDriveClient
+from app.remote_tree import RemoteTree, load_snapshot, save_snapshot
+from fake_drive import FakeDrive
+
+
+def test_listing_follows_pages_and_snapshot_warms_folder_cache():
+    with FakeDrive() as drive:
+        root = drive.add_file("Backup", mime=FOLDER_MIME)
+        docs = drive.add_file("docs", parents=[root["id"]], mime=FOLDER_MIME)
+        for i in range(25):
+            drive.add_file(f"f{i}.txt", b"x" * i, parents=[docs["id"]])
+        drive.add_file("elsewhere.txt")
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+
+        assert len(client.list_files(f"'{docs['id']}' in parents", page_size=10)) == 25
+
+        drive.requests.clear()
+        tree = RemoteTree.fetch(client, root["id"])
+        assert len(drive.requests) == 1
+        assert tree.folder_id("docs") == docs["id"]
+        assert tree.by_path["docs/f3.txt"].size == 3
+        assert "elsewhere.txt" not in tree.by_path
+
+        drive.requests.clear()
+        assert client.ensure_path("docs/new", root["id"]) == client.ensure_path("docs/new", root["id"])
+        # "docs" comes from the snapshot; only "new" is looked up and created, once.
+        assert [m for m, _ in drive.requests] == ["GET", "POST"]
+
+
+@pytest.mark.asyncio
+async def test_snapshot_roundtrip_through_db():
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.models import User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    with FakeDrive() as drive:
+        root = drive.add_file("Backup", mime=FOLDER_MIME)
+        sub = drive.add_file("a", parents=[root["id"]], mime=FOLDER_MIME)
+        drive.add_file("b.txt", b"hi", parents=[sub["id"]])
+        tree = RemoteTree.fetch(GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint), root["id"])
+
+    async with AsyncSessionLocal() as session:
+        user = User(google_sub=f"remote-tree-{uuid.uuid4()}", email="r@example.com")
+        session.add(user)
+        await session.commit()
+        await save_snapshot(session, user.id, tree)
+        loaded = await load_snapshot(session, user.id, root["id"])
+    assert set(loaded.by_path) == {"a", "a/b.txt"}
+    assert loaded.by_path["a/b.txt"].md5 == tree.by_path["a/b.txt"].md5
+
+
+@pytest.mark.asyncio
+async def test_changes_feed_updates_snapshot_not_index():
+    from sqlalchemy import select
+
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.models import FileIndex, User
+    from app.remote_changes import refresh_remote_tree
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    with FakeDrive() as drive:
+        root = drive.add_file("Backup", mime=FOLDER_MIME)
+        a = drive.add_file("a", parents=[root["id"]], mime=FOLDER_MIME)
+        b = drive.add_file("b.txt", b"v1", parents=[a["id"]])
+        synced_md5 = b["md5Checksum"]
+        gone = drive.add_file("gone.txt", b"x", parents=[root["id"]])
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+
+        async with AsyncSessionLocal() as session:
+            user = User(google_sub=f"changes-{uuid.uuid4()}", email="c@example.com")
+            session.add(user)
+            await session.commit()
+            session.add_all([
+                FileIndex(user_id=user.id, path="/l/b.txt", remote_id=b["id"], remote_etag=b["md5Checksum"]),
+                FileIndex(user_id=user.id, path="/l/gone.txt", remote_id=gone["id"]),
+            ])
+            await session.commit()
+
+            tree, delta = await refresh_remote_tree(user.id, client, root["id"])
+            assert delta.full_listing and set(tree.by_path) == {"a", "a/b.txt", "gone.txt"}
+
+            drive.update_file(b["id"], content=b"v2")
+            drive.update_file(a["id"], name="renamed")
+            drive.delete_file(gone["id"])
+            drive.requests.clear()
+            tree, delta = await refresh_remote_tree(user.id, client, root["id"])
+            assert not delta.full_listing
+            assert all(path.startswith("/drive/v3/changes") for _, path in drive.requests)
+            assert set(tree.by_path) == {"renamed", "renamed/b.txt"}
+            assert delta.removed == [gone["id"]]
+
+            # The index keeps the last synced state; the planner finds the change by comparing.
+            rows = {r.path: r for r in (await session.execute(select(FileIndex).where(FileIndex.user_id == user.id))).scalars()}
+            assert rows["/l/b.txt"].remote_etag == synced_md5 != tree.by_path["renamed/b.txt"].etag
+            assert rows["/l/gone.txt"].remote_id == gone["id"]
+
+
+@pytest.mark.asyncio
+async def test_root_alias_reads_the_snapshot_it_was_saved_under():
+    from app.db import AsyncSessionLocal, Base, ReadSessionLocal, engine
+    from app.models import User
+    from app.remote_changes import refresh_remote_tree, resolve_root
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    with FakeDrive() as drive:
+        drive.root_id = "my-drive"
+        drive.add_file("top.txt", b"x", parents=["my-drive"])
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+        async with AsyncSessionLocal() as session:
+            user = User(google_sub=f"root-alias-{uuid.uuid4()}", email="r@example.com")
+            session.add(user)
+            await session.commit()
+
+        async with ReadSessionLocal() as session:
+            assert await resolve_root(session, user.id, "root") == "root"
+        tree, _ = await refresh_remote_tree(user.id, client, "root")
+        assert tree.root_id == "my-drive" and set(tree.by_path) == {"top.txt"}
+
+        # Offline reads of "root" land on the same snapshot, without asking Drive.
+        drive.requests.clear()
+        async with ReadSessionLocal() as session:
+            loaded = await load_snapshot(session, user.id, await resolve_root(session, user.id, "root"))
+        assert set(loaded.by_path) == {"top.txt"} and drive.requests == []
+
+        tree, delta = await refresh_remote_tree(user.id, client, "root")
+        assert not delta.full_listing and set(tree.by_path) == {"top.txt"}
+        assert all(path.startswith("/drive/v3/changes") for _, path in drive.requests)
+
+
+@pytest.mark.asyncio
+async def test_rejected_page_token_falls_back_to_full_listing():
+    from app.db import AsyncSessionLocal, Base, ReadSessionLocal, engine
+    from app.models import User
+    from app.remote_changes import load_page_token, refresh_remote_tree, save_page_token
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    with FakeDrive() as drive:
+        root = drive.add_file("Backup", mime=FOLDER_MIME)
+        drive.add_file("a.txt", b"a", parents=[root["id"]])
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+        async with AsyncSessionLocal() as session:
+            user = User(google_sub=f"expired-token-{uuid.uuid4()}", email="e@example.com")
+            session.add(user)
+            await session.commit()
+            await save_page_token(session, user.id, "expired")
+
+        tree, delta = await refresh_remote_tree(user.id, client, root["id"])
+        assert delta.full_listing and set(tree.by_path) == {"a.txt"}
+        async with ReadSessionLocal() as session:
+            assert await load_page_token(session, user.id) == delta.token != "expired"
+
+        drive.add_file("b.txt", b"b", parents=[root["id"]])
+        tree, delta = await refresh_remote_tree(user.id, client, root["id"])
+        assert not delta.full_listing and set(tree.by_path) == {"a.txt", "b.txt"}
+
+
+@pytest.mark.asyncio
+async def test_refreshing_two_roots_alternately_keeps_both_trees():
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.models import User
+    from app.remote_changes import refresh_remote_tree
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    with FakeDrive() as drive:
+        a = drive.add_file("A", mime=FOLDER_MIME)
+        b = drive.add_file("B", mime=FOLDER_MIME)
+        drive.add_file("a.txt", b"a", parents=[a["id"]])
+        in_b = drive.add_file("b.txt", b"b", parents=[b["id"]])
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint)
+        async with AsyncSessionLocal() as session:
+            user = User(google_sub=f"two-roots-{uuid.uuid4()}", email="t@example.com")
+            session.add(user)
+            await session.commit()
+
+        tree, delta = await refresh_remote_tree(user.id, client, a["id"])
+        assert delta.full_listing and set(tree.by_path) == {"a.txt"}
+        tree, delta = await refresh_remote_tree(user.id, client, b["id"])
+        assert not delta.full_listing and set(tree.by_path) == {"b.txt"}
+
+        # A change under B consumed by A's refresh still shows up in B's tree.
+        drive.update_file(in_b["id"], name="renamed.txt")
+        drive.add_file("new.txt", b"n", parents=[b["id"]])
+        tree, _ = await refresh_remote_tree(user.id, client, a["id"])
+        assert set(tree.by_path) == {"a.txt"}
+        tree, delta = await refresh_remote_tree(user.id, client, b["id"])
+        assert set(tree.by_path) == {"renamed.txt", "new.txt"} and delta.changed == []
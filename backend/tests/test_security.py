@@ -0,0 +1,51 @@
+import pytest
+
+from app import security
+from app.security import AuthUser, TokenCache
+from app.utils import create_jwt
+
+
+@pytest.mark.asyncio
+async def test_authenticate_caches_verified_token(monkeypatch):
+    decoded, looked_up = [], []
+    real_verify = security.verify_jwt
+
+    def verify(token, secret):
+        decoded.append(token)
+        return real_verify(token, secret)
+
+    async def user_id(sub):
+        looked_up.append(sub)
+        return 7 if sub == "alice" else None
+
+    monkeypatch.setattr(security, "verify_jwt", verify)
+    monkeypatch.setattr(security, "_user_id", user_id)
+    monkeypatch.setattr(security, "token_cache", TokenCache(size=4))
+
+    token = create_jwt("alice", security.JWT_SECRET)
+    for _ in range(5):
+        assert await security.authenticate(token) == AuthUser("alice", 7)
+    assert len(decoded) == 1 and looked_up == ["alice"]
+
+    # Unknown subjects are not cached, so a later sign-up is seen on the next request.
+    stranger = create_jwt("bob", security.JWT_SECRET)
+    assert (await security.authenticate(stranger)).id is None
+    await security.authenticate(stranger)
+    assert looked_up == ["alice", "bob", "bob"]
+
+    assert await security.authenticate(create_jwt("alice", "wrong-secret")) is None
+    assert await security.authenticate(None) is None
+
+
+def test_token_cache_expires_at_exp_and_is_bounded():
+    now = [100.0]
+    cache = TokenCache(size=2, clock=lambda: now[0])
+    cache.put("a", AuthUser("a", 1), exp=150)
+    cache.put("b", AuthUser("b", 2), exp=500)
+    assert cache.get("a").id == 1
+    cache.put("c", AuthUser("c", 3), exp=500)  # least recently used: b
+    assert cache.get("b") is None and len(cache) == 2
+
+    now[0] = 150.0
+    assert cache.get("a") is None
+    assert cache.get("c").id == 3
@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app import size_index
+from app.db import Base, engine
+from app.size_index import SizeIndex
+
+
+def _write(path, size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+
+
+def _touch_dir(path):
+    # Guarantee a visible mtime step on filesystems with coarse timestamps.
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+@pytest.mark.asyncio
+async def test_index_aggregates_and_updates_only_changed_dirs(tmp_path, monkeypatch):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    _write(tmp_path / "a" / "one.txt", 10)
+    _write(tmp_path / "a" / "deep" / "two.log", 20)
+    _write(tmp_path / "b" / "three.txt", 30)
+    _write(tmp_path / "b" / "cache" / "four.bin", 40)
+    _write(tmp_path / "top.txt", 5)
+
+    index = SizeIndex([str(tmp_path)])
+    await index.refresh()
+    assert index.size_of(str(tmp_path)) == (105, 5)
+    assert index.size_of(str(tmp_path / "a")) == (30, 2)
+
+    scanned = []
+    real_scan = size_index._scan
+    monkeypatch.setattr(size_index, "_scan", lambda p, m: scanned.append(p) or real_scan(p, m))
+    generation = index.generation
+    await index.refresh()
+    assert index.generation == generation  # nothing changed
+    _write(tmp_path / "a" / "deep" / "five.txt", 100)
+    _touch_dir(tmp_path / "a" / "deep")
+    (tmp_path / "b" / "cache" / "four.bin").unlink()
+    (tmp_path / "b" / "cache").rmdir()
+    _touch_dir(tmp_path / "b")
+    await index.refresh()
+    assert sorted(scanned) == [str(tmp_path / "a" / "deep"), str(tmp_path / "b")]
+    assert index.generation > generation
+    assert index.size_of(str(tmp_path)) == (165, 5)
+    assert index.size_of(str(tmp_path / "b" / "cache")) is None
+
+    # A fresh instance picks the persisted rows up without rescanning anything.
+    restored = SizeIndex()
+    await restored.load()
+    assert str(tmp_path) in restored.roots
+    assert restored.size_of(str(tmp_path / "a")) == (130, 3)
+    scanned.clear()
+    await restored.refresh()
+    assert scanned == []
+
+    est = await index.estimate([str(tmp_path / "a"), str(tmp_path / "a" / "deep"), str(tmp_path / "top.txt")])
+    assert (est["size"], est["files"]) == (135, 4)
+    est = await index.estimate([str(tmp_path)], ["*.log", "**/b/**"])
+    assert (est["size"], est["files"]) == (115, 3)
+    est = await index.estimate([str(tmp_path / "missing")])
+    assert est["missing"] == [str(tmp_path / "missing")]
+
+
+def test_scan_skips_directory_symlinks(tmp_path):
+    _write(tmp_path / "a" / "one.txt", 10)
+    _write(tmp_path / "top.txt", 5)
+    (tmp_path / "loop").symlink_to(tmp_path, target_is_directory=True)
+    (tmp_path / "top-link.txt").symlink_to(tmp_path / "top.txt")
+    node = size_index._scan(str(tmp_path), 0)
+    assert (node.own_files, node.own_size, node.subdirs) == (2, 10, ("a",))
+
+
+@pytest.mark.asyncio
+async def test_estimate_with_name_patterns_lists_the_files(tmp_path):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    _write(tmp_path / "keep.txt", 10)
+    _write(tmp_path / "notes.txt", 20)
+    _write(tmp_path / ".bashrc", 5)
+    _write(tmp_path / "a.tar.gz", 7)
+    _write(tmp_path / "other.gz", 3)
+    index = SizeIndex([str(tmp_path)])
+    await index.refresh()
+
+    est = await index.estimate([str(tmp_path)], ["*/notes.txt"])
+    assert (est["size"], est["files"]) == (25, 4)
+    est = await index.estimate([str(tmp_path)], ["*.tar.gz"])
+    assert (est["size"], est["files"]) == (38, 4)
+    est = await index.estimate([str(tmp_path)], ["*.bashrc", "*.txt"])
+    assert (est["size"], est["files"]) == (10, 2)
+
+
+@pytest.mark.asyncio
+async def test_refresh_stops_at_other_filesystems(tmp_path, monkeypatch):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    _write(tmp_path / "local" / "one.txt", 10)
+    _write(tmp_path / "mnt" / "big.bin", 1000)
+    real_stat = os.stat
+
+    class Mounted:
+        def __init__(self, st):
+            self._st = st
+
+        def __getattr__(self, name):
+            return getattr(self._st, name)
+
+        st_dev = -1
+
+    def fake_stat(path, *args, **kwargs):
+        st = real_stat(path, *args, **kwargs)
+        return Mounted(st) if str(path) == str(tmp_path / "mnt") else st
+
+    monkeypatch.setattr(size_index.os, "stat", fake_stat)
+    index = SizeIndex([str(tmp_path)])
+    await index.refresh()
+    assert index.size_of(str(tmp_path)) == (10, 1)
+    assert index.size_of(str(tmp_path / "mnt")) is None
+
+
+@pytest.mark.asyncio
+async def test_backup_roots_are_tracked(tmp_path):
+    import json
+    import uuid
+
+    from app.db import AsyncSessionLocal
+    from app.models import SyncJob, User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    (tmp_path / "docs").mkdir()
+    async with AsyncSessionLocal() as s:
+        user = User(google_sub=f"sizes-{uuid.uuid4()}", email="s@example.com")
+        s.add(user)
+        await s.commit()
+        paths = json.dumps([str(tmp_path / "docs"), str(tmp_path / "gone")])
+        s.add(SyncJob(sync_id=uuid.uuid4().hex, user_id=user.id, mode="oneway", paths=paths))
+        await s.commit()
+    index = SizeIndex()
+    await index.track_backup_roots()
+    assert str(tmp_path / "docs") in index.roots
+    assert str(tmp_path / "gone") not in index.roots
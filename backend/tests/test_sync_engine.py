@@ -1,5 +1,6 @@
 import asyncio
 import os
+import uuid
 from pathlib import Path
 
 import pytest
@@ -21,3 +22,232 @@ async def test_sync_engine_scans_and_progress(tmp_path: Path):
     st = eng.status()
     assert st["progress"] == 100
     assert not st["running"]
+
+
+@pytest.mark.asyncio
+async def test_sync_engine_incremental_skips_unchanged(tmp_path: Path):
+    os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.models import User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        user = User(google_sub=f"sub-{uuid.uuid4()}", email="a@example.com")
+        session.add(user)
+        await session.commit()
+        user_id = user.id
+
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_text("hello")
+    (src / "b.txt").write_text("world")
+
+    eng = SyncEngine()
+    await eng.start("oneway", [str(src)], [], SyncOptions(), user_id=user_id)
+    assert eng.status()["changed"] == 2
+
+    await eng.start("oneway", [str(src)], [], SyncOptions(), user_id=user_id)
+    st = eng.status()
+    assert st["skipped"] == 2 and st["changed"] == 0
+
+    (src / "b.txt").write_text("world!")
+    (src / "a.txt").unlink()
+    await eng.start("oneway", [str(src)], [], SyncOptions(), user_id=user_id)
+    st = eng.status()
+    assert st["changed"] == 1 and st["removed"] == 1
+
+
+def test_exclusion_matcher_prunes_directories():
+    from app.utils import compile_exclusions, match_exclusions
+
+    m = compile_exclusions(["**/node_modules/**", "*.tmp"])
+    assert m is compile_exclusions(["**/node_modules/**", "*.tmp"])
+    assert m.prune_dir("/home/u/proj/node_modules")
+    assert not m.prune_dir("/home/u/proj/src")
+    assert m.match("/home/u/proj/node_modules/x/index.js")
+    assert match_exclusions("C:\\Users\\u\\a.tmp", ["*.tmp"])
+    assert not match_exclusions("/home/u/a.txt", ["*.tmp"])
+
+
+@pytest.mark.asyncio
+async def test_sync_engine_stops_at_checkpoint_and_resumes(tmp_path: Path, monkeypatch):
+    os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+    import app.sync_engine as sync_engine
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.models import User
+    from app.walker import sort_key
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        user = User(google_sub=f"sub-{uuid.uuid4()}", email="a@example.com")
+        session.add(user)
+        await session.commit()
+        user_id = user.id
+
+    src = tmp_path / "src"
+    for d in range(3):
+        (src / f"d{d}").mkdir(parents=True)
+        for i in range(10):
+            (src / f"d{d}" / f"f{i:02}.txt").write_text(f"{d}-{i}")
+    monkeypatch.setattr(sync_engine, "INDEX_FLUSH_SIZE", 5)
+
+    eng = SyncEngine()
+    checkpoints = []
+
+    async def on_checkpoint(cp):
+        checkpoints.append(cp)
+        eng.stop()
+
+    assert not await eng.start("oneway", [str(src)], [], SyncOptions(), user_id=user_id, on_checkpoint=on_checkpoint)
+    assert not eng.status()["running"] and eng.status()["progress"] < 100
+    cp = checkpoints[-1]
+    assert cp["last_path"].startswith(str(src))
+
+    resumed = SyncEngine()
+    done = []
+
+    async def record(cp):
+        done.append(cp)
+
+    assert await resumed.start("oneway", [str(src)], [], SyncOptions(), user_id=user_id, checkpoint=cp, on_checkpoint=record)
+    st = resumed.status()
+    after = sum(1 for p in src.rglob("*.txt") if sort_key(str(p)) > sort_key(cp["last_path"]))
+    assert st["scanned"] == after
+    assert st["removed"] == 0
+    assert done[-1] is None
+
+    # Every file is now indexed, so a fresh full pass changes nothing.
+    final = SyncEngine()
+    await final.start("oneway", [str(src)], [], SyncOptions(), user_id=user_id)
+    assert final.status()["skipped"] == 30
+
+
+@pytest.mark.asyncio
+async def test_oneway_run_uploads_and_records_transfers(tmp_path: Path):
+    os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+    from google.auth.credentials import AnonymousCredentials
+
+    from app.db import AsyncSessionLocal, Base, ReadSessionLocal, engine
+    from app.file_index import load_index
+    from app.google_drive import GoogleDriveClient
+    from app.models import User
+    from app.transfers import TransferScheduler
+    from fake_drive import FakeDrive
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        user = User(google_sub=f"sub-{uuid.uuid4()}", email="a@example.com")
+        session.add(user)
+        await session.commit()
+        user_id = user.id
+
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a.txt").write_text("hello")
+    (src / "sub" / "b.txt").write_text("world")
+
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=0)
+        transfers = TransferScheduler(client, workers=2, large_workers=1)
+        root = drive.add_file("backup", mime="application/vnd.google-apps.folder")["id"]
+        options = SyncOptions(remote_root=root)
+
+        # Indexed without a remote first: those rows are not synced and still get uploaded.
+        await SyncEngine().start("oneway", [str(src)], [], SyncOptions(), user_id=user_id)
+        eng = SyncEngine()
+        assert await eng.start("oneway", [str(src)], [], options, user_id=user_id, transfers=transfers)
+        st = eng.status()
+        assert st["errors"] == [] and st["bytes_done"] == st["bytes_total"] == 10 and st["uploaded"] == 2
+        by_name = {f["name"]: f for f in drive.files.values()}
+        assert by_name["b.txt"]["content"] == b"world" and by_name["sub"]["parents"] == [by_name["src"]["id"]]
+        # Folder lookups and creates went through batch requests, one level at a time.
+        assert ("GET", "/drive/v3/files") not in drive.requests and ("POST", "/drive/v3/files") not in drive.requests
+        async with ReadSessionLocal() as session:
+            index = await load_index(session, user_id)
+        a = index[str(src / "a.txt")]
+        assert a.remote_id == by_name["a.txt"]["id"] and a.synced_sha256 == a.sha256
+        assert a.remote_etag == by_name["a.txt"]["md5Checksum"]
+
+        # Nothing changed: no transfer at all.
+        files = len(drive.files)
+        again = SyncEngine()
+        assert await again.start("oneway", [str(src)], [], options, user_id=user_id, transfers=transfers)
+        assert again.status()["skipped"] == 2 and len(drive.files) == files
+
+        # Uploads start as files are handed over, not when the run reaches a checkpoint.
+        from app.file_index import IndexEntry
+        from app.sync_engine import _Uploader
+        from app.walker import FileEntry
+
+        (src / "c.txt").write_text("later")
+        st = os.stat(src / "c.txt")
+        uploader = _Uploader(again, transfers, options, [str(src)], user_id)
+        await uploader.put(FileEntry.from_stat(str(src / "c.txt"), st), IndexEntry(str(src / "c.txt")))
+        for _ in range(100):
+            if any(f["name"] == "c.txt" for f in drive.files.values()):
+                break
+            await asyncio.sleep(0.02)
+        assert any(f["name"] == "c.txt" for f in drive.files.values())
+        await uploader.close()
+        assert [e.path for e in uploader.take()] == [str(src / "c.txt")]
+        (src / "c.txt").unlink()
+        files = len(drive.files)
+
+        # An edit replaces the content of the same Drive file.
+        (src / "a.txt").write_text("hello again")
+        edit = SyncEngine()
+        assert await edit.start("oneway", [str(src)], [], options, user_id=user_id, transfers=transfers)
+        assert len(drive.files) == files and drive.files[a.remote_id]["content"] == b"hello again"
+        transfers.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_oneway_run_uploads_large_files_as_chunks(tmp_path: Path):
+    os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+    from google.auth.credentials import AnonymousCredentials
+
+    from app.chunking import ChunkStore
+    from app.db import AsyncSessionLocal, Base, ReadSessionLocal, engine
+    from app.file_index import load_index
+    from app.google_drive import GoogleDriveClient
+    from app.models import User
+    from app.transfers import TransferScheduler
+    from fake_drive import FakeDrive
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        user = User(google_sub=f"sub-{uuid.uuid4()}", email="a@example.com")
+        session.add(user)
+        await session.commit()
+        user_id = user.id
+
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "small.txt").write_text("small")
+    (src / "big.img").write_bytes(os.urandom(64 * 1024))
+
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=0)
+        transfers = TransferScheduler(client, workers=2, large_workers=1)
+        root = drive.add_file("backup", mime="application/vnd.google-apps.folder")["id"]
+        options = SyncOptions(remote_root=root, chunk_min_size=1024)
+
+        eng = SyncEngine()
+        assert await eng.start("oneway", [str(src)], [], options, user_id=user_id, transfers=transfers)
+        assert eng.status()["errors"] == []
+        names = {f["name"] for f in drive.files.values()}
+        assert "small.txt" in names and "big.img" not in names and ".onyx" in names
+        async with ReadSessionLocal() as session:
+            index = await load_index(session, user_id)
+        big = index[str(src / "big.img")]
+        manifest = await ChunkStore(user_id).manifest(str(src / "big.img"))
+        assert big.remote_id == manifest.remote_id and big.synced_sha256 == big.sha256
+
+        again = SyncEngine()
+        assert await again.start("oneway", [str(src)], [], options, user_id=user_id, transfers=transfers)
+        assert again.status()["skipped"] == 2
+        transfers.shutdown()
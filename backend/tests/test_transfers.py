@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+from pathlib import Path
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+
+from app.google_drive import ChecksumMismatch, GoogleDriveClient
+from app.transfers import Transfer, TransferScheduler
+from fake_drive import FakeDrive
+
+
+@pytest.mark.asyncio
+async def test_scheduler_uploads_and_downloads_against_fake_drive(tmp_path: Path):
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=3)
+        sched = TransferScheduler(client, workers=4, large_workers=1, large_threshold=1024)
+
+        uploads = []
+        for i in range(10):
+            p = tmp_path / f"u{i}.bin"
+            p.write_bytes(bytes([i]) * (4096 if i == 0 else 10))
+            uploads.append(Transfer("upload", str(p), size=p.stat().st_size))
+        # The first upload attempt hits a 503 and must be retried transparently.
+        drive.fail("POST", "/upload/drive/v3/files", times=1)
+        done = [t async for t in sched.run(uploads)]
+        assert [t.error for t in done] == [None] * 10
+        assert len(drive.files) == 10
+
+        remote = next(f for f in drive.files.values() if f["name"] == "u0.bin")
+        drive.fail("GET", f"/drive/v3/files/{remote['id']}", times=2)
+        dest = tmp_path / "restored.bin"
+        t = await sched.transfer(Transfer("download", str(dest), file_id=remote["id"]))
+        assert t.error is None
+        assert dest.read_bytes() == bytes([0]) * 4096
+        sched.shutdown()
+
+
+def test_chunked_upload_resumes_from_saved_session(tmp_path: Path):
+    chunk = 256 * 1024
+    opts = {"chunk_size": chunk, "multipart_max": 0}
+    data = bytes(range(256)) * (5 * chunk // 256) + b"tail"
+    src = tmp_path / "big.bin"
+    src.write_bytes(data)
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=0)
+        sessions: list = []
+        progress: list = []
+
+        def drop_after_two_chunks(done, total):
+            progress.append((done, total))
+            if done == 2 * chunk:
+                drive.fail("PUT", "/upload/session", times=1)
+
+        with pytest.raises(HttpError):
+            client.upload_file(str(src), None, on_session=sessions.append, on_progress=drop_after_two_chunks, **opts)
+        assert progress == [(chunk, len(data)), (2 * chunk, len(data))]
+        assert len(sessions) == 1 and not drive.files
+
+        drive.requests.clear()
+        progress.clear()
+        result = client.upload_file(str(src), None, session_uri=sessions[0], on_progress=lambda d, t: progress.append(d), **opts)
+        # One status query, then only the four chunks the server never acknowledged.
+        assert [m for m, _ in drive.requests] == ["PUT"] * 5
+        assert progress[0] == 3 * chunk and progress[-1] == len(data)
+        assert drive.files[result["id"]]["content"] == data
+
+        # An expired session falls back to a fresh upload.
+        sessions.clear()
+        gone = f"{drive.base}/upload/session/gone"
+        result = client.upload_file(str(src), None, session_uri=gone, on_session=sessions.append, **opts)
+        assert sessions[0] is None and sessions[1].startswith(drive.base)
+        assert drive.files[result["id"]]["content"] == data
+
+
+@pytest.mark.asyncio
+async def test_scheduler_tracks_sessions_and_progress(tmp_path: Path):
+    src = tmp_path / "large.bin"
+    src.write_bytes(b"x" * (6 * 1024 * 1024))
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=0)
+        sched = TransferScheduler(client, workers=1, large_workers=1)
+        sessions = {str(src): f"{drive.base}/upload/session/stale"}
+        progress = []
+        done = [
+            t async for t in sched.run(
+                [Transfer("upload", str(src), size=src.stat().st_size)],
+                sessions=sessions,
+                on_progress=lambda path, d, total: progress.append((path, d, total)),
+            )
+        ]
+        assert done[0].error is None
+        assert sessions == {}
+        assert progress[-1] == (str(src), 6 * 1024 * 1024, 6 * 1024 * 1024)
+        sched.shutdown()
+
+
+def test_download_streams_verifies_and_resumes(tmp_path: Path):
+    chunk = 256 * 1024
+    data = bytes(range(256)) * (4 * chunk // 256) + b"tail"
+    dest = tmp_path / "restored.bin"
+    part = tmp_path / "restored.bin.part"
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=0)
+        fid = drive.add_file("restored.bin", data)["id"]
+
+        def drop_after_two_chunks(done, total):
+            if done == 2 * chunk:
+                drive.fail("GET", f"/drive/v3/files/{fid}", times=1)
+
+        with pytest.raises(HttpError):
+            client.download_file(fid, str(dest), chunk_size=chunk, on_progress=drop_after_two_chunks)
+        assert not dest.exists() and part.stat().st_size == 2 * chunk
+
+        drive.requests.clear()
+        out = client.download_file(fid, str(dest), chunk_size=chunk)
+        # Metadata for the checksum, then only the three chunks that were missing.
+        assert len(drive.requests) == 4
+        assert dest.read_bytes() == data and not part.exists()
+        assert out == {
+            "size": len(data),
+            "md5": hashlib.md5(data).hexdigest(),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+
+        # A partial copy that no longer matches the remote file is discarded.
+        part.write_bytes(b"stale" * 1000)
+        assert client.download_file(fid, str(dest), chunk_size=chunk)["size"] == len(data)
+        assert dest.read_bytes() == data
+
+        # A server that ignores the range sends everything; the part file starts over.
+        part.write_bytes(data[:chunk])
+        drive.ignore_ranges = True
+        assert client.download_file(fid, str(dest), chunk_size=chunk)["md5"] == hashlib.md5(data).hexdigest()
+        assert dest.read_bytes() == data
+        drive.ignore_ranges = False
+
+        with pytest.raises(ChecksumMismatch):
+            client.download_file(fid, str(tmp_path / "bad.bin"), expected_md5="0" * 32)
+        assert list(tmp_path.glob("bad.bin*")) == []
+
+
+def test_failed_chunk_is_retried_after_a_status_query(tmp_path: Path):
+    chunk = 256 * 1024
+    data = bytes(range(256)) * (3 * chunk // 256)
+    src = tmp_path / "big.bin"
+    src.write_bytes(data)
+    empty = tmp_path / "empty.bin"
+    empty.write_bytes(b"")
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=1)
+        drive.lose("PUT", "/upload/session", times=1)
+        result = client.upload_file(str(src), None, chunk_size=chunk, multipart_max=0)
+        assert drive.files[result["id"]]["content"] == data
+        # Open, the lost first chunk, the status query, then the second and third chunks.
+        assert [m for m, _ in drive.requests] == ["POST", "PUT", "PUT", "PUT", "PUT"]
+
+        result = client.upload_file(str(empty), None, chunk_size=chunk, multipart_max=0)
+        assert drive.files[result["id"]]["content"] == b""
+        out = client.download_file(result["id"], str(tmp_path / "empty.out"))
+        assert out["size"] == 0 and (tmp_path / "empty.out").read_bytes() == b""
+
+
+@pytest.mark.asyncio
+async def test_backlog_of_large_files_leaves_room_for_small_ones():
+    import threading
+
+    release = threading.Event()
+
+    class Blocking(TransferScheduler):
+        def _run_sync(self, t, cancel=None, sessions=None, on_progress=None):
+            if t.size >= self.large_threshold:
+                release.wait(5)
+            return {"id": t.local_path}
+
+    sched = Blocking(None, workers=2, large_workers=1, large_threshold=100)
+    jobs = [Transfer("upload", f"large{i}", size=1000) for i in range(6)]
+    jobs += [Transfer("upload", f"small{i}", size=1) for i in range(2)]
+    finished = []
+    try:
+        async with asyncio.timeout(2):
+            async for t in sched.run(jobs):
+                finished.append(t.local_path)
+                if len(finished) == 2:
+                    break
+    finally:
+        release.set()
+        sched.shutdown()
+    assert finished == ["small0", "small1"]
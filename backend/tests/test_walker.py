@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from app.utils import compile_exclusions
+from app.walker import sort_key, walk_batches, walk_files
+
+
+def _tree(root: Path):
+    for rel in ["b.txt", "a/x.txt", "a/node_modules/dep.js", "a.txt", "c/d/e.log", "c/d/f.txt"]:
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(rel)
+
+
+def test_walk_files_sorted_and_pruned(tmp_path: Path):
+    _tree(tmp_path)
+    matcher = compile_exclusions(["**/node_modules/**", "*.log"])
+    paths = [f.path for f in walk_files([str(tmp_path)], matcher)]
+    rel = [os.path.relpath(p, tmp_path).replace(os.sep, "/") for p in paths]
+    assert rel == ["a/x.txt", "a.txt", "b.txt", "c/d/f.txt"]
+    assert paths == sorted(paths, key=sort_key)
+
+
+@pytest.mark.asyncio
+async def test_walk_batches_streams(tmp_path: Path):
+    _tree(tmp_path)
+    batches = [b async for b in walk_batches([str(tmp_path)], compile_exclusions([]), batch_size=2, max_pending=1)]
+    assert [len(b) for b in batches] == [2, 2, 2]
+
+    # Closing the consumer early must not leave the walker thread blocked.
+    agen = walk_batches([str(tmp_path)], compile_exclusions([]), batch_size=1, max_pending=1)
+    first = await agen.__anext__()
+    await agen.aclose()
+    assert len(first) == 1
+
+
+def test_walk_files_resumes_after_checkpoint(tmp_path: Path):
+    _tree(tmp_path)
+    matcher = compile_exclusions([])
+    full = [f.path for f in walk_files([str(tmp_path)], matcher)]
+    for i, checkpoint in enumerate(full):
+        rest = [f.path for f in walk_files([str(tmp_path)], matcher, start_after=checkpoint)]
+        assert rest == full[i + 1 :]
+
+
+def test_walk_files_skips_directory_symlinks(tmp_path: Path):
+    _tree(tmp_path)
+    (tmp_path / "loop").symlink_to(tmp_path, target_is_directory=True)
+    (tmp_path / "b-link.txt").symlink_to(tmp_path / "b.txt")
+    rel = [os.path.relpath(f.path, tmp_path) for f in walk_files([str(tmp_path)], compile_exclusions([]))]
+    assert "loop" not in rel and not any(r.startswith("loop" + os.sep) for r in rel)
+    assert "b-link.txt" in rel
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from watchdog.events import DirModifiedEvent, DirMovedEvent, FileClosedNoWriteEvent, FileCreatedEvent, FileModifiedEvent
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+from app.db import AsyncSessionLocal, Base, engine
+from app.models import User
+from app.sync_engine import SyncEngine, SyncOptions
+from app.watcher import ChangeWatcher, coarsen
+
+
+class _NoObserver:
+    def schedule(self, *a, **kw):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def join(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_watcher_debounces_filters_and_coarsens(tmp_path):
+    root = str(tmp_path)
+    delivered = []
+
+    async def on_changes(paths):
+        delivered.append(sorted(paths))
+
+    w = ChangeWatcher([root], ["*.tmp"], on_changes, debounce=0.05, max_pending=4, observer_factory=_NoObserver)
+    await w.start()
+    try:
+        f = os.path.join(root, "a.txt")
+        for _ in range(20):
+            w.handler.dispatch(FileModifiedEvent(f))
+        w.handler.dispatch(FileCreatedEvent(os.path.join(root, "x.tmp")))
+        w.handler.dispatch(FileClosedNoWriteEvent(os.path.join(root, "read.txt")))
+        w.handler.dispatch(DirModifiedEvent(root))
+        w.handler.dispatch(DirMovedEvent(os.path.join(root, "old"), os.path.join(root, "new")))
+        await asyncio.sleep(0.2)
+        assert delivered == [sorted([f, os.path.join(root, "old"), os.path.join(root, "new")])]
+
+        delivered.clear()
+        w.add([os.path.join(root, "burst", f"f{i}") for i in range(10)] + [os.path.join(root, "b.txt")])
+        assert w.overflows == 1 and w.pending() <= 2
+        await asyncio.sleep(0.2)
+        assert delivered == [sorted([os.path.join(root, "b.txt"), os.path.join(root, "burst")])]
+    finally:
+        await w.stop()
+
+
+class _FailingObserver(_NoObserver):
+    stopped = False
+
+    def start(self):
+        raise OSError(28, "inotify watch limit reached")
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.mark.asyncio
+async def test_watcher_scans_roots_it_cannot_watch(tmp_path):
+    delivered = []
+    observers = []
+
+    async def on_changes(paths):
+        delivered.append(paths)
+
+    def factory():
+        observers.append(_FailingObserver())
+        return observers[-1]
+
+    w = ChangeWatcher([str(tmp_path)], [], on_changes, debounce=0.01, observer_factory=factory)
+    await w.start()
+    try:
+        await asyncio.sleep(0.1)
+        assert delivered == [[str(tmp_path)]] and observers[0].stopped
+    finally:
+        await w.stop()
+
+
+def test_coarsen_stops_at_roots():
+    paths = [f"/r/a/b/{i}" for i in range(5)] + ["/r/c.txt", "/s/d.txt"]
+    assert coarsen(paths, ["/r", "/s"], 3) == ["/r/a/b", "/r/c.txt", "/s/d.txt"]
+    assert coarsen(paths, ["/r", "/s"], 2) == ["/r", "/s"]
+    assert coarsen(["/r/x", "/r/x/y"], ["/r"], 5) == ["/r/x"]
+
+
+@pytest.mark.asyncio
+async def test_sync_changes_touches_only_changed_paths(tmp_path):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as s:
+        user = User(google_sub=f"watch-{uuid.uuid4()}", email="w@example.com")
+        s.add(user)
+        await s.commit()
+    for d in ("keep", "gone", "moved"):
+        (tmp_path / d).mkdir()
+        for i in range(3):
+            (tmp_path / d / f"{i}.txt").write_text(f"{d}{i}")
+    eng = SyncEngine()
+    assert await eng.start("oneway", [str(tmp_path)], [], SyncOptions(), user_id=user.id)
+
+    (tmp_path / "keep" / "0.txt").write_text("edited")
+    (tmp_path / "keep" / "new.txt").write_text("new")
+    for i in range(3):
+        (tmp_path / "gone" / f"{i}.txt").unlink()
+    (tmp_path / "gone").rmdir()
+    os.rename(tmp_path / "moved", tmp_path / "renamed")
+    changed = [tmp_path / "keep" / "0.txt", tmp_path / "keep" / "new.txt", tmp_path / "gone", tmp_path / "moved", tmp_path / "renamed"]
+    assert await eng.sync_changes([str(p) for p in changed], [], SyncOptions(), user.id)
+    assert eng.status()["scanned"] == 5
+    assert (eng.status()["changed"], eng.status()["removed"]) == (5, 6)
+
+    # A full pass afterwards finds nothing left to do.
+    full = SyncEngine()
+    assert await full.start("oneway", [str(tmp_path)], [], SyncOptions(), user_id=user.id)
+    assert (full.status()["changed"], full.status()["removed"], full.status()["skipped"]) == (0, 0, 7)
+
+    # Errors are per call, not accumulated over the life of the watcher.
+    unreadable = str(tmp_path / ("x" * 5000))
+    for _ in range(3):
+        assert await eng.sync_changes([unreadable], [], SyncOptions(), user.id)
+        assert len(eng.status()["errors"]) == 1
+    assert await eng.sync_changes([str(tmp_path / "keep")], [], SyncOptions(), user.id)
+    assert eng.status()["errors"] == []
+
+
+@pytest.mark.asyncio
+async def test_watcher_reconciles_roots_periodically(tmp_path):
+    delivered = []
+
+    async def on_changes(paths):
+        delivered.append(paths)
+
+    w = ChangeWatcher([str(tmp_path)], [], on_changes, debounce=0.01, reconcile=0.05, observer_factory=_NoObserver)
+    await w.start()
+    try:
+        await asyncio.sleep(0.2)
+        assert w.reconciles >= 2 and delivered[0] == [str(tmp_path)]
+    finally:
+        await w.stop()
+
+
+@pytest.mark.asyncio
+async def test_continuous_sync_uploads_changed_files(tmp_path):
+    from google.auth.credentials import AnonymousCredentials
+
+    from app.db import ReadSessionLocal
+    from app.file_index import load_index
+    from app.google_drive import FOLDER_MIME, GoogleDriveClient
+    from app.transfers import TransferScheduler
+    from app.watcher import ContinuousSync
+    from fake_drive import FakeDrive
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as s:
+        user = User(google_sub=f"live-{uuid.uuid4()}", email="w@example.com")
+        s.add(user)
+        await s.commit()
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    with FakeDrive() as drive:
+        client = GoogleDriveClient(AnonymousCredentials(), api_endpoint=drive.endpoint, retries=0)
+        root = drive.add_file("backup", mime=FOLDER_MIME)["id"]
+        live = ContinuousSync(
+            user.id,
+            [str(src)],
+            [],
+            SyncOptions(remote_root=root),
+            transfers=TransferScheduler(client, workers=1, large_workers=1),
+            observer_factory=_NoObserver,
+        )
+        (src / "sub" / "new.txt").write_text("fresh")
+        await live.apply([str(src / "sub" / "new.txt")])
+        by_name = {f["name"]: f for f in drive.files.values()}
+        assert by_name["new.txt"]["content"] == b"fresh"
+        assert by_name["sub"]["parents"] == [by_name["src"]["id"]]
+        async with ReadSessionLocal() as s:
+            entry = (await load_index(s, user.id))[str(src / "sub" / "new.txt")]
+        assert entry.remote_id == by_name["new.txt"]["id"] and entry.synced_sha256 == entry.sha256
+        await live.stop()
@@ -0,0 +1,88 @@
+import asyncio
+
+import orjson
+import pytest
+
+from app.ws import Connection, ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, stall: bool = False):
+        self.stall = stall
+        self.sent: list[str] = []
+        self.got = asyncio.Event()
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        if self.stall:
+            await asyncio.sleep(3600)
+        self.sent.append(data)
+        self.got.set()
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_broadcast_reaches_fast_clients_despite_slow_ones():
+    manager = ConnectionManager(send_timeout=0.2)
+    sockets = [FakeSocket(stall=i % 10 == 0) for i in range(1000)]
+    for s in sockets:
+        await manager.connect(s)
+    fast = [s for s in sockets if not s.stall]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await manager.broadcast({"type": "power_countdown", "job_id": "j", "seconds": 10})
+    await asyncio.wait_for(asyncio.gather(*(s.got.wait() for s in fast)), 1)
+    assert loop.time() - started < 1
+    assert all(s.sent == [fast[0].sent[0]] for s in fast)
+    assert orjson.loads(fast[0].sent[0])["seconds"] == 10
+
+    # Stalled clients hit the send timeout and are dropped.
+    await asyncio.sleep(0.4)
+    assert len(manager.active) == len(fast)
+    assert all(s.closed for s in sockets if s.stall)
+    for s in fast:
+        await manager.disconnect(s)
+
+
+@pytest.mark.asyncio
+async def test_connection_queue_drops_oldest_and_coalesces():
+    conn = Connection(FakeSocket(), maxsize=3)
+    for i in range(5):
+        conn.push(str(i))
+    assert [p for _, p in conn.pending] == ["2", "3", "4"]
+    assert conn.dropped == 2
+
+    conn = Connection(FakeSocket(), maxsize=3)
+    conn.push("a")
+    conn.push("c1", key="countdown")
+    conn.push("c2", key="countdown")
+    assert [p for _, p in conn.pending] == ["a", "c2"]
+
+
+def test_notifications_keep_clients_that_never_answer_pings(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api import notifications
+    from app.security import AuthUser
+
+    async def user(ws):
+        return AuthUser("tester", 1)
+
+    monkeypatch.setattr(notifications, "PING_INTERVAL", 0.05)
+    monkeypatch.setattr(notifications, "websocket_user", user)
+    app = FastAPI()
+    app.include_router(notifications.router)
+    with TestClient(app).websocket_connect("/ws/notifications") as ws:
+        # Far past two intervals without a reply, the connection is still served.
+        for _ in range(5):
+            assert ws.receive_json() == {"type": "ping"}
+        ws.send_text("ping")
+        # A ping may already be queued ahead of the reply.
+        assert {"type": "pong"} in [ws.receive_json() for _ in range(2)]